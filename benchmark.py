@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from modules.buffer import DataBuffer
+from modules.editor import HexEditor
+from modules.filemodel import FileModel
+from modules.pagecache import DEFAULT_CACHE_SIZE
+
+# байты, которые ищет поиск с вхождением, лежат на 3/4 файла
+MARKER = b'HEX_EDITOR_BENCHMARK_MARKER'
+MISSING = b'HEX_EDITOR_BENCHMARK_MISSING'
+# столько байт читается за раз, примерно один экран редактора
+READ_SIZE = 16 * 64
+# в разреженном файле данные есть только в одном блоке из SPARSE_STRIDE
+SPARSE_STRIDE = 64 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+EDIT_SIZE = 8
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(value: str) -> int:
+    """Размер вида 512K, 1M, 10G или число байт"""
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+
+    return int(value)
+
+
+def generate_file(filename: str, size: int, sparse: bool,
+                  rng: random.Random) -> int:
+    """Создает файл размера size со случайными данными. В разреженном файле
+    данные записаны блоками через SPARSE_STRIDE байт, а между ними дыры.
+    Возвращает смещение MARKER в файле"""
+    block = rng.randbytes(BLOCK_SIZE)
+    stride = SPARSE_STRIDE if sparse else BLOCK_SIZE
+    with open(filename, 'wb') as fp:
+        fp.truncate(size)
+        for offset in range(0, size, stride):
+            fp.seek(offset)
+            fp.write(block[:size - offset])
+        marker_offset = max(size * 3 // 4 - len(MARKER), 0)
+        fp.seek(marker_offset)
+        fp.write(MARKER[:size - marker_offset])
+
+    return marker_offset
+
+
+class Benchmarks:
+    """Набор замеров для одного сгенерированного файла. Каждый замер
+    возвращает функцию без аргументов, время работы которой измеряется,
+    а также количество операций и обработанных байт"""
+
+    def __init__(self, filename: str, size: int, operations: int, seed: int,
+                 use_mmap=False, cache_size=DEFAULT_CACHE_SIZE):
+        self.filename = filename
+        self.size = size
+        self.operations = operations
+        self.use_mmap = use_mmap
+        self.cache_size = cache_size
+        self._rng = random.Random(seed)
+
+    def _offsets(self, margin: int) -> list:
+        """Случайные смещения, по которым можно выполнить все операции,
+        даже если файл уменьшится на margin байт"""
+        limit = max(self.size - margin, 1)
+        return [self._rng.randrange(limit) for _ in range(self.operations)]
+
+    def filemodel_insert(self):
+        model = FileModel(self.size)
+        offsets = self._offsets(0)
+        data = b'\xaa' * EDIT_SIZE
+
+        def run():
+            for offset in offsets:
+                model.insert(offset, data)
+
+        return run, self.operations, self.operations * EDIT_SIZE
+
+    def filemodel_remove(self):
+        model = FileModel(self.size)
+        offsets = self._offsets(EDIT_SIZE * (self.operations + 1))
+
+        def run():
+            for offset in offsets:
+                model.remove(offset, EDIT_SIZE)
+
+        return run, self.operations, self.operations * EDIT_SIZE
+
+    def filemodel_replace(self):
+        model = FileModel(self.size)
+        offsets = self._offsets(EDIT_SIZE)
+        data = b'\xaa' * EDIT_SIZE
+
+        def run():
+            for offset in offsets:
+                model.replace(offset, data)
+
+        return run, self.operations, self.operations * EDIT_SIZE
+
+    def read_random(self):
+        return self._read(self._offsets(READ_SIZE))
+
+    def read_sequential(self):
+        steps = max(self.size // READ_SIZE, 1)
+        return self._read([i % steps * READ_SIZE
+                           for i in range(self.operations)])
+
+    def _read(self, offsets: list):
+        def run():
+            with open(self.filename, 'rb') as fp:
+                buffer = DataBuffer(FileModel(self.size), fp, self.use_mmap,
+                                    self.cache_size)
+                for offset in offsets:
+                    buffer.read_nbytes(offset, READ_SIZE)
+                buffer.unmap()
+
+        return run, self.operations, self.operations * READ_SIZE
+
+    def search_hit(self):
+        return self._search(MARKER)
+
+    def search_miss(self):
+        return self._search(MISSING)
+
+    def _search(self, query: bytes):
+        editor = self._editor(is_readonly=True)
+
+        def run():
+            editor.search(query)
+
+        return run, 1, self.size
+
+    def save_in_place(self):
+        editor = self._editor()
+        self._edit(editor)
+
+        def run():
+            editor.save_changes(self.filename)
+
+        return run, self.operations, self.size
+
+    def save_in_place_shifted(self):
+        """Сохранение после вставки в середину файла, когда вторую половину
+        файла нужно сдвинуть"""
+        editor = self._editor()
+        editor.insert(self.size // 2, b'\xaa' * EDIT_SIZE)
+
+        def run():
+            editor.save_changes(self.filename)
+            # возвращаем файлу исходный размер для следующих замеров
+            editor.remove(self.size // 2, EDIT_SIZE)
+            editor.save_changes(self.filename)
+
+        return run, 1, self.size
+
+    def save_as(self):
+        editor = self._editor()
+        self._edit(editor)
+        filename = self.filename + '.out'
+
+        def run():
+            editor.save_changes(filename)
+            os.remove(filename)
+
+        return run, self.operations, self.size
+
+    def compare(self):
+        """Сравнение измененного файла с сохраненным"""
+        editor = self._editor(is_readonly=True)
+        self._edit(editor)
+
+        def run():
+            editor.compare()
+
+        return run, 1, self.size
+
+    def crc32_after_edit(self):
+        """Пересчет crc32 всего файла после каждой правки, суммы кусков
+        исходного файла уже посчитаны"""
+        editor = self._editor(is_readonly=True)
+        editor.checksums(algorithms=('crc32',))
+        offsets = self._offsets(EDIT_SIZE)
+        data = b'\xbb' * EDIT_SIZE
+
+        def run():
+            for offset in offsets:
+                editor.replace(offset, data)
+                editor.checksums(algorithms=('crc32',))
+
+        return run, self.operations, self.operations * EDIT_SIZE
+
+    def _editor(self, is_readonly=False) -> HexEditor:
+        return HexEditor(self.filename, is_readonly, self.use_mmap,
+                         self.cache_size, prefetch_screens=0)
+
+    def _edit(self, editor: HexEditor) -> None:
+        data = b'\xbb' * EDIT_SIZE
+        for offset in self._offsets(EDIT_SIZE):
+            editor.replace(offset, data)
+
+
+BENCHMARKS = ['filemodel_insert', 'filemodel_remove', 'filemodel_replace',
+              'read_random', 'read_sequential', 'search_hit', 'search_miss',
+              'save_in_place', 'save_in_place_shifted', 'save_as', 'compare',
+              'crc32_after_edit']
+
+
+def measure(benchmark, repeat: int) -> dict:
+    """Запускает замер repeat раз и возвращает лучшее и медианное время"""
+    times = []
+    operations = processed = 0
+    for _ in range(repeat):
+        run, operations, processed = benchmark()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+
+    return {
+        'operations': operations,
+        'bytes': processed,
+        'seconds': best,
+        'median_seconds': statistics.median(times),
+        'operations_per_second': operations / best if best else None,
+        'bytes_per_second': processed / best if best else None,
+    }
+
+
+def run_benchmarks(sizes: list, sparse_modes=(False,), operations=1000,
+                   repeat=3, seed=0, directory=None, use_mmap=False,
+                   cache_size=DEFAULT_CACHE_SIZE, names=None) -> dict:
+    """Генерирует файлы всех размеров sizes и выполняет на них замеры
+    с именами names (по умолчанию все из BENCHMARKS). Возвращает отчет,
+    который можно записать в JSON"""
+    names = BENCHMARKS if names is None else names
+    results = []
+    for size in sizes:
+        for sparse in sparse_modes:
+            fd, filename = tempfile.mkstemp(prefix='hex_editor_bench_',
+                                            dir=directory)
+            os.close(fd)
+            try:
+                generate_file(filename, size, sparse, random.Random(seed))
+                benchmarks = Benchmarks(filename, size, operations, seed,
+                                        use_mmap, cache_size)
+                for name in names:
+                    result = {'benchmark': name, 'size': size,
+                              'sparse': sparse}
+                    result.update(measure(getattr(benchmarks, name), repeat))
+                    results.append(result)
+            finally:
+                os.remove(filename)
+
+    return {
+        'engine': 'hex_editor',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'operations': operations,
+            'repeat': repeat,
+            'seed': seed,
+            'mmap': use_mmap,
+            'cache_size': cache_size,
+            'read_size': READ_SIZE,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of the hex editor engine, '
+                    'results are printed as JSON')
+    parser.add_argument('-s', '--sizes', default='1M,64M',
+                        help='comma separated sizes of generated files, '
+                             'e.g. 1M,1G,10G')
+    parser.add_argument('--sparse', choices=['no', 'yes', 'both'],
+                        default='both', help='generate sparse files')
+    parser.add_argument('-n', '--operations', type=int, default=1000,
+                        help='number of edits and reads per benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of runs of each benchmark')
+    parser.add_argument('-b', '--benchmark', action='append',
+                        choices=BENCHMARKS,
+                        help='run only this benchmark, can be repeated')
+    parser.add_argument('-m', '--mmap', action='store_true',
+                        help='map files into memory instead of reading them')
+    parser.add_argument('-c', '--cache-size', type=int,
+                        default=DEFAULT_CACHE_SIZE // 1024 // 1024,
+                        help='size of the read cache in megabytes')
+    parser.add_argument('-d', '--directory',
+                        help='directory for generated files')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output',
+                        help='file for results instead of stdout')
+    args = parser.parse_args(sys.argv[1:])
+
+    sparse_modes = {'no': (False,), 'yes': (True,),
+                    'both': (False, True)}[args.sparse]
+    report = run_benchmarks(
+        [parse_size(size) for size in args.sizes.split(',')], sparse_modes,
+        args.operations, args.repeat, args.seed, args.directory, args.mmap,
+        args.cache_size * 1024 * 1024, args.benchmark)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
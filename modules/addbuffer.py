@@ -0,0 +1,176 @@
+import mmap
+import os
+import tempfile
+
+DEFAULT_MAX_MEMORY = 256 * 1024 * 1024
+
+
+class AddBuffer:
+    """Общее хранилище всех вставленных и замененных байт. Данные только
+    дописываются в конец, а измененные регионы хранят сдвиг и длину своих
+    данных в нем, поэтому разбиение и обрезка регионов не копируют данные.
+
+    Пока данных не больше max_memory байт, они лежат в памяти, затем
+    переносятся во временный файл в $TMPDIR, отображенный в память.
+    Буфер в памяти никогда не меняет размер: при росте данные копируются
+    в новый буфер вдвое больше, а старый живет, пока на него ссылаются
+    выданные memoryview.
+
+    Байты до frozen не перезаписываются: на них могут ссылаться снимки
+    регионов, которые читаются в фоне (см. FileModel.snapshot)"""
+
+    def __init__(self, max_memory: int = DEFAULT_MAX_MEMORY):
+        self.max_memory = max_memory
+        self._memory = bytearray()  # первые _size байт заняты данными
+        self._size = 0
+        self._file = None  # временный файл, когда данные не влезли в память
+        self._mmap = None
+        self._capacity = 0
+        self.frozen = 0
+
+    @property
+    def is_spilled(self) -> bool:
+        """Лежат ли данные во временном файле"""
+        return self._file is not None
+
+    @property
+    def filename(self) -> str:
+        """Путь к временному файлу с данными или None, пока они в памяти"""
+        return None if self._file is None else self._file.name
+
+    @property
+    def memory(self) -> int:
+        """Память, выделенная под данные, не считая отображенного файла"""
+        return len(self._memory)
+
+    def append(self, data) -> int:
+        """Дописывает data в конец и возвращает сдвиг, по которому они
+        лежат"""
+        offset = self._size
+        if self._file is None:
+            if offset + len(data) <= self.max_memory:
+                self._reserve_memory(offset + len(data))
+                self._memory[offset:offset + len(data)] = data
+                self._size += len(data)
+                return offset
+            self._spill()
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+        data = memoryview(data)
+        self._reserve(offset + len(data))
+        self._mmap[offset:offset + len(data)] = data
+        self._size += len(data)
+
+        return offset
+
+    def read(self, offset: int, count: int):
+        return self._storage()[offset:offset + count]
+
+    def view(self, offset: int, count: int) -> memoryview:
+        """Байты со сдвига offset без копирования. Дописывание в буфер
+        выданный memoryview не портит, но write меняет байты, которые
+        он показывает"""
+        return memoryview(self._storage())[offset:offset + count]
+
+    def write(self, offset: int, data) -> None:
+        """Перезаписывает байты со сдвига offset. Можно вызывать только для
+        байт, которые принадлежат одному региону"""
+        self._storage()[offset:offset + len(data)] = data
+
+    def freeze(self) -> None:
+        """Запрещает перезаписывать уже дописанные байты"""
+        self.frozen = self._size
+
+    def slice(self, offset: int, count: int):
+        """Байты со сдвига offset в виде, который можно передать в другой
+        процесс: SpilledSlice, если данные во временном файле, иначе копия"""
+        if self._file is None:
+            return bytes(self.view(offset, count))
+
+        return SpilledSlice(self._file.name, offset, count)
+
+    def close(self) -> None:
+        """Освобождает память и удаляет временный файл"""
+        self._memory = bytearray()
+        self._size = 0
+        self._drop_mmap()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._capacity = 0
+        self.frozen = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _storage(self):
+        return self._memory if self._file is None else self._mmap
+
+    def _spill(self) -> None:
+        """Переносит данные из памяти во временный файл"""
+        self._file = tempfile.NamedTemporaryFile(prefix='hex_editor_edits_')
+        self._reserve(max(self._size, mmap.ALLOCATIONGRANULARITY))
+        self._mmap[:self._size] = memoryview(self._memory)[:self._size]
+        self._memory = bytearray()
+
+    def _reserve_memory(self, size: int) -> None:
+        """Заменяет буфер в памяти буфером, в котором поместится size
+        байт. Размер буфера на месте не меняется, потому что на него могут
+        ссылаться memoryview"""
+        if size <= len(self._memory):
+            return
+        memory = bytearray(min(max(size, len(self._memory) * 2),
+                               self.max_memory))
+        memory[:self._size] = memoryview(self._memory)[:self._size]
+        self._memory = memory
+
+    def _reserve(self, size: int) -> None:
+        """Увеличивает временный файл так, чтобы в нем поместилось size
+        байт. Размер растет в два раза, чтобы отображение пересоздавалось
+        редко"""
+        if size <= self._capacity:
+            return
+        capacity = max(size, self._capacity * 2)
+        os.ftruncate(self._file.fileno(), capacity)
+        self._drop_mmap()
+        self._mmap = mmap.mmap(self._file.fileno(), capacity)
+        self._capacity = capacity
+
+    def _drop_mmap(self) -> None:
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # на отображение еще ссылаются выданные memoryview,
+                # оно закроется, когда они будут освобождены
+                pass
+            self._mmap = None
+
+
+class SpilledSlice:
+    """length байт временного файла AddBuffer со сдвига offset. Передается
+    в другие процессы вместо самих байт, которые там читаются из файла"""
+
+    __slots__ = ('filename', 'offset', 'length')
+
+    def __init__(self, filename: str, offset: int, length: int):
+        self.filename = filename
+        self.offset = offset
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index: slice) -> 'SpilledSlice':
+        start, stop, _ = index.indices(self.length)
+        return SpilledSlice(self.filename, self.offset + start,
+                            max(stop - start, 0))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SpilledSlice) and \
+            (self.filename, self.offset, self.length) == \
+            (other.filename, other.offset, other.length)
+
+    def __repr__(self):
+        return f'SpilledSlice({self.filename!r}, {self.offset}, ' \
+               f'{self.length})'
@@ -0,0 +1,239 @@
+import bisect
+import os
+import re
+from array import array
+
+from modules.search import BackgroundSearch, PieceReader, \
+    map_in_processes, shard_pieces, DEFAULT_CHUNK_SIZE, DEFAULT_SHARD_SIZE
+
+# совпадающие байты внутри отличающихся участков занимают меньше
+# DIFF_GRANULARITY байт подряд, это одна строка редактора
+DIFF_GRANULARITY = 16
+_EQUAL_RUN = re.compile(b'\\x00{%d,}' % DIFF_GRANULARITY)
+
+
+class DiffRanges:
+    """Компактный список участков [начало; конец), в которых два файла
+    отличаются, если сравнивать байты с одинаковыми смещениями. Внутри
+    участка могут быть совпадающие байты (меньше DIFF_GRANULARITY подряд),
+    но участки начинаются и заканчиваются отличающимися байтами"""
+
+    def __init__(self, first_size: int = 0, second_size: int = 0):
+        self.first_size = first_size
+        self.second_size = second_size
+        self.starts = array('q')
+        self.ends = array('q')
+
+    def add(self, start: int, end: int) -> None:
+        """Добавляет участок после всех уже добавленных, соседние участки
+        склеиваются"""
+        if self.ends and self.ends[-1] == start:
+            self.ends[-1] = end
+        else:
+            self.starts.append(start)
+            self.ends.append(end)
+
+    @property
+    def differing_bytes(self) -> int:
+        return sum(self.ends) - sum(self.starts)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, index: int) -> tuple:
+        return self.starts[index], self.ends[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def next_after(self, offset: int) -> int:
+        """Номер первого участка, начинающегося после offset, или -1"""
+        index = bisect.bisect_right(self.starts, offset)
+        return index if index < len(self) else -1
+
+    def prev_before(self, offset: int) -> int:
+        """Номер последнего участка, начинающегося раньше offset, или -1"""
+        return bisect.bisect_left(self.starts, offset) - 1
+
+    def overlapping(self, start: int, end: int) -> list:
+        """Участки, пересекающиеся с [start; end), обрезанные по нему"""
+        index = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        result = []
+        while index < len(self) and self.starts[index] < end:
+            if self.ends[index] > start:
+                result.append((max(self.starts[index], start),
+                               min(self.ends[index], end)))
+            index += 1
+
+        return result
+
+
+def diff_ranges(read_first, first_size: int, read_second, second_size: int,
+                start: int = 0, end: int = None,
+                chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Генератор участков [начало; конец) из [start; end), в которых
+    отличаются файлы, читаемые функциями read_first и read_second
+    (read(offset, count)). Файлы читаются кусками по chunk_size байт,
+    совпадающие куски отсеиваются одним сравнением, а в отличающихся
+    отличия ищутся за один проход xor (см. _chunk_ranges). Если файлы разной
+    длины, хвост длинного файла считается отличающимся. Участки, идущие
+    вплотную, склеиваются"""
+    end = max(first_size, second_size) if end is None else end
+    common = min(first_size, second_size, end)
+    run_start = run_end = None
+    position = max(start, 0)
+    while position < common:
+        chunk_end = min(position + chunk_size, common)
+        first = read_first(position, chunk_end - position)
+        second = read_second(position, chunk_end - position)
+        if first != second:
+            for range_start, range_end in _chunk_ranges(
+                    memoryview(first), memoryview(second), position):
+                if range_start == run_end:
+                    run_end = range_end
+                    continue
+                if run_start is not None:
+                    yield run_start, run_end
+                run_start, run_end = range_start, range_end
+        position = chunk_end
+    tail_start = max(common, start)
+    tail_end = min(max(first_size, second_size), end)
+    if tail_start < tail_end:
+        if tail_start == run_end:
+            run_end = tail_end
+        else:
+            if run_start is not None:
+                yield run_start, run_end
+            run_start, run_end = tail_start, tail_end
+    if run_start is not None:
+        yield run_start, run_end
+
+
+def compare(read_first, first_size: int, read_second, second_size: int,
+            start: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE) \
+        -> DiffRanges:
+    """Все отличающиеся участки двух файлов (см. diff_ranges)"""
+    ranges = DiffRanges(first_size, second_size)
+    for range_start, range_end in diff_ranges(read_first, first_size,
+                                              read_second, second_size,
+                                              start, None, chunk_size):
+        ranges.add(range_start, range_end)
+
+    return ranges
+
+
+def parallel_compare(filename: str, layout: list, size: int,
+                     other_filename: str, other_size: int,
+                     workers: int = None,
+                     shard_size: int = DEFAULT_SHARD_SIZE,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     progress=None) -> DiffRanges:
+    """То же, что compare, но файл делится на куски по shard_size байт,
+    которые сравниваются в нескольких процессах. Первый файл описан
+    регионами layout (см. FileModel.snapshot с portable) поверх filename,
+    второй читается из other_filename целиком. После каждого куска
+    вызывается progress(конец куска), исключение из него останавливает
+    сравнение"""
+    starts = [piece[0] for piece in layout]
+    common = min(size, other_size)
+    ranges = DiffRanges(size, other_size)
+
+    def shards():
+        for shard_start in range(0, common, shard_size):
+            shard_end = min(shard_start + shard_size, common)
+            yield (filename, shard_pieces(layout, starts, shard_start,
+                                          shard_end),
+                   other_filename, other_size, shard_start, shard_end,
+                   chunk_size)
+
+    # участки на границах кусков склеиваются в DiffRanges.add
+    for index, shard_ranges in enumerate(
+            map_in_processes(_compare_shard, shards(), workers), 1):
+        if progress is not None:
+            progress(min(index * shard_size, common))
+        for range_start, range_end in shard_ranges:
+            ranges.add(range_start, range_end)
+    if common < max(size, other_size):
+        ranges.add(common, max(size, other_size))
+
+    return ranges
+
+
+class BackgroundCompare(BackgroundSearch):
+    """Сравнение снимка регионов файла с другим файлом в отдельном
+    потоке. Результат - DiffRanges"""
+
+    def __init__(self, filename: str, layout: list, size: int,
+                 other_filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 workers: int = 1, shard_size: int = DEFAULT_SHARD_SIZE):
+        super().__init__(filename, layout, size, b'', 0, chunk_size,
+                         workers, shard_size)
+        self.other_filename = other_filename
+
+    def _parallel_search(self, progress) -> DiffRanges:
+        return parallel_compare(
+            self._filename, self._layout, self.size, self.other_filename,
+            os.path.getsize(self.other_filename), self._workers,
+            self._shard_size, self._chunk_size, progress)
+
+    def _search(self, read) -> DiffRanges:
+        with open(self.other_filename, 'rb') as fp:
+            reader = _whole_file_reader(fp)
+            try:
+                return compare(read, self.size, reader.read,
+                               reader.size, 0, self._chunk_size)
+            finally:
+                reader.close()
+
+
+def _chunk_ranges(first: memoryview, second: memoryview, offset: int):
+    """Отличающиеся участки двух кусков одинаковой длины. Куски
+    сравниваются побайтно одним xor больших чисел, совпадающие байты дают
+    в нем нули, а участки разделяют серии из DIFF_GRANULARITY и больше
+    нулей, которые ищет регулярное выражение. Так работа на Python
+    пропорциональна числу участков, а не числу отличающихся байт"""
+    length = len(first)
+    xor = (int.from_bytes(first, 'big')
+           ^ int.from_bytes(second, 'big')).to_bytes(length, 'big')
+    start = 0
+    for equal in _EQUAL_RUN.finditer(xor):
+        yield from _trimmed_range(xor, start, equal.start(), offset)
+        start = equal.end()
+    yield from _trimmed_range(xor, start, length, offset)
+
+
+def _trimmed_range(xor: bytes, start: int, end: int, offset: int):
+    """Участок [start; end) xor без нулей по краям, если в нем есть
+    отличающиеся байты"""
+    part = xor[start:end]
+    head = len(part) - len(part.lstrip(b'\x00'))
+    if head < len(part):
+        tail = len(part) - len(part.rstrip(b'\x00'))
+        yield offset + start + head, offset + end - tail
+
+
+def _whole_file_reader(fp) -> PieceReader:
+    """PieceReader для файла без изменений"""
+    size = os.fstat(fp.fileno()).st_size
+    reader = PieceReader(fp, [(0, size, 0, None)] if size else [])
+    reader.size = size
+
+    return reader
+
+
+def _compare_shard(filename: str, pieces: list, other_filename: str,
+                   other_size: int, shard_start: int, shard_end: int,
+                   chunk_size: int) -> list:
+    """Отличающиеся участки в [shard_start; shard_end). Выполняется
+    в отдельном процессе"""
+    with open(filename, 'rb') as fp, open(other_filename, 'rb') as other:
+        reader = PieceReader(fp, pieces)
+        other_reader = _whole_file_reader(other)
+        try:
+            return list(diff_ranges(reader.read, shard_end, other_reader.read,
+                                    other_size, shard_start, shard_end,
+                                    chunk_size))
+        finally:
+            reader.close()
+            other_reader.close()
@@ -1,53 +1,171 @@
+import mmap
+import os
+
 from modules.filemodel import FileRegion, EditedFileRegion, FileModel
+from modules.pagecache import PageCache
 
 
 class DataBuffer:
-    def __init__(self, file_model: FileModel, fp):
+    def __init__(self, file_model: FileModel, fp, use_mmap=False,
+                 cache_size=0):
         self._buffer_max_length = 16 * 16 * 4
-        self.buffer = []
+        self.buffer = bytearray()
 
         self._file_model = file_model
         self._initial_region: FileRegion = None
         self._current_region: FileRegion = None
 
         self._fp = fp
+        self._use_mmap = use_mmap
+        self._mmap = None
+        if use_mmap:
+            self.remap()
+        # при отображении в память кэшированием занимается ОС
+        self.cache = PageCache(fp, cache_size) \
+            if cache_size and not use_mmap else None
 
         self.offset: int = 0
+        self.stats = None  # EngineStats, если статистика включена
+
+    def invalidate(self) -> None:
+        """Сбрасывает все, что было прочитано из исходного файла. Нужно
+        вызывать после того, как файл был изменен на диске"""
+        if self.cache is not None:
+            self.cache.clear()
+        self.remap()
+
+    def remap(self) -> None:
+        """Заново отображает исходный файл в память. Нужно вызывать после
+        того, как файл был изменен на диске"""
+        self.unmap()
+        if not self._use_mmap:
+            return
+        if os.fstat(self._fp.fileno()).st_size:
+            # пустой файл отобразить в память нельзя
+            self._mmap = mmap.mmap(self._fp.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
 
-    def read_nbytes(self, offset: int, count: int) -> list:
+    def unmap(self) -> None:
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # на отображение еще ссылаются выданные memoryview,
+                # оно закроется, когда они будут освобождены
+                pass
+            self._mmap = None
+
+    def read_nbytes(self, offset: int, count: int) -> bytearray:
         """Возвращает count байт текущего состояния файла со смещения offset
         и записывает их в буффер"""
         # TODO
         # нужны какие-то оптимизации, чтобы не считывать все заново в буффер,
         # если это возможно
-        self.buffer = []
+        self.buffer = bytearray(max(count, 0))
         self.offset = offset
+        if count <= 0:
+            return self.buffer
         self._initial_region = self._file_model.search_region(offset)
         self._current_region = self._initial_region
 
+        start = offset - self._current_region.start
         read_total = 0
         while read_total < count:  # read_total есть len(buffer)
-            start = max(0, offset - self._current_region.start)
             to_read = min(self._current_region.length - start, count - read_total)
             if isinstance(self._current_region, EditedFileRegion):
                 # текущий регион был изменен и лежит в памяти
-                self.buffer.extend(self._current_region.get_nbytes(start,
-                                                                   to_read))
+                data = self._current_region.get_nbytes(start, to_read)
             else:
                 # текущий регион лежит на диске
-                old_position = self._fp.tell()
-                self._fp.seek(self._current_region.original_start + start)
-                self.buffer.extend(self._fp.read(to_read))
-                self._fp.seek(old_position)
-            read_total += to_read
+                data = self._read_original(
+                    self._current_region.original_start + start, to_read)
+            self.buffer[read_total:read_total + to_read] = data
+            read_total += len(data)
+            start = 0
 
-            if self._current_region < offset + count - 1:
-                # идем к следующему региону
-                self._current_region = \
-                    self._file_model.file_regions[self._current_region.index + 1]
+            # идем к следующему региону
+            self._current_region = \
+                self._file_model.next_region(self._current_region)
+            if self._current_region is None:
+                break
+        del self.buffer[read_total:]
 
         return self.buffer
 
+    def read_view(self, offset: int, count: int) -> memoryview:
+        """Возвращает count байт со смещения offset в виде memoryview. Если
+        байты целиком лежат в одном неизмененном регионе и файл отображен
+        в память, данные не копируются. Такой memoryview действителен до
+        следующего сохранения файла"""
+        if self._mmap is not None and count > 0:
+            region = self._file_model.search_region(offset)
+            start = offset - region.start
+            if (not isinstance(region, EditedFileRegion)
+                    and start + count <= region.length):
+                return self._read_original(region.original_start + start,
+                                           count)
+
+        return memoryview(self.read_nbytes(offset, count))
+
+    def iter_chunks(self, start: int, end: int, chunk_size: int):
+        """Генератор memoryview с байтами [start; end) текущего состояния
+        файла. Каждый кусок не длиннее chunk_size и лежит целиком в одном
+        регионе, поэтому байты из отображенного файла и временного файла
+        правок не копируются. Куски действительны до следующего сохранения
+        файла"""
+        end = min(end, self._file_model.file_size)
+        if start >= end:
+            return
+        if chunk_size <= 0:
+            raise ValueError('chunk size must be positive')
+        position = None
+        for region in self._file_model.iter_regions(start):
+            position = region.start if position is None else position
+            if position >= end:
+                return
+            shift = max(start - position, 0)
+            stop = min(position + region.length, end) - position
+            position += region.length
+            is_edited = isinstance(region, EditedFileRegion)
+            while shift < stop:
+                count = min(chunk_size, stop - shift)
+                if is_edited:
+                    piece = region.view(shift, count)
+                elif self._mmap is not None:
+                    piece = self._read_original(
+                        region.original_start + shift, count)
+                elif self.cache is not None:
+                    # проход по файлу не должен вытеснить из кэша байты
+                    # на экране (см. PageCache.read_bulk)
+                    piece = memoryview(self.cache.read_bulk(
+                        region.original_start + shift, count))
+                else:
+                    piece = memoryview(os.pread(
+                        self._fp.fileno(), count,
+                        region.original_start + shift))
+                    if self.stats is not None:
+                        self.stats.count_read(
+                            len(piece), region.original_start + shift)
+                if not piece:
+                    # файл на диске оказался короче, чем ожидалось
+                    return
+                yield piece
+                shift += len(piece)
+
+    def _read_original(self, offset: int, count: int):
+        """Читает count байт исходного файла со смещения offset"""
+        if self._mmap is not None:
+            return memoryview(self._mmap)[offset:offset + count]
+        if self.cache is not None:
+            return self.cache.read(offset, count)
+        # читаем мимо буфера файлового объекта: сохранение на месте пишет
+        # в файл через дескриптор, и буфер остался бы устаревшим
+        data = os.pread(self._fp.fileno(), count, offset)
+        if self.stats is not None:
+            self.stats.count_read(len(data), offset)
+
+        return data
+
     @property
     def length(self):
         return len(self.buffer)
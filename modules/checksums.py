@@ -0,0 +1,294 @@
+import hashlib
+import os
+import zlib
+from array import array
+
+from modules.search import BackgroundSearch, SearchCancelled, \
+    clip_layout, DEFAULT_CHUNK_SIZE
+
+ALGORITHMS = ('crc32', 'md5', 'sha256')
+# crc32 исходного файла хранится по кускам такого размера: после правки
+# дочитывается не больше двух кусков на каждый неизмененный регион
+DEFAULT_TREE_CHUNK_SIZE = 64 * 1024
+# состояния md5 и sha256 исходного файла сохраняются через столько байт
+DEFAULT_CHECKPOINT_SIZE = 16 * 1024 * 1024
+
+# _zero_operators[k] - матрица над GF(2), которая переводит crc32 данных
+# в crc32 тех же данных, дополненных 2 ** k нулевыми байтами (см. zlib)
+_zero_operators = []
+
+
+def crc32_combine(first: int, second: int, second_length: int) -> int:
+    """crc32 склейки двух кусков по их crc32 и длине второго куска"""
+    power = 0
+    while second_length:
+        if second_length & 1:
+            first = _gf2_times(_zero_operator(power), first)
+        second_length >>= 1
+        power += 1
+
+    return first ^ second
+
+
+class ChunkTree:
+    """Дерево Меркла над crc32 кусков исходного файла: лист хранит crc32
+    куска, а узел - crc32 склейки кусков своих детей. crc32 любого
+    непрерывного ряда кусков собирается из O(log n) узлов"""
+
+    def __init__(self, crcs: array, lengths: array):
+        count = len(crcs)
+        self._count = count
+        self._crcs = array('L', [0]) * count + crcs
+        self._lengths = array('q', [0]) * count + lengths
+        for node in range(count - 1, 0, -1):
+            left, right = 2 * node, 2 * node + 1
+            self._crcs[node] = crc32_combine(self._crcs[left],
+                                             self._crcs[right],
+                                             self._lengths[right])
+            self._lengths[node] = self._lengths[left] + self._lengths[right]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def crc32(self, first: int, last: int) -> int:
+        """crc32 кусков с номерами из [first; last)"""
+        crc = 0
+        right = []
+        low, high = first + self._count, last + self._count
+        while low < high:
+            if low & 1:
+                crc = crc32_combine(crc, self._crcs[low], self._lengths[low])
+                low += 1
+            if high & 1:
+                high -= 1
+                right.append(high)
+            low //= 2
+            high //= 2
+        for node in reversed(right):
+            crc = crc32_combine(crc, self._crcs[node], self._lengths[node])
+
+        return crc
+
+
+class ChecksumCache:
+    """Контрольные суммы исходного файла размера size, посчитанные один раз
+    при первом обращении: дерево crc32 кусков по chunk_size байт
+    и состояния md5 и sha256 через каждые checkpoint_size байт. Исходный
+    файл читается функцией read(offset, count), которая передается в каждый
+    вызов, чтобы чтение можно было отменить"""
+
+    def __init__(self, size: int, chunk_size: int = DEFAULT_TREE_CHUNK_SIZE,
+                 checkpoint_size: int = DEFAULT_CHECKPOINT_SIZE):
+        self.size = size
+        self.chunk_size = chunk_size
+        # состояния сохраняются на границах кусков
+        self.checkpoint_size = max(checkpoint_size // chunk_size, 1) \
+            * chunk_size
+        self._tree = None
+        self._checkpoints = {}  # алгоритм -> состояния по порядку
+
+    def original_crc32(self, read, start: int, end: int) -> int:
+        """crc32 байт исходного файла из [start; end). Целые куски берутся
+        из дерева, дочитываются только неполные куски по краям"""
+        self.prepare(read, ('crc32',))
+        first = -(-start // self.chunk_size)
+        last = end // self.chunk_size
+        if first >= last:
+            return zlib.crc32(read(start, end - start))
+        crc = zlib.crc32(read(start, first * self.chunk_size - start))
+        middle_end = last * self.chunk_size
+        crc = crc32_combine(crc, self._tree.crc32(first, last),
+                            middle_end - first * self.chunk_size)
+        return zlib.crc32(read(middle_end, end - middle_end), crc)
+
+    def checkpoint(self, read, algorithm: str, offset: int) -> tuple:
+        """Пара (смещение, копия состояния algorithm после первых
+        смещение байт исходного файла) для ближайшей сохраненной точки
+        не дальше offset"""
+        self.prepare(read, (algorithm,))
+        states = self._checkpoints[algorithm]
+        index = min(offset // self.checkpoint_size, len(states) - 1)
+
+        return index * self.checkpoint_size, states[index].copy()
+
+    def is_prepared(self, algorithms=ALGORITHMS) -> bool:
+        """Посчитано ли уже все, что нужно для algorithms (см. prepare)"""
+        return not any(self._missing(algorithms))
+
+    def prepare(self, read, algorithms=ALGORITHMS) -> None:
+        """Считает за один проход по исходному файлу еще не посчитанные
+        дерево crc32 и состояния для algorithms"""
+        build_tree, states = self._missing(algorithms)
+        if not build_tree and not states:
+            return
+        crcs, lengths = array('L'), array('q')
+        hashes = {algorithm: algorithm_states[0].copy()
+                  for algorithm, algorithm_states in states.items()}
+        for offset in range(0, self.size, self.chunk_size):
+            chunk = read(offset, min(self.chunk_size, self.size - offset))
+            if build_tree:
+                crcs.append(zlib.crc32(chunk))
+                lengths.append(len(chunk))
+            checkpoint = (offset + len(chunk)) % self.checkpoint_size == 0
+            for algorithm, state in hashes.items():
+                state.update(chunk)
+                if checkpoint:
+                    states[algorithm].append(state.copy())
+        if build_tree:
+            self._tree = ChunkTree(crcs, lengths)
+        self._checkpoints.update(states)
+
+    def _missing(self, algorithms) -> tuple:
+        """Нужно ли строить дерево crc32 и словарь алгоритм -> список
+        с начальным состоянием для еще не посчитанных состояний"""
+        build_tree = self._tree is None and 'crc32' in algorithms
+        states = {algorithm: [hashlib.new(algorithm)]
+                  for algorithm in algorithms if algorithm != 'crc32'
+                  and algorithm not in self._checkpoints}
+
+        return build_tree, states
+
+
+def checksums(cache: ChecksumCache, layout: list, read, read_original,
+              start: int, end: int, algorithms=ALGORITHMS) -> dict:
+    """Контрольные суммы algorithms байт [start; end) файла, описанного
+    регионами layout (см. FileModel.layout), в виде шестнадцатеричных
+    строк. crc32 неизмененных регионов берется из cache, так что читаются
+    только измененные регионы и края неизмененных. md5 и sha256 нельзя
+    собрать из сумм кусков, поэтому они продолжаются с последнего
+    сохраненного состояния перед первым измененным или сдвинутым регионом.
+    read читает текущее состояние файла, read_original - исходный файл"""
+    # исходный файл читается один раз для всех сумм
+    cache.prepare(read_original, _prepared_algorithms(algorithms, start))
+    result = {}
+    for algorithm in algorithms:
+        if algorithm == 'crc32':
+            crc = _crc32(cache, layout, read_original, start, end)
+            result[algorithm] = f'{crc:08x}'
+        else:
+            result[algorithm] = _digest(cache, layout, read, read_original,
+                                        algorithm, start, end)
+
+    return result
+
+
+class BackgroundChecksums(BackgroundSearch):
+    """Подсчет контрольных сумм снимка регионов файла в отдельном потоке.
+    Результат - словарь, как у checksums. Если cache еще не посчитан,
+    сначала читается весь исходный файл, поэтому size и scanned считают
+    байты обоих проходов: исходного файла и [start; end)"""
+
+    def __init__(self, filename: str, layout: list, cache: ChecksumCache,
+                 start: int, end: int, algorithms=ALGORITHMS,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(filename, layout, end, b'', start, chunk_size)
+        self.end = end
+        self.algorithms = algorithms
+        self._cache = cache
+        self._prepared = _prepared_algorithms(algorithms, start)
+        self._prepare_size = 0 if cache.is_prepared(self._prepared) \
+            else cache.size
+        self.size = self._prepare_size + end - start
+
+    def _search(self, read) -> dict:
+        with open(self._filename, 'rb') as fp:
+            fd = fp.fileno()
+
+            def read_original(offset: int, count: int) -> bytes:
+                if self.cancelled:
+                    raise SearchCancelled
+                return os.pread(fd, count, offset)
+
+            def prepare_read(offset: int, count: int) -> bytes:
+                data = read_original(offset, count)
+                self.scanned = min(offset + count, self._prepare_size)
+                return data
+
+            self._cache.prepare(prepare_read, self._prepared)
+            self.scanned = self._prepare_size
+            return checksums(self._cache, self._layout, read, read_original,
+                             self.start_offset, self.end, self.algorithms)
+
+    def _read(self, read):
+        def read_and_track(offset: int, count: int):
+            if self.cancelled:
+                raise SearchCancelled
+            data = read(offset, count)
+            self.scanned = self._prepare_size + offset + count \
+                - self.start_offset
+            return data
+
+        return read_and_track
+
+
+def _prepared_algorithms(algorithms, start: int) -> list:
+    """Алгоритмы, для которых нужен ChecksumCache: состояния md5 и sha256
+    нужны, только если считать с начала файла"""
+    return [algorithm for algorithm in algorithms
+            if algorithm == 'crc32' or start == 0]
+
+
+def _crc32(cache: ChecksumCache, layout: list, read_original,
+           start: int, end: int) -> int:
+    crc = 0
+    for position, length, original_start, data in clip_layout(layout, start,
+                                                               end):
+        if data is None:
+            crc = crc32_combine(crc, cache.original_crc32(
+                read_original, original_start, original_start + length),
+                length)
+        else:
+            crc = zlib.crc32(data, crc)
+
+    return crc
+
+
+def _digest(cache: ChecksumCache, layout: list, read, read_original,
+            algorithm: str, start: int, end: int) -> str:
+    position = start
+    state = hashlib.new(algorithm)
+    if start == 0:
+        # до первого измененного региона файл совпадает с исходным
+        unchanged = 0
+        for piece_start, length, original_start, data in layout:
+            if data is not None or original_start != piece_start:
+                break
+            unchanged = piece_start + length
+        position, state = cache.checkpoint(read_original, algorithm,
+                                           min(unchanged, end))
+    while position < end:
+        count = min(cache.chunk_size, end - position)
+        state.update(read(position, count))
+        position += count
+
+    return state.hexdigest()
+
+
+def _zero_operator(power: int) -> list:
+    while len(_zero_operators) <= power:
+        if not _zero_operators:
+            # сдвиг на один нулевой бит, дальше каждый квадрат удваивает его
+            operator = [0xedb88320] + [1 << bit for bit in range(31)]
+            for _ in range(3):
+                operator = _gf2_square(operator)
+        else:
+            operator = _gf2_square(_zero_operators[-1])
+        _zero_operators.append(operator)
+
+    return _zero_operators[power]
+
+
+def _gf2_times(matrix: list, vector: int) -> int:
+    result = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[row]
+        vector >>= 1
+        row += 1
+
+    return result
+
+
+def _gf2_square(matrix: list) -> list:
+    return [_gf2_times(matrix, row) for row in matrix]
@@ -1,85 +1,377 @@
-import os.path
+import logging
+import os
+from modules import bindiff, checksums, patterns, prefetch, saveplan, \
+    search
+from modules.bindiff import BackgroundCompare, DiffRanges
+from modules.checksums import ALGORITHMS, BackgroundChecksums, \
+    ChecksumCache
+from modules.patterns import BackgroundPatternSearch, BytePattern
+from modules.search import BackgroundSearch
+from modules.signatures import BackgroundSignatureScan, SignatureHits, \
+    scan_signatures
+from modules.addbuffer import DEFAULT_MAX_MEMORY
 from modules.buffer import DataBuffer
+from modules.pagecache import DEFAULT_CACHE_SIZE
+from modules.saveplan import SavePlan
+from modules.stats import EngineStats, dump_json, log_stats, timed
 from modules.filemodel import FileModel, FileRegion, EditedFileRegion
 
 
 class HexEditor:
-    def __init__(self, filename: str, is_readonly=False):
+    def __init__(self, filename: str, is_readonly=False, use_mmap=False,
+                 cache_size=DEFAULT_CACHE_SIZE,
+                 edit_memory=DEFAULT_MAX_MEMORY,
+                 prefetch_screens=prefetch.DEFAULT_SCREENS):
         self.filename = filename
         if is_readonly:
             self._fp = open(filename, 'rb')
         else:
             self._fp = open(filename, 'r+b')
-        self._model = FileModel(os.path.getsize(filename))
-        self._buffer = DataBuffer(self._model, self._fp)
+        self._edit_memory = edit_memory
+        self._model = FileModel(os.path.getsize(filename), edit_memory)
+        self._buffer = DataBuffer(self._model, self._fp, use_mmap,
+                                  cache_size)
+        # при последовательном чтении следующие prefetch_screens кусков
+        # читаются заранее в отдельном потоке, 0 отключает чтение наперед
+        self._prefetcher = prefetch.Prefetcher(
+            self._fp.fileno(), self._buffer.cache, prefetch_screens) \
+            if prefetch_screens > 0 else None
 
-        self.__chunk_size = 1024
+        self.save_chunk_size = saveplan.DEFAULT_CHUNK_SIZE
+        self.search_chunk_size = search.DEFAULT_CHUNK_SIZE
+        # при search_workers > 1 поиск в больших файлах идет в нескольких
+        # процессах, каждый из которых обрабатывает свой кусок файла
+        self.search_workers = 1
+        self.search_shard_size = search.DEFAULT_SHARD_SIZE
+        self.stats: EngineStats = None  # см. enable_stats
+        # суммы кусков исходного файла, считаются при первом обращении
+        self._checksum_cache: ChecksumCache = None
 
+    @timed
     def get_nbytes(self, offset: int, count: int) -> bytes:
-        return bytes(self._buffer.read_nbytes(offset, count))
+        data = bytes(self._buffer.read_nbytes(offset, count))
+        if self._prefetcher is not None:
+            self._prefetcher.access(offset, count, self._original_ranges)
 
+        return data
+
+    def iter_chunks(self, start: int = 0, end: int = None,
+                    chunk_size: int = search.DEFAULT_CHUNK_SIZE):
+        """Генератор кусков текущего состояния файла с байтами [start; end)
+        в виде memoryview не длиннее chunk_size (см. DataBuffer.iter_chunks).
+        Файл нельзя изменять, пока генератор не исчерпан"""
+        end = self.file_size if end is None else end
+        return self._buffer.iter_chunks(start, end, chunk_size)
+
+    @timed
+    def read(self, offset: int, count: int) -> bytes:
+        """count байт текущего состояния файла со смещения offset. В отличие
+        от get_nbytes, не считается просмотром и не запускает чтение
+        наперед"""
+        return b''.join(self.iter_chunks(offset, offset + count, count)) \
+            if count > 0 else b''
+
+    @timed
     def replace(self, offset: int, data: bytes) -> None:
         self._model.replace(offset, data)
 
+    @timed
     def insert(self, offset: int, data: bytes) -> None:
         self._model.insert(offset, data)
 
+    @timed
     def remove(self, offset: int, count: int) -> None:
         self._model.remove(offset, count)
 
+    @timed
+    def insert_original(self, offset: int, original_start: int,
+                        length: int) -> None:
+        """Вставляет по смещению offset length байт исходного файла со
+        смещения original_start без чтения (см. FileModel.insert_original)"""
+        self._model.insert_original(offset, original_start, length)
+
+    @timed
     def save_changes(self, filename: str):
         if filename != self.filename:
-            # сохраняем в другой файл
-            fp = open(filename, 'wb')
-        else:
-            fp = self._fp
-        for region in self._model.file_regions:
-            if isinstance(region, EditedFileRegion):
-                fp.seek(region.start)
-                fp.write(region.data)
-            elif (region.original_start != region.start
-                  or region.original_end != region.end):
-                previous = region.start
-                for i in range(region.length // self.__chunk_size):
-                    data = self.get_nbytes(previous, self.__chunk_size)
-                    fp.seek(previous)
-                    fp.write(data)
-                    previous += self.__chunk_size
-                fp.write(self.get_nbytes(previous, region.length % self.__chunk_size))
-        fp.flush()
-        fp.truncate(self.file_size)
+            # собираем файл заново во временном файле и подменяем им filename
+            saveplan.save_as(self._model.layout(copy=False), self._fp.fileno(),
+                             filename, self.save_chunk_size,
+                             stats=self.stats)
+            return
 
-        if filename != self.filename:
-            fp.close()
+        layout = self._model.layout(copy=False)
+        if saveplan.is_in_order(layout):
+            self.plan_save().apply(self._fp.fileno(), self.save_chunk_size,
+                                   self.stats)
         else:
-            self._model = FileModel(self._model.file_size)
-            self._buffer._file_model = self._model
-
-    def search(self, query: bytes) -> int:
-        """Поиск подстроки в строке через полиномиальный хэш"""
-        # нет проверки на длину входных данных
-        p = 1000
-        max_power = p ** (len(query) - 1)
-        query_hash = 0
-        substring_hash = 0
-        for i in range(len(query)):
-            query_hash = query_hash * p + query[i]
-            substring_hash = substring_hash * p + self.get_nbytes(i, 1)[0]
-
-        for i in range(len(query), self.file_size + 1):
-            if query_hash == substring_hash:
-                if query == self.get_nbytes(i - len(query), len(query)):
-                    return i - len(query)
-            if i == self.file_size:
-                return -1
-            substring_hash -= max_power * self.get_nbytes(i - len(query), 1)[0]
-            substring_hash = substring_hash * p + self.get_nbytes(i, 1)[0]
-
-        return -1
+            # куски исходного файла переставлены, переписать их на месте
+            # нельзя, поэтому файл собирается заново и открывается снова
+            saveplan.save_as(layout, self._fp.fileno(), filename,
+                             self.save_chunk_size, stats=self.stats)
+            self._reopen()
+        # исходный файл изменился, суммы его кусков больше не верны
+        self._checksum_cache = None
+        file_size = self.file_size
+        self._model.close()
+        self._model = FileModel(file_size, self._edit_memory)
+        self._buffer._file_model = self._model
+        self._buffer.invalidate()
+
+    def diff(self):
+        """Генератор участков (смещение, старые байты, новые байты), которыми
+        текущее состояние файла отличается от файла на диске, если сравнивать
+        байты с одинаковыми смещениями. Регионы, которые не изменялись и не
+        сдвигались, не читаются"""
+        fd = self._fp.fileno()
+        disk_size = os.fstat(fd).st_size
+        for start, length, original_start, data in \
+                self._model.layout(copy=False):
+            if data is None and original_start == start:
+                continue
+            position = start
+            for chunk in self.iter_chunks(start, start + length,
+                                          self.save_chunk_size):
+                for offset, new in saveplan.diff_runs(fd, position, chunk,
+                                                      disk_size, self.stats):
+                    yield offset, os.pread(fd, len(new), offset), bytes(new)
+                position += len(chunk)
+
+    @timed
+    def compare(self, filename: str = None) -> DiffRanges:
+        """Участки, которыми текущее состояние файла отличается от файла
+        filename (по умолчанию от сохраненного на диске), если сравнивать
+        байты с одинаковыми смещениями"""
+        filename = self.filename if filename is None else filename
+        with open(filename, 'rb') as fp:
+            fd = fp.fileno()
+            other_size = os.fstat(fd).st_size
+            if self._is_search_parallel():
+                return bindiff.parallel_compare(
+                    self.filename, self._model.snapshot(portable=True),
+                    self.file_size, filename, other_size,
+                    self.search_workers, self.search_shard_size,
+                    self.search_chunk_size)
+            return bindiff.compare(
+                self.read, self.file_size,
+                lambda offset, count: os.pread(fd, count, offset),
+                other_size, 0, self.search_chunk_size)
+
+    def start_compare(self, filename: str = None) -> BackgroundCompare:
+        """Запускает сравнение с файлом filename (по умолчанию
+        с сохраненным на диске) в отдельном потоке по снимку текущего
+        состояния файла. Если включен параллельный поиск, поток раздает
+        куски файла процессам"""
+        parallel = self._is_search_parallel()
+        return BackgroundCompare(
+            self.filename, self._model.snapshot(portable=parallel),
+            self.file_size, self.filename if filename is None else filename,
+            self.search_chunk_size, self.search_workers if parallel else 1,
+            self.search_shard_size).start()
+
+    @timed
+    def checksums(self, start: int = 0, end: int = None,
+                  algorithms=ALGORITHMS) -> dict:
+        """Контрольные суммы (crc32, md5, sha256) байт [start; end) текущего
+        состояния файла в виде шестнадцатеричных строк. Первый вызов читает
+        весь исходный файл, после этого crc32 пересчитывается только для
+        измененных регионов"""
+        end = self.file_size if end is None else min(end, self.file_size)
+        fd = self._fp.fileno()
+        return checksums.checksums(
+            self._checksums(), self._model.layout(start, end, copy=False),
+            self.read, lambda offset, count: os.pread(fd, count, offset),
+            start, end, algorithms)
+
+    def start_checksums(self, start: int = 0, end: int = None,
+                        algorithms=ALGORITHMS) \
+            -> BackgroundChecksums:
+        """Запускает подсчет контрольных сумм в отдельном потоке по снимку
+        текущего состояния файла"""
+        end = self.file_size if end is None else min(end, self.file_size)
+        return BackgroundChecksums(
+            self.filename, self._model.snapshot(start, end),
+            self._checksums(), start, end, algorithms,
+            self.search_chunk_size).start()
+
+    def plan_save(self) -> SavePlan:
+        """План сохранения изменений на месте: какие регионы нужно сдвинуть
+        и какие измененные байты записать"""
+        return SavePlan.from_layout(self._model.layout(copy=False),
+                                    self.file_size)
+
+    @timed
+    def search(self, query: bytes, start: int = 0) -> int:
+        """Смещение первого вхождения query не раньше start или -1"""
+        return self.find_next(query, start)
+
+    @timed
+    def find_next(self, query: bytes, start: int = 0) -> int:
+        """Смещение первого вхождения query не раньше start или -1"""
+        if self._is_search_parallel():
+            return search.parallel_find_next(
+                self.filename, self._model.snapshot(start, portable=True),
+                self.file_size, query, start, self.search_workers,
+                self.search_shard_size, self.search_chunk_size)
+        return search.find_next(self.read, self.file_size,
+                                query, start, self.search_chunk_size)
+
+    @timed
+    def find_prev(self, query: bytes, start: int = None) -> int:
+        """Смещение последнего вхождения query раньше start или -1"""
+        return search.find_prev(self.read, self.file_size,
+                                query, start, self.search_chunk_size)
+
+    def find_all(self, query: bytes, start: int = 0):
+        """Генератор смещений всех вхождений query не раньше start"""
+        if self._is_search_parallel():
+            return search.parallel_find_all(
+                self.filename, self._model.snapshot(start, portable=True),
+                self.file_size, query, start, False, self.search_workers,
+                self.search_shard_size, self.search_chunk_size)
+        return search.find_all(self.read, self.file_size,
+                               query, start, self.search_chunk_size)
+
+    def start_search(self, query: bytes, start: int = 0) -> BackgroundSearch:
+        """Запускает поиск первого вхождения query в отдельном потоке по
+        снимку текущего состояния файла. Если включен параллельный поиск,
+        поток раздает куски файла процессам"""
+        parallel = self._is_search_parallel()
+        return BackgroundSearch(
+            self.filename, self._model.snapshot(start, portable=parallel),
+            self.file_size, query, start, self.search_chunk_size,
+            self.search_workers if parallel else 1,
+            self.search_shard_size).start()
+
+    @timed
+    def find_pattern(self, pattern: BytePattern, start: int = 0) -> int:
+        """Смещение первого вхождения шаблона pattern (см. modules.patterns)
+        не раньше start или -1"""
+        return patterns.find_next(self.read, self.file_size,
+                                  pattern, start, self.search_chunk_size)
+
+    def find_all_pattern(self, pattern: BytePattern, start: int = 0):
+        """Генератор смещений всех вхождений шаблона pattern не раньше
+        start"""
+        return patterns.find_all(self.read, self.file_size,
+                                 pattern, start, self.search_chunk_size)
+
+    def start_pattern_search(self, pattern: BytePattern,
+                             start: int = 0) -> BackgroundPatternSearch:
+        """Запускает поиск первого вхождения шаблона pattern в отдельном
+        потоке по снимку текущего состояния файла"""
+        return BackgroundPatternSearch(
+            self.filename, self._model.snapshot(start), self.file_size,
+            pattern, start, self.search_chunk_size).start()
+
+    @timed
+    def scan_signatures(self, signatures: dict = None,
+                        start: int = 0) -> SignatureHits:
+        """Находит за один проход все вхождения сигнатур signatures
+        (по умолчанию сигнатуры распространенных форматов файлов)"""
+        return scan_signatures(self.read, self.file_size,
+                               signatures, start, self.search_chunk_size)
+
+    def start_signature_scan(self, signatures: dict = None,
+                             start: int = 0) -> BackgroundSignatureScan:
+        """Запускает поиск сигнатур в отдельном потоке по снимку текущего
+        состояния файла"""
+        return BackgroundSignatureScan(
+            self.filename, self._model.snapshot(start), self.file_size,
+            signatures, start, self.search_chunk_size).start()
+
+    def enable_stats(self) -> EngineStats:
+        """Включает подсчет чтений с диска и времени работы публичных
+        методов"""
+        if self.stats is None:
+            self.stats = EngineStats()
+            self._attach_stats()
+        return self.stats
+
+    def disable_stats(self) -> None:
+        self.stats = None
+        self._attach_stats()
+
+    def statistics(self) -> dict:
+        """Снимок статистики: регионы и данные правок, кэш блоков и, если
+        статистика включена, чтения с диска и время работы методов"""
+        return {
+            'file_size': self.file_size,
+            'model': self._model.statistics(),
+            'cache': self.cache.snapshot() if self.cache is not None
+            else None,
+            'prefetched_bytes': self._prefetcher.prefetched
+            if self._prefetcher is not None else 0,
+            'engine': self.stats.snapshot() if self.stats is not None
+            else None,
+        }
+
+    def dump_stats(self, fp) -> None:
+        """Записывает снимок статистики в fp в формате JSON"""
+        dump_json(self.statistics(), fp)
+
+    def log_stats(self, logger=logging, level: int = logging.INFO) -> None:
+        log_stats(self.statistics(), logger, level)
+
+    def _reopen(self) -> None:
+        """Открывает файл заново после того, как он был подменен на диске"""
+        old_fp = self._fp
+        self._fp = open(self.filename, old_fp.mode)
+        self._buffer._fp = self._fp
+        if self.cache is not None:
+            self.cache._fp = self._fp
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = prefetch.Prefetcher(
+                self._fp.fileno(), self.cache, self._prefetcher.screens)
+        old_fp.close()
+
+    def _attach_stats(self) -> None:
+        self._buffer.stats = self.stats
+        if self.cache is not None:
+            self.cache.stats = self.stats
+
+    def _original_ranges(self, start: int, end: int) -> list:
+        """Пары (смещение в исходном файле, длина) неизмененных байт
+        из [start; end)"""
+        ranges = []
+        end = min(end, self.file_size)
+        if start >= end:
+            return ranges
+        position = None
+        for region in self._model.iter_regions(start):
+            position = region.start if position is None else position
+            if position >= end:
+                break
+            if not isinstance(region, EditedFileRegion):
+                shift = max(start - position, 0)
+                length = min(position + region.length, end) - position - shift
+                ranges.append((region.original_start + shift, length))
+            position += region.length
+
+        return ranges
+
+    def _checksums(self) -> ChecksumCache:
+        if self._checksum_cache is None:
+            self._checksum_cache = ChecksumCache(
+                os.fstat(self._fp.fileno()).st_size)
+        return self._checksum_cache
+
+    def _is_search_parallel(self) -> bool:
+        return (self.search_workers > 1
+                and self.file_size > self.search_shard_size)
 
     def exit(self):
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+        self._buffer.unmap()
+        self._model.close()
         self._fp.close()
 
+    @property
+    def cache(self):
+        """Кэш блоков исходного файла или None, если он отключен"""
+        return self._buffer.cache
+
     @property
     def file_size(self) -> int:
         return self._model.file_size
@@ -1,144 +1,219 @@
-import bisect
+from modules.addbuffer import AddBuffer, DEFAULT_MAX_MEMORY
 from modules.fileregion import FileRegion, EditedFileRegion
+from modules.regiontree import RegionTree
 
 
 class FileModel:
-    def __init__(self, file_size: int):
-        self.file_regions = [FileRegion(0, file_size - 1, 0)]
+    def __init__(self, file_size: int,
+                 max_edit_memory: int = DEFAULT_MAX_MEMORY):
+        self._regions = RegionTree(
+            [FileRegion(0, file_size - 1, 0)] if file_size else [])
+        # данные всех измененных регионов, при превышении max_edit_memory
+        # переносятся во временный файл
+        self._add_buffer = AddBuffer(max_edit_memory)
+
+    @property
+    def file_regions(self) -> RegionTree:
+        """Регионы файла в порядке их следования"""
+        return self._regions
+
+    @file_regions.setter
+    def file_regions(self, regions) -> None:
+        self._regions = RegionTree(regions)
 
     @property
     def file_size(self) -> int:
-        return self.file_regions[-1].end + 1
+        return self._regions.length
 
     def search_region(self, offset: int) -> FileRegion:
         """Возвращает FileRegion, который соответствует смещению offset"""
-        return self.file_regions[bisect.bisect_left(self.file_regions, offset)]
+        region = self._regions.find(offset)
+        if region is None:
+            raise IndexError(f'offset {offset} is out of file')
+
+        return region
+
+    def next_region(self, region: FileRegion):
+        """Возвращает регион, следующий за region, или None"""
+        return self._regions.successor(region)
+
+    def iter_regions(self, offset: int = 0):
+        """Перебирает регионы, начиная с содержащего смещение offset"""
+        region = self._regions.find(offset)
+        while region is not None:
+            yield region
+            region = self._regions.successor(region)
+
+    def layout(self, start: int = 0, end: int = None, copy=True) -> list:
+        """Описание регионов, пересекающихся с [start; end), в виде кортежей
+        (начало, длина, смещение в исходном файле, данные). У неизмененных
+        регионов данные равны None, у измененных None смещение. Если copy
+        ложно, данные измененных регионов по возможности не копируются,
+        и такое описание действительно только до следующего изменения"""
+        return self._pieces(start, end, (lambda region: bytes(region.data))
+                            if copy else EditedFileRegion.view)
+
+    def snapshot(self, start: int = 0, end: int = None,
+                 portable=False) -> list:
+        """То же, что layout(start, end, copy=False), но описание остается
+        действительным после изменений: данные измененных регионов больше
+        не перезаписываются на месте. Если portable истинно, описание можно
+        передать в другой процесс: данные из временного файла передаются
+        как SpilledSlice, а из памяти копируются"""
+        self._add_buffer.freeze()
+        return self._pieces(start, end, EditedFileRegion.portable
+                            if portable else EditedFileRegion.view)
+
+    def _pieces(self, start: int, end: int, data) -> list:
+        """Кортежи layout, данные измененного региона берутся как
+        data(регион)"""
+        end = self.file_size if end is None else end
+        result = []
+        region = self._regions.find(start)
+        position = region.start if region is not None else end
+        while region is not None and position < end:
+            if isinstance(region, EditedFileRegion):
+                result.append((position, region.length, None, data(region)))
+            else:
+                result.append((position, region.length,
+                               region.original_start, None))
+            position += region.length
+            region = self._regions.successor(region)
+
+        return result
+
+    @property
+    def edit_memory(self) -> int:
+        """Память, занятая данными измененных регионов"""
+        return self._add_buffer.memory
+
+    def statistics(self) -> dict:
+        """Число регионов, насколько файл раздроблен правками и сколько
+        места занимают их данные. Обходит все регионы"""
+        edited_regions = edited_bytes = 0
+        for region in self._regions:
+            if isinstance(region, EditedFileRegion):
+                edited_regions += 1
+                edited_bytes += region.length
+        regions = len(self._regions)
+
+        return {
+            'regions': regions,
+            'edited_regions': edited_regions,
+            'edited_bytes': edited_bytes,
+            'average_region_length':
+                self.file_size / regions if regions else 0,
+            'edit_buffer_bytes': len(self._add_buffer),
+            'edit_memory': self._add_buffer.memory,
+            'edit_buffer_spilled': self._add_buffer.is_spilled,
+        }
+
+    def close(self) -> None:
+        """Освобождает данные измененных регионов"""
+        self._add_buffer.close()
 
     def replace(self, offset: int, data: bytes) -> int:
         """Заменяет байты со смещения offset на data"""
-        # TODO: оптимизация, когда изменяются смежные байты
-        left, right = self._remove_intermediate_regions(offset,
-                                                        offset + len(data) - 1)
-        if not self.file_regions:
-            # граничный случай, был заменен весь файл
-            self.file_regions = [EditedFileRegion(0, data, 0)]
-            return 0
-
-        if offset == left.start:
-            new_region_index = left.index
-        else:
-            new_region_index = left.index + 1
-        new_region = EditedFileRegion(offset, data, new_region_index)
-
-        # корректируем границы смежных с новым регионов
-        if left == right and new_region.start == left.start:
-            # изменения с начала региона
-            left.truncate_start(new_region.end - left.start + 1)
-        elif left == right and new_region.end == right.end:
-            # изменения до конца региона
-            left.truncate_end(left.end - new_region.start + 1)
-        elif left == right:
-            # изменения в середине региона
-            head, tail = left.split(new_region.start)
-            left.truncate_end(tail.length)
-            tail.truncate_start(new_region.length)
-
-            self.file_regions.insert(tail.index, tail)
-            # left.truncate_end(left.end - head.end - 1)
-        else:
-            # изменения больше, чем в одном регионе
-            left.truncate_end(left.end - new_region.start + 1)
-            right.truncate_start(new_region.end - right.start + 1)
-
-        self.file_regions.insert(new_region.index, new_region)
-
-        # исправляем индексы
-        for i in range(new_region.index + 1, len(self.file_regions)):
-            self.file_regions[i].index = i
-
-        return new_region.index
+        region = self._edited_region(offset)
+        if region is not None and not region.is_frozen \
+                and offset + len(data) <= region.end + 1:
+            # замена внутри измененного региона, который не попал в снимок
+            region.overwrite(offset - region.start, data)
+            return region.index
+
+        right = self._split(min(offset + len(data), self.file_size))
+        left = self._split(offset)
+        self._remove_regions(left, right)
+
+        new_region = EditedFileRegion(offset, data, 0, self._add_buffer)
+        self._regions.insert_before(right, new_region)
+
+        return self._merge_adjacent(new_region).index
 
     def insert(self, offset: int, data: bytes) -> int:
         """Вставляет data по смещению offset"""
-        previous = self.search_region(offset)
-
-        if offset == previous.start:
-            # вставка будет перед предыдущим регионом
-            new_region_index = previous.index
-        else:
-            # вставка будет в середине предыдущего региона
-            new_region_index = previous.index + 1
-            head, tail = previous.split(offset)
-            previous.truncate_end(tail.length)
-            self.file_regions.insert(tail.index, tail)
-        new_region = EditedFileRegion(offset,
-                                      data,
-                                      new_region_index)
-
-        self.file_regions.insert(new_region.index, new_region)
-
-        # исправляем границы и индексы
-        for i in range(new_region.index + 1, len(self.file_regions)):
-            self.file_regions[i].move(new_region.length)
-            self.file_regions[i].index = i
-
-        return new_region.index
+        # вставка сразу после конца измененного региона, например, при
+        # наборе байт подряд, дописывает данные в этот регион
+        region = self._edited_region(offset - 1) if offset else None
+        if region is not None and region.end + 1 == offset and data \
+                and region.append(data):
+            return region.index
+
+        new_region = EditedFileRegion(offset, data, 0, self._add_buffer)
+        self._regions.insert_before(self._split(offset), new_region)
+
+        return self._merge_adjacent(new_region).index
+
+    def insert_original(self, offset: int, original_start: int,
+                        length: int) -> None:
+        """Вставляет по смещению offset length байт исходного файла со
+        смещения original_start, не читая их. Порядок кусков исходного
+        файла при этом может нарушиться (см. saveplan.is_in_order)"""
+        if length <= 0:
+            return
+        region = FileRegion(offset, offset + length - 1, 0)
+        region._original_start = original_start
+        self._regions.insert_before(self._split(offset), region)
 
     def remove(self, offset: int, count: int) -> None:
-        remove_end = max(offset + count - 1, 0)
-        left, right = self._remove_intermediate_regions(offset, remove_end)
-        if not self.file_regions:
+        right = self._split(min(offset + count, self.file_size))
+        left = self._split(offset)
+        self._remove_regions(left, right)
+        if not len(self._regions):
             # граничный случай, был удален весь файл
-            self.file_regions = [EditedFileRegion(0, b'', 0)]
-            return
-        is_left_removed = offset <= left.start and left.end <= remove_end
-
-        is_left_truncated = False
-        # корректируем границы смежных с новым регионов
-        if left == right and offset == left.start:
-            # изменения с начала региона
-            is_left_truncated = True
-            left.truncate_start(count)
-        elif left == right and remove_end == right.end:
-            # изменения до конца региона
-            left.truncate_end(count)
-        elif left == right:
-            # изменения в середине региона
-            head, tail = left.split(offset)
-            tail.truncate_start(count)
-            self.file_regions.insert(tail.index, tail)
-            left.truncate_end(left.end - head.end)
-        else:
-            # изменения больше, чем в одном регионе
-            left.truncate_end(left.end - offset + 1)
-            right.truncate_start(offset + count - right.start)
-
-        # исправляем границы и индексы
-        if is_left_removed or is_left_truncated:
-            start_from = left.index
-        else:
-            start_from = left.index + 1
-        for i in range(start_from, len(self.file_regions)):
-            self.file_regions[i].move(-count)
-            self.file_regions[i].index = i
-
-    def _remove_intermediate_regions(self, start: int, end: int) -> tuple:
-        """Удаляет регионы, целиком находящиеся в отрезке [start; end].
-        Возвращает первый и последний регионы, что не были удалены.
-        Если бы удален весь файл, возвращает None, None"""
-        left = self.search_region(start)
-        to_delete = left.index
-        while (to_delete < len(self.file_regions)
-               and end >= self.file_regions[to_delete].end):
-            if start <= self.file_regions[to_delete].start:
-                self.file_regions.pop(to_delete)
-            else:
-                to_delete += 1
-        if not self.file_regions:
-            return None, None
-
-        return left, self.file_regions[to_delete]
-
-
-# TODO
-# 1. linked list?
+            self._regions.insert_before(
+                None, EditedFileRegion(0, b'', 0, self._add_buffer))
+        elif right is not None:
+            self._merge_adjacent(right)
+
+    def _edited_region(self, offset: int):
+        """Возвращает измененный регион, содержащий offset, если его данные
+        можно изменять на месте, иначе None"""
+        if not 0 <= offset < self.file_size:
+            return None
+        region = self._regions.find(offset)
+        if isinstance(region, EditedFileRegion) and region.is_mutable:
+            return region
+
+        return None
+
+    def _merge_adjacent(self, region: FileRegion) -> FileRegion:
+        """Объединяет измененный регион region с соседними измененными
+        регионами, если их данные лежат в буфере добавлений подряд.
+        Возвращает получившийся регион"""
+        if not isinstance(region, EditedFileRegion):
+            return region
+        previous = self._regions.predecessor(region)
+        if isinstance(previous, EditedFileRegion) and previous.join(region):
+            self._regions.remove(region)
+            region = previous
+        following = self._regions.successor(region)
+        if isinstance(following, EditedFileRegion) and region.join(following):
+            self._regions.remove(following)
+
+        return region
+
+    def _split(self, offset: int):
+        """Разбивает регион, содержащий offset, так, чтобы offset стал началом
+        региона. Возвращает регион, начинающийся с offset, или None, если
+        offset указывает на конец файла"""
+        if offset == self.file_size:
+            return None
+        region = self.search_region(offset)
+        if region.start == offset:
+            return region
+
+        head, tail = region.split(offset)
+        self._regions.insert_before(region, head)
+        self._regions.insert_before(region, tail)
+        self._regions.remove(region)
+
+        return tail
+
+    def _remove_regions(self, first, stop) -> None:
+        """Удаляет регионы, начиная с first и до stop (не включительно)"""
+        region = first
+        while region is not None and region is not stop:
+            following = self._regions.successor(region)
+            self._regions.remove(region)
+            region = following
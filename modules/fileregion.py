@@ -1,34 +1,36 @@
-from functools import total_ordering
+from modules.addbuffer import AddBuffer
+from modules.regiontree import RegionNode
 
 
-@total_ordering
-class FileRegion:
+class FileRegion(RegionNode):
+    __slots__ = ('_start', '_index', '_original_start')
+
     def __init__(self, start: int, end: int, index: int):
+        super().__init__()
+        # пока регион не лежит в дереве, его положение хранится явно,
+        # иначе оно вычисляется деревом
         self._start = start
-        self._end = end
-        self.index = index
+        self._length = end - start + 1
+        self._index = index
 
-        # нужны, чтобы сохранить взаимно однозначное соответствие между
+        # нужно, чтобы сохранить взаимно однозначное соответствие между
         # FileRegion и местом на диске
-        self.__original_start = self.start
-        self.__original_end = self.end
+        self._original_start = self._start
 
     def move(self, count: int) -> None:
         """Сдвигает обе границы FileRegion на count, не изменяя original_end
         и original_start"""
         self._start += count
-        self._end += count
 
     def split(self, pos: int) -> tuple:
         """Разбивает текущий регион на два по позиции pos так, что конец левого
         региона в pos - 1, начало правого в pos, индекс левого равен индексу
         исходного региона, индекс правого на единицу больше индекса левого"""
-        left = FileRegion(self.start, pos - 1, self.index)
-        left.__set_original_bounds(self.__original_start,
-                                   self.__original_end - (self._end - pos) - 1)
-        right = FileRegion(pos, self.end, self.index + 1)
-        right.__set_original_bounds(self.__original_end - (self._end - pos),
-                                    self.__original_end)
+        start = self.start
+        left = FileRegion(start, pos - 1, self.index)
+        left._original_start = self._original_start
+        right = FileRegion(pos, start + self._length - 1, self.index + 1)
+        right._original_start = self._original_start + pos - start
 
         return left, right
 
@@ -36,39 +38,49 @@ class FileRegion:
         if value < 0:
             raise ValueError
 
-        self.__original_start += value
+        self._original_start += value
         self._start += value
+        self._length -= value
+        self._refresh()
 
     def truncate_end(self, value: int) -> None:
         if value < 0:
             raise ValueError
 
-        self.__original_end -= value
-        self._end -= value
+        self._length -= value
+        self._refresh()
 
     @property
     def original_start(self) -> int:
-        return self.__original_start
+        return self._original_start
 
     @property
     def original_end(self) -> int:
-        return self.__original_end
+        return self._original_start + self._length - 1
 
     @property
-    def start(self):
+    def start(self) -> int:
+        if self._tree is not None:
+            return self._tree.offset_of(self)
         return self._start
 
     @property
-    def end(self):
-        return self._end
+    def end(self) -> int:
+        return self.start + self._length - 1
 
     @property
     def length(self) -> int:
-        return self.end - self.start + 1
+        return self._length
+
+    @property
+    def index(self) -> int:
+        if self._tree is not None:
+            return self._tree.index_of(self)
+        return self._index
 
-    def __set_original_bounds(self, start, end):
-        self.__original_end = end
-        self.__original_start = start
+    @index.setter
+    def index(self, value: int) -> None:
+        self._index = value
 
     def __eq__(self, other):
         if isinstance(other, int):
@@ -89,34 +101,120 @@ class FileRegion:
 
 
 class EditedFileRegion(FileRegion):
-    def __init__(self, start: int, data: bytes, index: int):
+    __slots__ = ('_add_buffer', '_data_offset', '_data_length')
+
+    def __init__(self, start: int, data: bytes, index: int,
+                 add_buffer: AddBuffer = None):
         super().__init__(start, max(len(data) + start - 1, 0), index)
-        self.data = data
+        self._add_buffer = AddBuffer() if add_buffer is None else add_buffer
+        # данные региона лежат в буфере добавлений по сдвигу _data_offset
+        self._data_offset = self._add_buffer.append(data)
+        self._data_length = len(data)
+
+    @classmethod
+    def piece(cls, start: int, add_buffer: AddBuffer, data_offset: int,
+              data_length: int, index: int) -> 'EditedFileRegion':
+        """Регион, данные которого уже лежат в буфере добавлений"""
+        region = cls(start, b'', index, add_buffer)
+        region._length = data_length
+        region._data_offset = data_offset
+        region._data_length = data_length
+
+        return region
+
+    @property
+    def data(self) -> bytearray:
+        return self._add_buffer.read(self._data_offset, self._data_length)
 
     def truncate_start(self, value: int) -> None:
         if value < 0:
             raise ValueError
 
-        self.data = self.data[value:]
+        self._data_offset += value
+        self._data_length -= value
         self._start += value
+        self._length -= value
+        self._refresh()
 
     def truncate_end(self, value: int) -> None:
         if value < 0:
             raise ValueError
 
-        self.data = self.data[:len(self.data) - value]
-        self._end -= value
+        self._data_length -= value
+        self._length -= value
+        self._refresh()
 
     def split(self, pos: int) -> tuple:
-        return EditedFileRegion(self.start,
-                                self.data[:pos - self.start],
-                                self.index), \
-               EditedFileRegion(pos,
-                                self.data[pos - self.start:],
-                                self.index + 1)
+        start = self.start
+        index = self.index
+        shift = pos - start
+        return EditedFileRegion.piece(start, self._add_buffer,
+                                      self._data_offset, shift, index), \
+               EditedFileRegion.piece(pos, self._add_buffer,
+                                      self._data_offset + shift,
+                                      self._data_length - shift, index + 1)
+
+    def append(self, data: bytes) -> bool:
+        """Дописывает data в конец региона, если его данные лежат в самом
+        конце буфера добавлений. Возвращает, получилось ли это сделать"""
+        if (self._data_offset + self._data_length != len(self._add_buffer)
+                or not self.is_mutable):
+            return False
+        self._add_buffer.append(data)
+        self._data_length += len(data)
+        self._length += len(data)
+        self._refresh()
+
+        return True
+
+    def overwrite(self, pos: int, data: bytes) -> None:
+        """Заменяет байты региона со сдвига pos на data на месте"""
+        if pos + len(data) > self._data_length:
+            raise ValueError('data does not fit into the region')
+        self._add_buffer.write(self._data_offset + pos, data)
+
+    def join(self, other: 'EditedFileRegion') -> bool:
+        """Присоединяет к концу региона следующий за ним регион other, если
+        их данные лежат в буфере добавлений подряд"""
+        if (other._add_buffer is not self._add_buffer
+                or self._data_offset + self._data_length != other._data_offset
+                or not self.is_mutable or not other.is_mutable):
+            return False
+        self._data_length += other._data_length
+        self._length += other._length
+        self._refresh()
+
+        return True
+
+    @property
+    def is_mutable(self) -> bool:
+        """Можно ли изменять данные региона на месте. У пустого региона,
+        оставшегося после удаления всего файла, длина не совпадает с длиной
+        данных"""
+        return self._data_length == self._length
+
+    @property
+    def is_frozen(self) -> bool:
+        """Лежат ли данные региона в части буфера добавлений, которую
+        нельзя перезаписывать (см. AddBuffer.freeze)"""
+        return self._data_offset < self._add_buffer.frozen
 
     def get_nbytes(self, offset: int, count: int) -> bytes:
-        return self.data[offset:offset + count]
+        count = min(count, self._data_length - offset)
+        return self._add_buffer.read(self._data_offset + offset, count)
+
+    def view(self, offset: int = 0, count: int = None) -> memoryview:
+        """count байт данных региона со сдвига offset (по умолчанию все
+        данные) без копирования (см. AddBuffer.view)"""
+        if count is None:
+            count = self._data_length - offset
+        count = min(count, self._data_length - offset)
+        return self._add_buffer.view(self._data_offset + offset, count)
+
+    def portable(self):
+        """Данные региона для передачи в другой процесс (см.
+        AddBuffer.slice)"""
+        return self._add_buffer.slice(self._data_offset, self._data_length)
 
     def __repr__(self):
         return f'EditedFileRegion({self.start}, {self.end}, {self.data})'
@@ -0,0 +1,95 @@
+import json
+import math
+import time
+from collections import deque
+
+# сколько последних кадров учитывается в гистограммах
+DEFAULT_WINDOW = 1024
+PHASES = ('key', 'fetch', 'render', 'refresh')
+
+
+class LatencyHistogram:
+    """Время последних window замеров и их процентили"""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentiles(self, *percents) -> list:
+        """Процентили времени в секундах (ближайший ранг) или None, если
+        замеров еще не было"""
+        if not self._samples:
+            return [None] * len(percents)
+        ordered = sorted(self._samples)
+        return [ordered[max(math.ceil(len(ordered) * percent / 100), 1) - 1]
+                for percent in percents]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class FrameTracer:
+    """Замеряет, сколько времени уходит на обработку каждого нажатия:
+    обработку клавиши, чтение байт экрана, отрисовку и refresh. Кадр
+    начинается с нажатия (start) и заканчивается после refresh (finish).
+    Если до следующего нажатия кадр не закончился, например, пока вводится
+    строка поиска, он отбрасывается: время ожидания ввода не считается"""
+
+    def __init__(self, window: int = DEFAULT_WINDOW, trace_file=None):
+        self.histograms = {phase: LatencyHistogram(window)
+                           for phase in PHASES + ('total',)}
+        self._trace_file = trace_file  # файл для строк JSON по кадрам
+        self._key = None
+        self._times = None
+        self._start = self._last = 0.0
+
+    def start(self, key: int) -> None:
+        self._key = key
+        self._times = dict.fromkeys(PHASES, 0.0)
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        """Относит время с предыдущей отметки к фазе phase"""
+        if self._times is None:
+            return
+        now = time.perf_counter()
+        self._times[phase] += now - self._last
+        self._last = now
+
+    def finish(self) -> None:
+        if self._times is None:
+            return
+        total = time.perf_counter() - self._start
+        for phase, seconds in self._times.items():
+            self.histograms[phase].add(seconds)
+        self.histograms['total'].add(total)
+        if self._trace_file is not None:
+            frame = {'key': self._key}
+            frame.update((f'{phase}_ms', seconds * 1000)
+                         for phase, seconds in self._times.items())
+            frame['total_ms'] = total * 1000
+            self._trace_file.write(json.dumps(frame) + '\n')
+        self._times = None
+
+    def summary(self, phase: str = 'total') -> str:
+        """Строка вида 'p50 0.42 p95 1.20 p99 3.05 ms'"""
+        values = self.histograms[phase].percentiles(50, 95, 99)
+        if values[0] is None:
+            return 'no frames yet'
+        return ' '.join(f'p{percent} {value * 1000:.2f}' for percent, value
+                        in zip((50, 95, 99), values)) + ' ms'
+
+    def snapshot(self) -> dict:
+        """Процентили всех фаз в миллисекундах"""
+        result = {}
+        for phase, histogram in self.histograms.items():
+            values = histogram.percentiles(50, 95, 99)
+            result[phase] = {
+                'frames': len(histogram),
+                **{f'p{percent}_ms': value * 1000 if value is not None
+                   else None for percent, value in zip((50, 95, 99), values)},
+            }
+
+        return result
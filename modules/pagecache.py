@@ -0,0 +1,209 @@
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+
+
+class PageCache:
+    """Кэш выровненных блоков исходного файла фиксированного размера
+    с вытеснением давно не использованных блоков (LRU). Кэш можно заполнять
+    из другого потока (см. prefetch). Через него идут все чтения исходного
+    файла в DataBuffer: байты на экране через read, а проходы по всему
+    файлу через read_bulk. Фоновые задачи (см. search.BackgroundSearch)
+    читают снимок файла сами, мимо кэша"""
+
+    def __init__(self, fp, max_memory: int = DEFAULT_CACHE_SIZE,
+                 block_size: int = DEFAULT_BLOCK_SIZE):
+        if block_size <= 0:
+            raise ValueError('block size must be positive')
+        self._fp = fp
+        self.block_size = block_size
+        self.max_blocks = max(1, max_memory // block_size)
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        # увеличивается при каждом сбросе, блоки, прочитанные до сброса,
+        # в кэш не попадают
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetched = 0  # блоки, прочитанные заранее
+        self.bulk_hits = 0  # блоки, найденные при чтениях read_bulk
+        self.bulk_misses = 0
+        self.stats = None  # EngineStats, если статистика включена
+
+    @property
+    def memory(self) -> int:
+        """Память, занятая блоками в кэше"""
+        return sum(map(len, self._blocks.values()))
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def read(self, offset: int, count: int):
+        """Возвращает count байт исходного файла со смещения offset"""
+        if count <= 0:
+            return b''
+        first = offset // self.block_size
+        last = (offset + count - 1) // self.block_size
+        blocks = self._get_blocks(first, last)
+        start = offset - first * self.block_size
+        if len(blocks) == 1:
+            return memoryview(blocks[0])[start:start + count]
+
+        data = b''.join(blocks)
+        return data[start:start + count]
+
+    def read_bulk(self, offset: int, count: int):
+        """То же, что read, но для больших проходов по файлу (поиск,
+        сохранение, сравнение, контрольные суммы): блоки, которые уже есть
+        в кэше, берутся из него, не продвигаясь в очереди вытеснения,
+        а недостающие читаются с диска и в кэш не кладутся, чтобы проход
+        не вытеснил байты на экране. Учитывается в bulk_hits и bulk_misses"""
+        if count <= 0:
+            return b''
+        first = offset // self.block_size
+        last = (offset + count - 1) // self.block_size
+        parts = []  # [первый блок, следующий за последним, блок или None]
+        with self._lock:
+            for number in range(first, last + 1):
+                block = self._blocks.get(number)
+                if block is not None:
+                    self.bulk_hits += 1
+                    parts.append([number, number + 1, block])
+                    continue
+                self.bulk_misses += 1
+                if parts and parts[-1][2] is None:
+                    parts[-1][1] = number + 1
+                else:
+                    parts.append([number, number + 1, None])
+        if len(parts) == 1 and parts[0][2] is None:
+            # в кэше ничего нет, читаем сразу нужные байты
+            return self._pread(offset, count)
+        data = bytearray()
+        for start, stop, block in parts:
+            if block is None:
+                block = self._pread(start * self.block_size,
+                                    (stop - start) * self.block_size)
+            data += block
+            if len(block) < (stop - start) * self.block_size:
+                break
+        start = offset - first * self.block_size
+        return memoryview(data)[start:start + count]
+
+    def prefetch(self, offset: int, count: int,
+                 batch_blocks: int = 8) -> int:
+        """Заранее читает в кэш блоки с байтами [offset; offset + count),
+        которых в нем нет, не учитывая их в статистике попаданий. Блоки
+        читаются пачками по batch_blocks без блокировки, так что другие
+        потоки могут читать из кэша, пока идет чтение с диска. Возвращает
+        количество прочитанных блоков"""
+        if count <= 0:
+            return 0
+        first = offset // self.block_size
+        # занимаем не больше половины кэша, чтобы не вытеснить то, что
+        # читается сейчас
+        last = min((offset + count - 1) // self.block_size,
+                   first + max(self.max_blocks // 2, 1) - 1)
+        loaded = 0
+        number = first
+        while number <= last:
+            with self._lock:
+                generation = self._generation
+                while number <= last and number in self._blocks:
+                    number += 1
+                stop = number
+                while (stop <= last and stop - number < batch_blocks
+                       and stop not in self._blocks):
+                    stop += 1
+            if number < stop:
+                blocks = self._load(number, stop)
+                with self._lock:
+                    if self._store(number, blocks, generation):
+                        self.prefetched += len(blocks)
+                loaded += len(blocks)
+                # дошли до конца файла, дальше читать нечего
+                if len(blocks) < stop - number:
+                    return loaded
+            number = stop
+
+        return loaded
+
+    def snapshot(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hit_ratio, 'evictions': self.evictions,
+                'prefetched': self.prefetched, 'bulk_hits': self.bulk_hits,
+                'bulk_misses': self.bulk_misses, 'memory': self.memory,
+                'blocks': len(self._blocks), 'block_size': self.block_size}
+
+    def clear(self) -> None:
+        """Сбрасывает кэш, например, после изменения файла на диске"""
+        with self._lock:
+            self._blocks.clear()
+            self._generation += 1
+
+    def _get_blocks(self, first: int, last: int) -> list:
+        """Возвращает блоки с номерами от first до last включительно.
+        Подряд идущие отсутствующие блоки читаются одним вызовом pread,
+        кэш на время чтения с диска не блокируется"""
+        blocks = {}
+        missing = []  # пары [первый, следующий за последним]
+        with self._lock:
+            generation = self._generation
+            for number in range(first, last + 1):
+                block = self._blocks.get(number)
+                if block is None:
+                    if missing and missing[-1][1] == number:
+                        missing[-1][1] = number + 1
+                    else:
+                        missing.append([number, number + 1])
+                    continue
+                self.hits += 1
+                self._blocks.move_to_end(number)
+                blocks[number] = block
+        for start, stop in missing:
+            loaded = self._load(start, stop)
+            with self._lock:
+                self.misses += stop - start
+                self._store(start, loaded, generation)
+            for number in range(start, stop):
+                blocks[number] = loaded[number - start] \
+                    if number - start < len(loaded) else b''
+
+        return [blocks[number] for number in range(first, last + 1)]
+
+    def _load(self, first: int, stop: int) -> list:
+        """Читает с диска блоки с номерами из [first; stop). За концом
+        файла блоков нет, поэтому их может вернуться меньше"""
+        data = self._pread(first * self.block_size,
+                           (stop - first) * self.block_size)
+        return [data[start:start + self.block_size]
+                for start in range(0, len(data), self.block_size)]
+
+    def _pread(self, offset: int, count: int) -> bytes:
+        data = os.pread(self._fp.fileno(), count, offset)
+        if self.stats is not None:
+            self.stats.count_read(len(data), offset)
+
+        return data
+
+    def _store(self, first: int, blocks: list, generation: int) -> bool:
+        """Кладет в кэш блоки, начиная с номера first, если с тех пор, как
+        их начали читать (generation), кэш не сбрасывался: иначе они могли
+        быть прочитаны до того, как файл изменился на диске. Вызывается под
+        блокировкой. Возвращает, положены ли блоки"""
+        if generation != self._generation:
+            return False
+        for number, block in enumerate(blocks, first):
+            self._blocks[number] = block
+            self._blocks.move_to_end(number)
+            if len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+                self.evictions += 1
+
+        return True
@@ -0,0 +1,429 @@
+import multiprocessing
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from modules.editor import HexEditor
+
+# столько байт заполнения и повторов создается за один раз
+FILL_CHUNK_SIZE = 1024 * 1024
+# столько отличий сохраняется для каждого файла при пробном запуске
+DEFAULT_DIFF_LIMIT = 100
+
+IPS_HEADER = b'PATCH'
+IPS_FOOTER = b'EOF'
+BPS_HEADER = b'BPS1'
+
+SOURCE_READ, TARGET_READ, SOURCE_COPY, TARGET_COPY = range(4)
+
+
+class PatchError(ValueError):
+    pass
+
+
+def parse_hex(value: str) -> bytes:
+    """Байты из шестнадцатеричной строки, пробелы игнорируются"""
+    value = ''.join(value.split())
+    if value.lower().startswith('0x'):
+        value = value[2:]
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        raise PatchError(f'bad hex string {value!r}') from None
+
+
+def parse_number(value: str) -> int:
+    """Десятичное число или шестнадцатеричное с префиксом 0x"""
+    try:
+        number = int(value, 0)
+    except ValueError:
+        raise PatchError(f'bad number {value!r}') from None
+    if number < 0:
+        raise PatchError(f'negative number {value!r}')
+
+    return number
+
+
+def parse_script(lines):
+    """Генератор операций из строк сценария. Поддерживаются команды
+        replace ОТКУДА БАЙТЫ
+        insert ОТКУДА БАЙТЫ
+        remove ОТКУДА СКОЛЬКО
+        fill ОТКУДА СКОЛЬКО БАЙТЫ
+        substitute ЧТО НА_ЧТО
+    Смещения десятичные или с префиксом 0x, байты шестнадцатеричные
+    и могут разделяться пробелами, кроме команды substitute. Пустые строки
+    и текст после # пропускаются. Операции - кортежи из имени команды
+    и ее аргументов"""
+    for number, line in enumerate(lines, 1):
+        words = line.split('#', 1)[0].split()
+        if not words:
+            continue
+        command, arguments = words[0].lower(), words[1:]
+        try:
+            if command in ('replace', 'insert') and len(arguments) >= 2:
+                yield (command, parse_number(arguments[0]),
+                       parse_hex(''.join(arguments[1:])))
+            elif command == 'remove' and len(arguments) == 2:
+                yield command, *map(parse_number, arguments)
+            elif command == 'fill' and len(arguments) >= 3:
+                yield (command, parse_number(arguments[0]),
+                       parse_number(arguments[1]),
+                       parse_hex(''.join(arguments[2:])))
+            elif command == 'substitute' and len(arguments) == 2:
+                yield command, *map(parse_hex, arguments)
+            else:
+                raise PatchError(f'unknown command {line.strip()!r}')
+        except PatchError as error:
+            raise PatchError(f'line {number}: {error}') from None
+
+
+def apply_script(editor: HexEditor, lines) -> int:
+    """Выполняет сценарий (см. parse_script) над editor. Возвращает
+    количество выполненных операций"""
+    count = 0
+    for command, *arguments in parse_script(lines):
+        if command == 'replace':
+            offset, data = arguments
+            _check_offset(editor, offset)
+            editor.replace(offset, data)
+        elif command == 'insert':
+            offset, data = arguments
+            _check_offset(editor, offset)
+            editor.insert(offset, data)
+        elif command == 'remove':
+            offset, length = arguments
+            _check_offset(editor, offset + length)
+            editor.remove(offset, length)
+        elif command == 'fill':
+            fill(editor, *arguments)
+        else:
+            substitute(editor, *arguments)
+        count += 1
+
+    return count
+
+
+def fill(editor: HexEditor, offset: int, count: int, pattern: bytes) -> None:
+    """Заменяет count байт со смещения offset повторениями pattern. Данные
+    создаются кусками, поэтому count может быть больше памяти"""
+    _check_offset(editor, offset)
+    if not pattern:
+        raise PatchError('fill pattern is empty')
+    # длина куска кратна длине шаблона, чтобы шаблон не сбивался
+    chunk = pattern * max(FILL_CHUNK_SIZE // len(pattern), 1)
+    position = offset
+    while position < offset + count:
+        data = chunk[:offset + count - position]
+        editor.replace(position, data)
+        position += len(data)
+
+
+def substitute(editor: HexEditor, query: bytes, data: bytes) -> int:
+    """Заменяет все непересекающиеся вхождения query на data. Возвращает
+    количество замен"""
+    if not query:
+        raise PatchError('substitute query is empty')
+    offsets = []
+    for offset in editor.find_all(query):
+        if not offsets or offset >= offsets[-1] + len(query):
+            offsets.append(offset)
+    # с конца, чтобы замены не сдвигали еще не замененные вхождения
+    for offset in reversed(offsets):
+        if len(data) == len(query):
+            editor.replace(offset, data)
+        else:
+            editor.remove(offset, len(query))
+            editor.insert(offset, data)
+
+    return len(offsets)
+
+
+def apply_ips(editor: HexEditor, fp) -> int:
+    """Применяет патч в формате IPS из файла fp. Возвращает количество
+    записей патча"""
+    if fp.read(len(IPS_HEADER)) != IPS_HEADER:
+        raise PatchError('not an IPS patch')
+    count = 0
+    while True:
+        header = _read_exactly(fp, 3)
+        if header == IPS_FOOTER:
+            break
+        offset = int.from_bytes(header, 'big')
+        size = int.from_bytes(_read_exactly(fp, 2), 'big')
+        if offset > editor.file_size:
+            # запись за концом файла, промежуток заполняется нулями
+            fill(editor, editor.file_size, offset - editor.file_size, b'\0')
+        if size:
+            editor.replace(offset, _read_exactly(fp, size))
+        else:
+            # RLE: повторение одного байта
+            length = int.from_bytes(_read_exactly(fp, 2), 'big')
+            fill(editor, offset, length, _read_exactly(fp, 1))
+        count += 1
+    truncate = fp.read(3)
+    if len(truncate) == 3:
+        # расширение формата: размер, до которого обрезается файл
+        size = int.from_bytes(truncate, 'big')
+        if size < editor.file_size:
+            editor.remove(size, editor.file_size - size)
+
+    return count
+
+
+def apply_bps(editor: HexEditor, fp, verify=True) -> int:
+    """Применяет патч в формате BPS из файла fp к еще не измененному
+    editor. Куски исходного файла вставляются без чтения
+    (HexEditor.insert_original), а в памяти лежат только новые данные,
+    поэтому размер файла не ограничен памятью. Если verify истинно,
+    проверяются контрольные суммы исходного и полученного файла.
+    Возвращает количество действий патча"""
+    patch_size = os.fstat(fp.fileno()).st_size
+    reader = _CrcReader(fp)
+    if reader.read(len(BPS_HEADER)) != BPS_HEADER:
+        raise PatchError('not a BPS patch')
+    source_size = _read_varint(reader)
+    target_size = _read_varint(reader)
+    reader.read(_read_varint(reader))  # метаданные не нужны
+    if source_size != editor.file_size:
+        raise PatchError(f'source size is {editor.file_size}, '
+                         f'patch expects {source_size}')
+
+    # новый файл собирается после исходного, который потом удаляется
+    base = source_size
+    source_offset = target_offset = 0
+    count = 0
+    while reader.position < patch_size - 12:
+        data = _read_varint(reader)
+        command, length = data & 3, (data >> 2) + 1
+        output = editor.file_size - base
+        if command == SOURCE_READ:
+            _check_range(output, length, source_size)
+            editor.insert_original(editor.file_size, output, length)
+        elif command == TARGET_READ:
+            while length:
+                chunk = reader.read(min(length, FILL_CHUNK_SIZE))
+                if not chunk:
+                    raise PatchError('unexpected end of patch')
+                editor.insert(editor.file_size, chunk)
+                length -= len(chunk)
+        elif command == SOURCE_COPY:
+            source_offset += _read_signed(reader)
+            _check_range(source_offset, length, source_size)
+            editor.insert_original(editor.file_size, source_offset, length)
+            source_offset += length
+        else:
+            target_offset += _read_signed(reader)
+            if not 0 <= target_offset < output:
+                raise PatchError('target copy out of range')
+            _copy_target(editor, base + target_offset, length)
+            target_offset += length
+        count += 1
+    source_crc, target_crc = _read_uint32(reader), _read_uint32(reader)
+    patch_crc = reader.crc
+    if _read_uint32(reader) != patch_crc:
+        raise PatchError('patch checksum mismatch')
+    if editor.file_size - base != target_size:
+        raise PatchError('target size mismatch')
+    if verify and _crc32(editor, 0, base) != source_crc:
+        raise PatchError('source checksum mismatch')
+    editor.remove(0, base)
+    if verify and _crc32(editor, 0, target_size) != target_crc:
+        raise PatchError('target checksum mismatch')
+
+    return count
+
+
+class PatchResult:
+    """Итог применения патча к одному файлу"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.operations = 0
+        self.size = 0  # размер файла после применения патча
+        self.original_size = 0
+        self.seconds = 0.0
+        self.error = None  # текст ошибки, если патч не применился
+        self.diff = []  # отличия (смещение, старые, новые) при dry_run
+        self.diff_truncated = False
+
+    @property
+    def throughput(self) -> float:
+        """Байт исходного файла в секунду"""
+        return self.original_size / self.seconds if self.seconds else 0.0
+
+
+def patch_file(filename: str, kind: str, patch, output: str = None,
+               dry_run=False, edit_memory: int = None,
+               diff_limit: int = DEFAULT_DIFF_LIMIT) -> PatchResult:
+    """Применяет к filename патч вида kind ('script', 'ips' или 'bps'):
+    для сценария patch - список строк, для остальных - имя файла патча.
+    Если dry_run истинно, файл не сохраняется, а в результат записываются
+    первые diff_limit отличий. Ошибки не выбрасываются, а записываются
+    в результат, поэтому функцию удобно вызывать в других процессах"""
+    result = PatchResult(filename)
+    start = time.perf_counter()
+    try:
+        result.original_size = os.path.getsize(filename)
+        editor = _open_editor(filename, output if not dry_run else filename,
+                              edit_memory, dry_run)
+        try:
+            if kind == 'script':
+                result.operations = _apply(editor, script=patch)
+            else:
+                with open(patch, 'rb') as fp:
+                    result.operations = _apply(editor, **{kind: fp})
+            result.size = editor.file_size
+            if dry_run:
+                for run in editor.diff():
+                    if len(result.diff) == diff_limit:
+                        result.diff_truncated = True
+                        break
+                    result.diff.append(run)
+            else:
+                editor.save_changes(filename if output is None else output)
+        finally:
+            editor.exit()
+    except (PatchError, OSError) as error:
+        result.error = str(error)
+    except Exception as error:
+        # ошибка в одном файле не должна останавливать остальные
+        result.error = f'{type(error).__name__}: {error}'
+    result.seconds = time.perf_counter() - start
+
+    return result
+
+
+def patch_files(filenames: list, kind: str, patch, output_dir: str = None,
+                dry_run=False, jobs: int = 1, edit_memory: int = None):
+    """Применяет один патч (см. patch_file) к каждому из файлов filenames,
+    при jobs > 1 в нескольких процессах. Если передан output_dir,
+    результаты записываются туда под теми же именами. Генератор PatchResult
+    в порядке завершения"""
+    def output(filename):
+        return os.path.join(output_dir, os.path.basename(filename)) \
+            if output_dir is not None else None
+
+    if jobs <= 1 or len(filenames) <= 1:
+        for filename in filenames:
+            yield patch_file(filename, kind, patch, output(filename),
+                             dry_run, edit_memory)
+        return
+    # как и поиск, процессы запускаются через spawn, а не fork, чтобы
+    # не копировать потоки вызывающего процесса
+    with ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(patch_file, filename, kind, patch,
+                                   output(filename), dry_run, edit_memory)
+                   for filename in filenames]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _open_editor(filename: str, output: str, edit_memory: int,
+                 is_readonly=False) -> HexEditor:
+    kwargs = {} if edit_memory is None else {'edit_memory': edit_memory}
+    # если результат пишется в другой файл, исходный не изменяется
+    is_readonly = is_readonly or output is not None and output != filename
+    return HexEditor(filename, is_readonly, cache_size=0,
+                     prefetch_screens=0, **kwargs)
+
+
+def _apply(editor: HexEditor, script=None, ips=None, bps=None) -> int:
+    if script is not None:
+        return apply_script(editor, script)
+    if ips is not None:
+        return apply_ips(editor, ips)
+    if bps is not None:
+        return apply_bps(editor, bps)
+    raise PatchError('no patch given')
+
+
+def _check_offset(editor: HexEditor, offset: int) -> None:
+    if offset > editor.file_size:
+        raise PatchError(f'offset {offset:#x} is past the end of file '
+                         f'({editor.file_size:#x})')
+
+
+def _check_range(offset: int, length: int, size: int) -> None:
+    if offset < 0 or offset + length > size:
+        raise PatchError('source read out of range')
+
+
+def _copy_target(editor: HexEditor, start: int, length: int) -> None:
+    """Дописывает в конец length байт, начиная со start. Копия может
+    перекрываться с дописываемыми байтами, тогда они повторяются"""
+    while length:
+        available = editor.file_size - start
+        count = min(length, available)
+        if count < FILL_CHUNK_SIZE and count < length:
+            # короткий повторяющийся кусок, например, RLE
+            pattern = editor.read(start, available)
+            count = min(length, FILL_CHUNK_SIZE)
+            data = (pattern * (count // len(pattern) + 1))[:count]
+            editor.insert(editor.file_size, data)
+        else:
+            # читаем кусок целиком до вставки, так как вставка изменяет
+            # регионы, по которым идет чтение
+            for position in range(start, start + count, FILL_CHUNK_SIZE):
+                editor.insert(editor.file_size, editor.read(
+                    position, min(FILL_CHUNK_SIZE, start + count - position)))
+        start += count
+        length -= count
+
+
+def _crc32(editor: HexEditor, start: int, end: int) -> int:
+    crc = 0
+    for chunk in editor.iter_chunks(start, end):
+        crc = zlib.crc32(chunk, crc)
+
+    return crc
+
+
+class _CrcReader:
+    """Читает файл и считает CRC32 прочитанного"""
+
+    def __init__(self, fp):
+        self._fp = fp
+        self.crc = 0
+        self.position = 0
+
+    def read(self, count: int) -> bytes:
+        data = self._fp.read(count)
+        self.crc = zlib.crc32(data, self.crc)
+        self.position += len(data)
+
+        return data
+
+
+def _read_exactly(fp, count: int) -> bytes:
+    data = fp.read(count)
+    if len(data) != count:
+        raise PatchError('unexpected end of patch')
+
+    return data
+
+
+def _read_varint(reader) -> int:
+    """Число в кодировке BPS: по 7 бит, старший бит отмечает последний
+    байт, а к каждому следующему байту прибавляется смещение"""
+    value = 0
+    shift = 1
+    while True:
+        byte = _read_exactly(reader, 1)[0]
+        value += (byte & 0x7f) * shift
+        if byte & 0x80:
+            return value
+        shift <<= 7
+        value += shift
+
+
+def _read_signed(reader) -> int:
+    value = _read_varint(reader)
+    return -(value >> 1) if value & 1 else value >> 1
+
+
+def _read_uint32(reader) -> int:
+    return int.from_bytes(_read_exactly(reader, 4), 'little')
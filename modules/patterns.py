@@ -0,0 +1,180 @@
+import re
+
+from modules.search import BackgroundSearch, DEFAULT_CHUNK_SIZE
+
+# максимальная длина вхождения регулярного выражения по умолчанию
+DEFAULT_MAX_MATCH_LENGTH = 4096
+
+WILDCARD = '??'
+
+
+class BytePattern:
+    """Шаблон поиска, заданный регулярным выражением над байтами. Вхождения
+    ищутся в окнах, поэтому их длина ограничена max_length: более длинные
+    вхождения обрезаются до max_length байт"""
+    overlapping = False
+
+    def __init__(self, regex: bytes,
+                 max_length: int = DEFAULT_MAX_MATCH_LENGTH):
+        if max_length <= 0:
+            raise ValueError('max_length must be positive')
+        self.regex = re.compile(regex, re.DOTALL)
+        self.max_length = max_length
+
+    def matches(self, chunk, pos: int, limit: int):
+        """Генератор пар (начало, конец) вхождений в chunk, начинающихся
+        в [pos; limit)"""
+        while pos < limit:
+            match = self.regex.search(chunk, pos)
+            if match is None or match.start() >= limit:
+                return
+            start = match.start()
+            if match.end() - start > self.max_length:
+                # вхождение длиннее, чем может поместиться в окно
+                match = self.regex.match(chunk, start, start + self.max_length)
+                if match is None:
+                    pos = start + 1
+                    continue
+            yield start, match.end()
+            pos = max(match.end(), start + 1)
+
+    def __repr__(self):
+        return f'BytePattern({self.regex.pattern!r}, {self.max_length})'
+
+
+class MaskedPattern(BytePattern):
+    """Шаблон фиксированной длины, в котором часть байт может быть любой,
+    например 4D 5A ?? ?? 50 45. Как и при поиске по точному совпадению,
+    возвращаются и перекрывающиеся вхождения"""
+    overlapping = True
+
+    def __init__(self, values: bytes, mask: list):
+        if not values or len(values) != len(mask):
+            raise ValueError('pattern must not be empty')
+        if not any(mask):
+            raise ValueError('pattern must contain at least one known byte')
+        self.values = bytes(values)
+        self.mask = list(mask)
+        # кандидаты во вхождения ищутся через bytes.find по самой длинной
+        # последовательности известных байт, которая стоит в шаблоне
+        # со сдвигом literal_offset, а проверяются регулярным выражением
+        self.literal, self.literal_offset = \
+            _longest_literal(self.values, self.mask)
+        regex = b''.join(re.escape(self.values[i:i + 1]) if known else b'.'
+                         for i, known in enumerate(self.mask))
+        super().__init__(regex, len(self.values))
+
+    def matches(self, chunk, pos: int, limit: int):
+        if all(self.mask):
+            # шаблон без пропусков
+            found = chunk.find(self.literal, pos)
+            while found != -1 and found < limit:
+                yield found, found + len(self.literal)
+                found = chunk.find(self.literal, found + 1)
+            return
+        found = chunk.find(self.literal, pos + self.literal_offset)
+        while found != -1:
+            start = found - self.literal_offset
+            if start >= limit:
+                return
+            if self.regex.match(chunk, start):
+                yield start, start + self.max_length
+            found = chunk.find(self.literal, found + 1)
+
+    def __str__(self):
+        return ' '.join(f'{value:02x}' if known else WILDCARD
+                        for value, known in zip(self.values, self.mask))
+
+    def __repr__(self):
+        return f'MaskedPattern({str(self)!r})'
+
+
+def parse_masked(value: str) -> MaskedPattern:
+    """Разбирает шаблон вида '4D 5A ?? ?? 50 45'. Пробелы необязательны,
+    если в последней группе нечетное число цифр, к последней из них
+    дописывается ведущий ноль"""
+    values = bytearray()
+    mask = []
+    for group in value.split():
+        for i in range(0, len(group), 2):
+            digits = group[i:i + 2]
+            if set(digits) == {'?'}:
+                values.append(0)
+                mask.append(False)
+            elif '?' in digits:
+                raise ValueError(f'half-byte wildcard {digits!r} '
+                                 f'is not supported')
+            else:
+                values.append(int(digits, 16))
+                mask.append(True)
+
+    return MaskedPattern(bytes(values), mask)
+
+
+def compile_regex(value, max_length: int = DEFAULT_MAX_MATCH_LENGTH) \
+        -> BytePattern:
+    """Шаблон по регулярному выражению value (str или bytes), вхождения
+    которого не длиннее max_length байт"""
+    if isinstance(value, str):
+        value = value.encode('latin-1')
+
+    return BytePattern(value, max_length)
+
+
+def find_all(read, size: int, pattern: BytePattern, start: int = 0,
+             chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Генератор смещений вхождений pattern, начинающихся не раньше start.
+    Файл читается кусками по chunk_size байт, к каждому куску дочитывается
+    pattern.max_length - 1 байт, чтобы найти вхождения, начинающиеся
+    в нем, но заканчивающиеся в следующем"""
+    position = max(start, 0)
+    # если вхождения не перекрываются, следующее ищется не раньше конца
+    # предыдущего, в том числе в следующем куске
+    resume = position
+    while position < size:
+        chunk_end = min(position + chunk_size, size)
+        read_end = min(chunk_end + pattern.max_length - 1, size)
+        chunk = read(position, read_end - position)
+        for match_start, match_end in pattern.matches(
+                chunk, max(resume - position, 0), chunk_end - position):
+            yield position + match_start
+            if not pattern.overlapping:
+                resume = position + match_end
+        position = chunk_end
+
+
+def find_next(read, size: int, pattern: BytePattern, start: int = 0,
+              chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Смещение первого вхождения pattern не раньше start или -1"""
+    return next(find_all(read, size, pattern, start, chunk_size), -1)
+
+
+class BackgroundPatternSearch(BackgroundSearch):
+    """Поиск первого вхождения шаблона в отдельном потоке по снимку
+    регионов файла"""
+
+    def __init__(self, filename: str, layout: list, size: int,
+                 pattern: BytePattern, start: int = 0,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(filename, layout, size, b'', start, chunk_size)
+        self.query = pattern
+
+    def _search(self, read) -> int:
+        return find_next(read, self.size, self.query, self.start_offset,
+                         self._chunk_size)
+
+
+def _longest_literal(values: bytes, mask: list) -> tuple:
+    """Самая длинная последовательность известных байт шаблона и ее сдвиг
+    от начала шаблона"""
+    best_start = best_length = 0
+    run_start = None
+    for i, known in enumerate(mask + [False]):
+        if known and run_start is None:
+            run_start = i
+        elif not known and run_start is not None:
+            if i - run_start > best_length:
+                best_start, best_length = run_start, i - run_start
+            run_start = None
+
+    return values[best_start:best_start + best_length], best_start
@@ -0,0 +1,119 @@
+import os
+import threading
+
+DEFAULT_SCREENS = 4
+# сколько обращений подряд в одну сторону считается последовательным чтением
+SEQUENTIAL_STREAK = 2
+
+
+class Prefetcher:
+    """Заранее читает в кэш блоков следующие экраны, когда байты читаются
+    последовательно в одну сторону, например, при листании PgDn. Чтение
+    идет в отдельном потоке, а ОС получает подсказки posix_fadvise"""
+
+    def __init__(self, fd: int, cache=None, screens: int = DEFAULT_SCREENS):
+        self.screens = screens
+        self.prefetched = 0  # байты, для которых был запрошен prefetch
+
+        self._fd = fd
+        self._cache = cache
+        self._last_offset = None
+        self._direction = 0
+        self._streak = 0
+        self._is_sequential_hinted = False
+
+        self._pending = None  # последний запрос, более старые не нужны
+        self._busy = False
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def direction(self) -> int:
+        """1, если байты читаются к концу файла, -1, если к началу, иначе 0"""
+        return self._direction if self._streak >= SEQUENTIAL_STREAK else 0
+
+    def access(self, offset: int, count: int, locate) -> None:
+        """Сообщает о чтении count байт со смещения offset. Если чтение
+        последовательное, запрашивает следующие screens таких же кусков.
+        locate(start, end) должна возвращать список пар (смещение в исходном
+        файле, длина) неизмененных байт из [start; end)"""
+        if self._last_offset is None or offset == self._last_offset:
+            direction = 0
+        else:
+            direction = 1 if offset > self._last_offset else -1
+        self._last_offset = offset
+        if direction and direction == self._direction:
+            self._streak += 1
+        else:
+            self._direction = direction
+            self._streak = 1 if direction else 0
+        if not self.direction or count <= 0:
+            return
+
+        if not self._is_sequential_hinted:
+            _advise(self._fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+            self._is_sequential_hinted = True
+        if self.direction > 0:
+            start = offset + count
+            end = start + count * self.screens
+        else:
+            end = offset
+            start = max(end - count * self.screens, 0)
+        ranges = locate(start, end)
+        if not ranges:
+            return
+        if self.direction < 0:
+            # читаем ближайшие к текущему месту байты первыми
+            ranges = ranges[::-1]
+        with self._condition:
+            self._pending = ranges
+            self._condition.notify()
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Ждет, пока не будут обработаны все запросы"""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._pending is None and not self._busy, timeout)
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._pending is not None or self._closed)
+                if self._closed:
+                    return
+                ranges, self._pending = self._pending, None
+                self._busy = True
+            try:
+                for original_start, length in ranges:
+                    _advise(self._fd, original_start, length,
+                            'POSIX_FADV_WILLNEED')
+                    if self._cache is not None:
+                        self._cache.prefetch(original_start, length)
+                    self.prefetched += length
+                    if self._pending is not None or self._closed:
+                        # пользователь ушел дальше, этот запрос устарел
+                        break
+            except (OSError, ValueError):
+                # файл мог быть закрыт, prefetch просто не нужен
+                pass
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+
+def _advise(fd: int, offset: int, length: int, advice: str) -> None:
+    """Подсказка ОС о том, как будет читаться файл, если она поддерживается"""
+    if hasattr(os, 'posix_fadvise') and hasattr(os, advice):
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, advice))
+        except OSError:
+            pass
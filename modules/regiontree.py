@@ -0,0 +1,252 @@
+import random
+
+
+class RegionNode:
+    """Узел декартова дерева регионов. В каждом узле хранятся суммарная длина
+    и количество регионов его поддерева, что позволяет за O(log n) находить
+    регион по смещению, а также вычислять смещение и индекс региона"""
+    # регионов могут быть миллионы, поэтому у узлов нет __dict__
+    __slots__ = ('_left', '_right', '_parent', '_priority', '_tree',
+                 '_length', '_subtree_length', '_subtree_count')
+
+    def __init__(self):
+        self._left = None
+        self._right = None
+        self._parent = None
+        self._priority = random.random()
+        self._tree = None  # дерево, которому принадлежит узел
+
+        self._length = 0
+        self._subtree_length = 0
+        self._subtree_count = 1
+
+    def _refresh(self) -> None:
+        """Пересчитывает суммарные длины после изменения длины узла"""
+        if self._tree is not None:
+            self._tree.update(self)
+
+
+class RegionTree:
+    """Сбалансированное (в среднем) дерево регионов файла, упорядоченное по
+    их положению в файле. Положение регионов явно не хранится, а вычисляется
+    по длинам регионов левее, поэтому вставка и удаление не требуют сдвига
+    остальных регионов"""
+
+    def __init__(self, regions=()):
+        self._root = None
+        for region in regions:
+            self.insert_before(None, region)
+
+    @property
+    def length(self) -> int:
+        """Суммарная длина всех регионов"""
+        return _subtree_length(self._root)
+
+    def __len__(self) -> int:
+        return _subtree_count(self._root)
+
+    def __iter__(self):
+        node = self.first()
+        while node is not None:
+            yield node
+            node = self.successor(node)
+
+    def __getitem__(self, index: int) -> RegionNode:
+        """Возвращает регион по его порядковому номеру"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('region index out of range')
+        node = self._root
+        while True:
+            left_count = _subtree_count(node._left)
+            if index < left_count:
+                node = node._left
+            elif index == left_count:
+                return node
+            else:
+                index -= left_count + 1
+                node = node._right
+
+    def __repr__(self):
+        return f'RegionTree({list(self)})'
+
+    def find(self, offset: int):
+        """Возвращает регион, содержащий байт со смещением offset, или None,
+        если смещение вне дерева"""
+        node = self._root
+        while node is not None:
+            left = node._left
+            left_length = left._subtree_length if left is not None else 0
+            if offset < left_length:
+                node = left
+            elif offset < left_length + node._length:
+                return node
+            else:
+                offset -= left_length + node._length
+                node = node._right
+
+        return None
+
+    def offset_of(self, node: RegionNode) -> int:
+        """Смещение первого байта региона node"""
+        offset = _subtree_length(node._left)
+        while node._parent is not None:
+            parent = node._parent
+            if node is parent._right:
+                offset += _subtree_length(parent._left) + parent._length
+            node = parent
+
+        return offset
+
+    def index_of(self, node: RegionNode) -> int:
+        """Порядковый номер региона node"""
+        index = _subtree_count(node._left)
+        while node._parent is not None:
+            parent = node._parent
+            if node is parent._right:
+                index += _subtree_count(parent._left) + 1
+            node = parent
+
+        return index
+
+    def first(self):
+        return _leftmost(self._root) if self._root is not None else None
+
+    def last(self):
+        return _rightmost(self._root) if self._root is not None else None
+
+    @staticmethod
+    def successor(node: RegionNode):
+        """Следующий по порядку регион или None"""
+        if node._right is not None:
+            return _leftmost(node._right)
+        while node._parent is not None and node is node._parent._right:
+            node = node._parent
+
+        return node._parent
+
+    @staticmethod
+    def predecessor(node: RegionNode):
+        """Предыдущий по порядку регион или None"""
+        if node._left is not None:
+            return _rightmost(node._left)
+        while node._parent is not None and node is node._parent._left:
+            node = node._parent
+
+        return node._parent
+
+    def insert_before(self, anchor, node: RegionNode) -> None:
+        """Вставляет node перед регионом anchor, либо в конец,
+        если anchor равен None"""
+        node._left = node._right = node._parent = None
+        node._subtree_length = node._length
+        node._subtree_count = 1
+        node._tree = self
+        if self._root is None:
+            self._root = node
+            return
+
+        if anchor is None:
+            parent = _rightmost(self._root)
+            parent._right = node
+        elif anchor._left is None:
+            parent = anchor
+            parent._left = node
+        else:
+            parent = _rightmost(anchor._left)
+            parent._right = node
+        node._parent = parent
+        self.update(parent)
+
+        # поднимаем узел, пока не восстановится порядок приоритетов
+        while (node._parent is not None
+               and node._priority > node._parent._priority):
+            self._rotate_up(node)
+
+    def remove(self, node: RegionNode) -> None:
+        """Удаляет регион node из дерева"""
+        # опускаем узел, пока у него есть оба потомка
+        while node._left is not None and node._right is not None:
+            if node._left._priority > node._right._priority:
+                self._rotate_up(node._left)
+            else:
+                self._rotate_up(node._right)
+
+        child = node._left if node._left is not None else node._right
+        parent = node._parent
+        if child is not None:
+            child._parent = parent
+        if parent is None:
+            self._root = child
+        elif parent._left is node:
+            parent._left = child
+        else:
+            parent._right = child
+        if parent is not None:
+            self.update(parent)
+
+        node._left = node._right = node._parent = None
+        node._tree = None
+
+    def update(self, node: RegionNode) -> None:
+        """Пересчитывает суммарные значения от node до корня"""
+        while node is not None:
+            _recalculate(node)
+            node = node._parent
+
+    def _rotate_up(self, node: RegionNode) -> None:
+        """Поворачивает дерево так, что node занимает место своего родителя"""
+        parent = node._parent
+        grandparent = parent._parent
+        if node is parent._left:
+            parent._left = node._right
+            if parent._left is not None:
+                parent._left._parent = parent
+            node._right = parent
+        else:
+            parent._right = node._left
+            if parent._right is not None:
+                parent._right._parent = parent
+            node._left = parent
+        parent._parent = node
+
+        node._parent = grandparent
+        if grandparent is None:
+            self._root = node
+        elif grandparent._left is parent:
+            grandparent._left = node
+        else:
+            grandparent._right = node
+
+        _recalculate(parent)
+        _recalculate(node)
+
+
+def _subtree_length(node) -> int:
+    return node._subtree_length if node is not None else 0
+
+
+def _subtree_count(node) -> int:
+    return node._subtree_count if node is not None else 0
+
+
+def _recalculate(node: RegionNode) -> None:
+    node._subtree_length = (_subtree_length(node._left)
+                            + node._length
+                            + _subtree_length(node._right))
+    node._subtree_count = (_subtree_count(node._left)
+                           + 1
+                           + _subtree_count(node._right))
+
+
+def _leftmost(node: RegionNode) -> RegionNode:
+    while node._left is not None:
+        node = node._left
+    return node
+
+
+def _rightmost(node: RegionNode) -> RegionNode:
+    while node._right is not None:
+        node = node._right
+    return node
@@ -0,0 +1,343 @@
+import errno
+import os
+import stat
+import tempfile
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# размер блоков, которыми измененные данные сравниваются с данными на диске
+DIFF_BLOCK_SIZE = 4096
+
+
+class SavePlan:
+    """План сохранения изменений в исходный файл на месте. Перемещения
+    неизмененных регионов перечислены в порядке, в котором их можно
+    выполнить, не затерев еще не прочитанные данные"""
+
+    def __init__(self, file_size: int):
+        self.file_size = file_size
+        self.moves = []  # кортежи (откуда, куда, длина)
+        self.writes = []  # кортежи (смещение, данные) измененных регионов
+
+    @classmethod
+    def from_layout(cls, layout: list, file_size: int) -> 'SavePlan':
+        """Строит план по описанию регионов из FileModel.layout"""
+        plan = cls(file_size)
+        backward = []
+        for start, length, original_start, data in layout:
+            if data is not None:
+                if length:
+                    plan.writes.append((start, data))
+            elif original_start > start:
+                # регионы, сдвинутые к началу файла, копируются по порядку
+                plan.moves.append((original_start, start, length))
+            elif original_start < start:
+                backward.append((original_start, start, length))
+        # регионы, сдвинутые к концу файла, копируются начиная с последнего
+        plan.moves.extend(reversed(backward))
+
+        return plan
+
+    def apply(self, fd: int, chunk_size: int = DEFAULT_CHUNK_SIZE,
+              stats=None) -> int:
+        """Выполняет план над файлом с дескриптором fd. Возвращает
+        количество записанных байт. Системные вызовы учитываются в stats
+        (EngineStats), если он не None"""
+        written = 0
+        for source, destination, length in self.moves:
+            written += _move(fd, source, destination, length, chunk_size,
+                             stats)
+        # перемещения не пишут туда, где окажутся измененные данные, поэтому
+        # их можно сравнивать с тем, что лежит на диске сейчас
+        disk_size = os.fstat(fd).st_size
+        for offset, data in _coalesce(self.diff(fd, disk_size, stats),
+                                      chunk_size):
+            _write_all(fd, data, offset, stats)
+            written += len(data)
+        os.ftruncate(fd, self.file_size)
+
+        return written
+
+    def diff(self, fd: int, disk_size: int, stats=None):
+        """Генератор пар (смещение, данные) участков измененных регионов,
+        которые отличаются от данных на диске"""
+        for offset, data in self.writes:
+            yield from diff_runs(fd, offset, memoryview(data), disk_size,
+                                 stats)
+
+
+def is_in_order(layout: list) -> bool:
+    """Идут ли неизмененные регионы из FileModel.layout в том же порядке,
+    что и в исходном файле, без повторов. Только такие изменения можно
+    сохранить на месте"""
+    end = 0
+    for _, length, original_start, data in layout:
+        if data is None and length:
+            if original_start < end:
+                return False
+            end = original_start + length
+
+    return True
+
+
+def _write_all(fd: int, data, offset: int, stats=None) -> None:
+    """Записывает data целиком, os.pwrite может записать только часть"""
+    data = memoryview(data)
+    while data:
+        count = os.pwrite(fd, data, offset)
+        if stats is not None:
+            stats.count_write(count)
+        data = data[count:]
+        offset += count
+
+
+def _pread(fd: int, count: int, offset: int, stats=None) -> bytes:
+    data = os.pread(fd, count, offset)
+    if stats is not None:
+        stats.count_read(len(data), offset)
+
+    return data
+
+
+def _move(fd: int, source: int, destination: int, length: int,
+          chunk_size: int, stats=None) -> int:
+    """Копирует length байт со смещения source на destination кусками,
+    границы которых выровнены по chunk_size в месте назначения. Если
+    destination > source, копирует с конца, чтобы не затереть источник"""
+    pieces = []
+    position = destination
+    end = destination + length
+    while position < end:
+        piece_end = min((position // chunk_size + 1) * chunk_size, end)
+        pieces.append((position - destination, piece_end - position))
+        position = piece_end
+    if destination > source:
+        pieces.reverse()
+    for shift, count in pieces:
+        _write_all(fd, _pread(fd, count, source + shift, stats),
+                   destination + shift, stats)
+
+    return length
+
+
+def diff_runs(fd: int, offset: int, data: memoryview, disk_size: int,
+              stats=None):
+    """Генератор пар (смещение, данные) участков data, отличающихся от
+    байт на диске по смещению offset. Внутри участка могут быть совпадающие
+    байты, но участки начинаются и заканчиваются отличающимися байтами"""
+    run_start = run_end = None
+    for block_start in range(0, len(data), DIFF_BLOCK_SIZE):
+        block = data[block_start:block_start + DIFF_BLOCK_SIZE]
+        if offset + block_start < disk_size:
+            on_disk = _pread(fd, len(block), offset + block_start, stats)
+        else:
+            on_disk = b''
+        if block == on_disk:
+            if run_start is not None:
+                yield _trimmed(fd, offset, data, run_start, run_end,
+                               disk_size, stats)
+                run_start = None
+            continue
+        if run_start is None:
+            run_start = block_start
+        run_end = block_start + len(block)
+    if run_start is not None:
+        yield _trimmed(fd, offset, data, run_start, run_end, disk_size,
+                       stats)
+
+
+def _trimmed(fd: int, offset: int, data: memoryview, start: int, end: int,
+             disk_size: int, stats=None) -> tuple:
+    """Сужает отличающийся участок [start; end) data до первого
+    и последнего отличающегося байта"""
+    head = data[start:min(start + DIFF_BLOCK_SIZE, end)]
+    start += common_prefix(head, _pread(fd, len(head), offset + start,
+                                        stats))
+    if offset + end <= disk_size:
+        tail_start = max(end - DIFF_BLOCK_SIZE, start)
+        tail = data[tail_start:end]
+        on_disk = _pread(fd, len(tail), offset + tail_start, stats)
+        end -= common_prefix(bytes(tail)[::-1], on_disk[::-1])
+
+    return offset + start, data[start:end]
+
+
+def common_prefix(first, second) -> int:
+    """Длина общего начала first и second"""
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+
+    return low
+
+
+def _coalesce(runs, limit: int):
+    """Склеивает участки, идущие вплотную друг к другу, в буферы не больше
+    limit байт, чтобы записать их одним вызовом. Участки длиннее limit
+    возвращаются как есть"""
+    offset = None
+    buffer = bytearray()
+    for run_offset, data in runs:
+        if offset is not None and offset + len(buffer) == run_offset \
+                and len(buffer) + len(data) <= limit:
+            buffer += data
+            continue
+        if offset is not None:
+            yield offset, buffer
+        if len(data) > limit:
+            offset = None
+            yield run_offset, data
+        else:
+            offset, buffer = run_offset, bytearray(data)
+    if offset is not None:
+        yield offset, buffer
+
+
+class RangeCopier:
+    """Копирует диапазоны байт между файлами средствами ядра: через
+    os.copy_file_range, если его нет или файловая система его не
+    поддерживает, через os.sendfile, иначе через промежуточный буфер.
+    Системные вызовы учитываются в stats (EngineStats), если он не None"""
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, stats=None):
+        self.chunk_size = chunk_size
+        self.stats = stats
+        self.use_copy_file_range = hasattr(os, 'copy_file_range')
+        self.use_sendfile = hasattr(os, 'sendfile')
+
+    def copy(self, source_fd: int, source_offset: int, destination_fd: int,
+             destination_offset: int, length: int) -> None:
+        """Копирует length байт source_fd со смещения source_offset
+        в destination_fd по смещению destination_offset. Если исходный
+        файл кончился раньше, бросает OSError"""
+        copied = 0
+        if self.use_copy_file_range:
+            try:
+                copied = self._copy_loop(
+                    lambda offset, count: self._counted(os.copy_file_range(
+                        source_fd, destination_fd, count,
+                        source_offset + offset, destination_offset + offset)),
+                    length)
+            except OSError as error:
+                if error.errno not in _UNSUPPORTED_ERRORS:
+                    raise
+                self.use_copy_file_range = False
+        if copied < length and self.use_sendfile:
+            # sendfile пишет с текущей позиции файла назначения
+            os.lseek(destination_fd, destination_offset + copied, os.SEEK_SET)
+            start = copied
+            try:
+                copied += self._copy_loop(
+                    lambda offset, count: self._counted(os.sendfile(
+                        destination_fd, source_fd,
+                        source_offset + start + offset, count)),
+                    length - copied)
+            except OSError as error:
+                if error.errno not in _UNSUPPORTED_ERRORS:
+                    raise
+                self.use_sendfile = False
+                # часть байт могла быть скопирована до ошибки
+                copied = os.lseek(destination_fd, 0, os.SEEK_CUR) \
+                    - destination_offset
+        if copied < length:
+            start = copied
+            copied += self._copy_loop(
+                lambda offset, count: self._pwrite(
+                    destination_fd,
+                    _pread(source_fd, count, source_offset + start + offset,
+                           self.stats),
+                    destination_offset + start + offset),
+                length - copied)
+        if copied < length:
+            # исходный файл оказался короче, чем ожидалось, например, его
+            # обрезали: недостающие байты остались бы нулями
+            raise OSError(errno.EIO, f'source file ended after {copied} '
+                                     f'of {length} bytes')
+
+    def _copy_loop(self, copy_chunk, length: int) -> int:
+        """Вызывает copy_chunk(сдвиг, количество), пока не будет скопировано
+        length байт или не будет достигнут конец исходного файла"""
+        copied = 0
+        while copied < length:
+            count = copy_chunk(copied, min(self.chunk_size, length - copied))
+            if not count:
+                break
+            copied += count
+
+        return copied
+
+    def _pwrite(self, fd: int, data, offset: int) -> int:
+        count = os.pwrite(fd, data, offset)
+        if self.stats is not None:
+            self.stats.count_write(count)
+
+        return count
+
+    def _counted(self, count: int) -> int:
+        if self.stats is not None:
+            self.stats.count_copy(count)
+
+        return count
+
+
+_UNSUPPORTED_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                       errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP}
+
+
+def save_as(layout: list, source_fd: int, filename: str,
+            chunk_size: int = DEFAULT_CHUNK_SIZE,
+            copier: RangeCopier = None, stats=None) -> None:
+    """Атомарно сохраняет файл, описанный регионами из FileModel.layout, под
+    именем filename. Файл собирается во временном файле рядом с filename:
+    неизмененные регионы копируются из source_fd средствами ядра, а затем
+    временный файл сбрасывается на диск и заменяет filename"""
+    copier = RangeCopier(chunk_size, stats) if copier is None else copier
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_name = tempfile.mkstemp(
+        prefix=f'.{os.path.basename(filename)}.', suffix='.tmp',
+        dir=directory)
+    try:
+        try:
+            mode = os.stat(filename).st_mode
+        except FileNotFoundError:
+            mode = os.fstat(source_fd).st_mode
+        os.fchmod(fd, stat.S_IMODE(mode))
+
+        size = 0
+        writes = []
+        for start, length, original_start, data in layout:
+            if data is None:
+                copier.copy(source_fd, original_start, fd, start, length)
+            else:
+                writes.append((start, data))
+            size = start + length
+        for offset, data in _coalesce(writes, chunk_size):
+            _write_all(fd, data, offset, stats)
+        # у файла могли остаться незаписанными последние байты
+        os.ftruncate(fd, size)
+        os.fsync(fd)
+    except BaseException:
+        os.close(fd)
+        os.remove(temp_name)
+        raise
+    os.close(fd)
+    os.replace(temp_name, filename)
+    _fsync_directory(directory)
+
+
+def _fsync_directory(directory: str) -> None:
+    """Сбрасывает на диск запись каталога, чтобы переименование пережило
+    сбой питания"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
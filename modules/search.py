@@ -0,0 +1,330 @@
+import bisect
+import collections
+import itertools
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from modules.addbuffer import SpilledSlice
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_SHARD_SIZE = 64 * 1024 * 1024
+
+
+def find_all(read, size: int, query: bytes, start: int = 0,
+             chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Генератор смещений всех вхождений query, начинающихся не раньше start.
+    read(offset, count) должна возвращать count байт со смещения offset.
+    Файл читается кусками по chunk_size байт, соседние куски перекрываются
+    на len(query) - 1 байт, чтобы не пропустить вхождения на их границе"""
+    if not query:
+        return
+    overlap = len(query) - 1
+    position = max(start, 0)
+    while position < size:
+        chunk_start = max(position - overlap, max(start, 0))
+        chunk_end = min(position + chunk_size, size)
+        chunk = read(chunk_start, chunk_end - chunk_start)
+        found = chunk.find(query)
+        while found != -1:
+            yield chunk_start + found
+            found = chunk.find(query, found + 1)
+        position = chunk_end
+
+
+def find_next(read, size: int, query: bytes, start: int = 0,
+              chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Смещение первого вхождения query не раньше start или -1"""
+    return next(find_all(read, size, query, start, chunk_size), -1)
+
+
+def find_prev(read, size: int, query: bytes, start: int = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Смещение последнего вхождения query, начинающегося раньше start,
+    или -1. Если start не передан, ищет с конца файла"""
+    if not query:
+        return -1
+    overlap = len(query) - 1
+    position = size if start is None else min(start, size)
+    while position > 0:
+        chunk_start = max(position - chunk_size, 0)
+        chunk_end = min(position + overlap, size)
+        chunk = read(chunk_start, chunk_end - chunk_start)
+        # вхождение, начинающееся не раньше position, в кусок не поместится
+        found = chunk.rfind(query)
+        if found != -1:
+            return chunk_start + found
+        position = chunk_start
+
+    return -1
+
+
+def parallel_find_all(filename: str, layout: list, size: int, query: bytes,
+                      start: int = 0, first_only=False, workers: int = None,
+                      shard_size: int = DEFAULT_SHARD_SIZE,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE, progress=None):
+    """Генератор смещений вхождений query не раньше start, поиск в котором
+    идет параллельно в нескольких процессах. Файл делится на куски по
+    shard_size байт, перекрывающиеся на len(query) - 1 байт, каждый процесс
+    сам читает исходный файл filename, а измененные данные получает из
+    layout (см. FileModel.snapshot с portable). Если first_only,
+    останавливается на первом найденном вхождении, и куски после него
+    не ищутся. После каждого куска вызывается progress(конец куска),
+    исключение из него останавливает поиск"""
+    if not query:
+        return
+    overlap = len(query) - 1
+    starts = [piece[0] for piece in layout]
+
+    def shards():
+        for shard_start in range(max(start, 0), size, shard_size):
+            shard_end = min(shard_start + shard_size, size)
+            read_end = min(shard_end + overlap, size)
+            yield (filename, shard_pieces(layout, starts, shard_start,
+                                          read_end),
+                   shard_start, shard_end, read_end, query, first_only,
+                   chunk_size)
+
+    # результаты приходят в порядке кусков, поэтому смещения возвращаются
+    # по возрастанию
+    for index, matches in enumerate(
+            map_in_processes(_find_in_shard, shards(), workers), 1):
+        if progress is not None:
+            progress(min(max(start, 0) + index * shard_size, size))
+        yield from matches
+        if first_only and matches:
+            return
+
+
+def parallel_find_next(filename: str, layout: list, size: int,
+                       query: bytes, start: int = 0, workers: int = None,
+                       shard_size: int = DEFAULT_SHARD_SIZE,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Смещение первого вхождения query не раньше start или -1"""
+    return next(parallel_find_all(filename, layout, size, query, start, True,
+                                  workers, shard_size, chunk_size), -1)
+
+
+def map_in_processes(function, calls, workers: int = None):
+    """Генератор результатов function(*аргументы) для аргументов из calls
+    в порядке calls. Вызовы выполняются в workers процессах, запущенных
+    через spawn, и одновременно отправлено не больше workers вызовов: если
+    генератор остановить, следующие аргументы не создаются и не
+    передаются в процессы"""
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context('spawn'))
+    calls = iter(calls)
+    futures = collections.deque(
+        executor.submit(function, *arguments)
+        for arguments in itertools.islice(calls, workers))
+    try:
+        while futures:
+            result = futures.popleft().result()
+            for arguments in itertools.islice(calls, 1):
+                futures.append(executor.submit(function, *arguments))
+            yield result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def clip_layout(layout: list, start: int, end: int):
+    """Регионы layout, обрезанные по [start; end)"""
+    for position, length, original_start, data in layout:
+        shift = max(start - position, 0)
+        length = min(position + length, end) - position - shift
+        if length <= 0:
+            continue
+        if data is None:
+            yield position + shift, length, original_start + shift, None
+        else:
+            yield position + shift, length, None, data[shift:shift + length]
+
+
+def shard_pieces(layout: list, starts: list, start: int, end: int) -> list:
+    """Регионы layout, обрезанные по [start; end), для процесса, который
+    обрабатывает этот кусок файла. starts - начала регионов layout"""
+    return list(clip_layout(
+        layout[max(bisect.bisect_right(starts, start) - 1, 0):
+               bisect.bisect_left(starts, end)], start, end))
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+class BackgroundSearch:
+    """Поиск первого вхождения query в отдельном потоке. Поиск идет по
+    снимку регионов layout (см. FileModel.layout), поэтому правки, сделанные
+    во время поиска, на результат не влияют"""
+
+    def __init__(self, filename: str, layout: list, size: int, query: bytes,
+                 start: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 workers: int = 1, shard_size: int = DEFAULT_SHARD_SIZE):
+        self.query = query
+        self.start_offset = start
+        self.size = size
+        self.result = None  # смещение вхождения или -1, когда поиск закончен
+        self.error = None  # исключение, которым завершился поиск
+        self.scanned = 0
+
+        self._filename = filename
+        self._layout = layout
+        self._chunk_size = chunk_size
+        # если workers больше 1, поиск идет в процессах (см.
+        # parallel_find_all), и layout должен быть переносимым
+        self._workers = workers
+        self._shard_size = shard_size
+        self._started_at = None
+        self._finished_at = None
+        self._done = threading.Event()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> 'BackgroundSearch':
+        self._started_at = time.monotonic()
+        self._thread.start()
+        return self
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def throughput(self) -> float:
+        """Скорость поиска в байтах в секунду"""
+        if self._started_at is None:
+            return 0.0
+        finished_at = self._finished_at or time.monotonic()
+        elapsed = finished_at - self._started_at
+        return self.scanned / elapsed if elapsed else 0.0
+
+    def _run(self) -> None:
+        try:
+            if self._workers > 1:
+                self.result = self._parallel_search(self._progress)
+                return
+            with open(self._filename, 'rb') as fp:
+                reader = PieceReader(fp, self._layout)
+                try:
+                    self.result = self._search(self._read(reader.read))
+                finally:
+                    reader.close()
+        except SearchCancelled:
+            pass
+        except Exception as error:
+            self.error = error
+        finally:
+            self._finished_at = time.monotonic()
+            self._done.set()
+
+    def _search(self, read):
+        return find_next(read, self.size, self.query, self.start_offset,
+                         self._chunk_size)
+
+    def _parallel_search(self, progress):
+        return next(parallel_find_all(
+            self._filename, self._layout, self.size, self.query,
+            self.start_offset, True, self._workers, self._shard_size,
+            self._chunk_size, progress), -1)
+
+    def _progress(self, offset: int) -> None:
+        """Отмечает, что просмотрено все до offset, и прерывает поиск, если
+        он отменен"""
+        if self._cancelled.is_set():
+            raise SearchCancelled
+        self.scanned = offset - self.start_offset
+
+    def _read(self, read):
+        def read_and_track(offset: int, count: int):
+            if self._cancelled.is_set():
+                raise SearchCancelled
+            data = read(offset, count)
+            self.scanned = offset + count - self.start_offset
+            return data
+
+        return read_and_track
+
+
+class PieceReader:
+    """Читает байты файла, описанного кусками из FileModel.layout, напрямую
+    из исходного файла и переданных измененных данных. Данные SpilledSlice
+    читаются из временного файла буфера добавлений"""
+
+    def __init__(self, fp, pieces: list):
+        self._pieces = pieces
+        self._starts = [piece[0] for piece in pieces]
+        self._spilled = {}  # имя временного файла -> дескриптор
+        self._mmap = None
+        if os.fstat(fp.fileno()).st_size:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, offset: int, count: int) -> bytearray:
+        result = bytearray()
+        index = max(bisect.bisect_right(self._starts, offset) - 1, 0)
+        while count > 0 and index < len(self._pieces):
+            start, length, original_start, data = self._pieces[index]
+            skip = offset - start
+            to_read = min(length - skip, count)
+            if data is None:
+                result += self._mmap[original_start + skip:
+                                     original_start + skip + to_read]
+            elif isinstance(data, SpilledSlice):
+                result += os.pread(self._spilled_fd(data.filename), to_read,
+                                   data.offset + skip)
+            else:
+                result += data[skip:skip + to_read]
+            offset += to_read
+            count -= to_read
+            index += 1
+
+        return result
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        for fd in self._spilled.values():
+            os.close(fd)
+        self._spilled = {}
+
+    def _spilled_fd(self, filename: str) -> int:
+        fd = self._spilled.get(filename)
+        if fd is None:
+            fd = self._spilled[filename] = os.open(filename, os.O_RDONLY)
+
+        return fd
+
+
+def _find_in_shard(filename: str, pieces: list, shard_start: int,
+                   shard_end: int, read_end: int, query: bytes,
+                   first_only: bool, chunk_size: int) -> list:
+    """Ищет вхождения query, начинающиеся в [shard_start; shard_end).
+    Выполняется в отдельном процессе"""
+    matches = []
+    with open(filename, 'rb') as fp:
+        reader = PieceReader(fp, pieces)
+        try:
+            for offset in find_all(reader.read, read_end, query, shard_start,
+                                   chunk_size):
+                if offset >= shard_end:
+                    break
+                matches.append(offset)
+                if first_only:
+                    break
+        finally:
+            reader.close()
+
+    return matches
@@ -0,0 +1,144 @@
+import bisect
+import re
+from array import array
+
+from modules.search import BackgroundSearch, DEFAULT_CHUNK_SIZE
+
+# сигнатуры распространенных форматов файлов
+DEFAULT_SIGNATURES = {
+    'zip': b'PK\x03\x04',
+    'elf': b'\x7fELF',
+    'png': b'\x89PNG\r\n\x1a\n',
+    'gzip': b'\x1f\x8b\x08',
+    'jpeg': b'\xff\xd8\xff',
+    'gif87a': b'GIF87a',
+    'gif89a': b'GIF89a',
+    'pdf': b'%PDF-',
+    'bzip2': b'BZh',
+    'xz': b'\xfd7zXZ\x00',
+    '7z': b"7z\xbc\xaf'\x1c",
+    'rar': b'Rar!\x1a\x07',
+    'sqlite': b'SQLite format 3\x00',
+    'cab': b'MSCF\x00\x00\x00\x00',
+    'squashfs': b'hsqs',
+    'ubi': b'UBI#',
+}
+
+
+class SignatureMatcher:
+    """Одновременный поиск нескольких шаблонов за один проход по файлу.
+    Места, где может начинаться вхождение, ищет регулярное выражение из
+    всех шаблонов, которое работает на C, а в каждом таком месте
+    проверяются только шаблоны, начинающиеся с того же байта"""
+
+    def __init__(self, patterns: list):
+        self.patterns = [bytes(pattern) for pattern in patterns]
+        if not all(self.patterns):
+            raise ValueError('patterns must not be empty')
+
+        self._by_first_byte = {}  # первый байт -> номера шаблонов
+        for index, pattern in enumerate(self.patterns):
+            self._by_first_byte.setdefault(pattern[0], []).append(index)
+        self._candidates = re.compile(b'|'.join(map(re.escape,
+                                                    self.patterns)))
+        self._max_length = max(map(len, self.patterns))
+
+    def scan(self, read, size: int, start: int = 0,
+             chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """Генератор пар (смещение, номер шаблона) для всех вхождений
+        шаблонов, начинающихся не раньше start, по порядку смещений"""
+        # последние байты куска, вхождения с которых могут не поместиться
+        # в кусок, проверяются вместе со следующим куском
+        overlap = self._max_length - 1
+        carry = b''
+        position = max(start, 0)
+        while position < size:
+            count = min(chunk_size, size - position)
+            data = carry + bytes(read(position, count))
+            base = position - len(carry)
+            position += count
+            limit = len(data) if position >= size \
+                else max(len(data) - overlap, 0)
+            candidate = self._candidates.search(data, 0, len(data))
+            while candidate is not None and candidate.start() < limit:
+                offset = candidate.start()
+                for pattern in self._match_at(data, offset):
+                    yield base + offset, pattern
+                candidate = self._candidates.search(data, offset + 1)
+            carry = data[limit:]
+
+    def _match_at(self, data: bytes, offset: int) -> list:
+        """Номера шаблонов, начинающихся в data со сдвига offset"""
+        return [index for index in self._by_first_byte[data[offset]]
+                if data.startswith(self.patterns[index], offset)]
+
+
+class SignatureHits:
+    """Компактная таблица найденных сигнатур: смещения вхождений и номера
+    сигнатур, упорядоченные по смещению"""
+
+    def __init__(self, names: list):
+        self.names = names
+        self.offsets = array('q')
+        self.patterns = array('I')
+
+    @classmethod
+    def collect(cls, names: list, hits) -> 'SignatureHits':
+        """Строит таблицу по парам (смещение, номер сигнатуры), идущим
+        по порядку смещений"""
+        table = cls(names)
+        for offset, pattern in hits:
+            table.offsets.append(offset)
+            table.patterns.append(pattern)
+        return table
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> tuple:
+        return self.offsets[index], self.names[self.patterns[index]]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def next_after(self, offset: int) -> int:
+        """Номер первого вхождения со смещением больше offset или -1"""
+        index = bisect.bisect_right(self.offsets, offset)
+        return index if index < len(self) else -1
+
+    def prev_before(self, offset: int) -> int:
+        """Номер последнего вхождения со смещением меньше offset или -1"""
+        return bisect.bisect_left(self.offsets, offset) - 1
+
+    def counts(self) -> dict:
+        """Количество вхождений каждой сигнатуры"""
+        result = dict.fromkeys(self.names, 0)
+        for pattern in self.patterns:
+            result[self.names[pattern]] += 1
+        return result
+
+
+def scan_signatures(read, size: int, signatures: dict = None, start: int = 0,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> SignatureHits:
+    """Находит за один проход все вхождения сигнатур signatures
+    (по умолчанию DEFAULT_SIGNATURES), начинающиеся не раньше start"""
+    signatures = DEFAULT_SIGNATURES if signatures is None else signatures
+    matcher = SignatureMatcher(list(signatures.values()))
+    return SignatureHits.collect(
+        list(signatures), matcher.scan(read, size, start, chunk_size))
+
+
+class BackgroundSignatureScan(BackgroundSearch):
+    """Поиск сигнатур в отдельном потоке по снимку регионов файла"""
+
+    def __init__(self, filename: str, layout: list, size: int,
+                 signatures: dict = None, start: int = 0,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        signatures = DEFAULT_SIGNATURES if signatures is None else signatures
+        super().__init__(filename, layout, size, b'', start, chunk_size)
+        self.signatures = signatures
+
+    def _search(self, read) -> SignatureHits:
+        return scan_signatures(read, self.size, self.signatures,
+                               self.start_offset, self._chunk_size)
@@ -0,0 +1,143 @@
+import functools
+import json
+import logging
+import threading
+import time
+
+
+class EngineStats:
+    """Счетчики работы движка: системные вызовы чтения, записи
+    и копирования файлов и время, проведенное в публичных методах HexEditor.
+    Пока статистика не включена (см. HexEditor.enable_stats), счетчики
+    не обновляются. Счетчики обновляются и из потока prefetch, поэтому
+    под блокировкой"""
+
+    def __init__(self):
+        self.disk_reads = 0  # вызовы read и pread исходного файла
+        self.bytes_read = 0
+        self.seeks = 0  # чтения не с того места, где кончилось предыдущее
+        self.disk_writes = 0  # вызовы pwrite
+        self.bytes_written = 0
+        self.disk_copies = 0  # вызовы copy_file_range и sendfile
+        self.bytes_copied = 0
+        self.calls = {}  # имя метода -> [число вызовов, время в секундах]
+        self._next_read = None  # смещение сразу за последним чтением
+        self._lock = threading.Lock()
+
+    def count_read(self, count: int, offset: int = None) -> None:
+        """Учитывает чтение count байт со смещения offset (None, если
+        смещение неизвестно)"""
+        with self._lock:
+            self.disk_reads += 1
+            self.bytes_read += count
+            if offset is not None:
+                if self._next_read is not None and offset != self._next_read:
+                    self.seeks += 1
+                self._next_read = offset + count
+
+    def count_write(self, count: int) -> None:
+        with self._lock:
+            self.disk_writes += 1
+            self.bytes_written += count
+
+    def count_copy(self, count: int) -> None:
+        with self._lock:
+            self.disk_copies += 1
+            self.bytes_copied += count
+
+    def add_call(self, name: str, seconds: float) -> None:
+        with self._lock:
+            call = self.calls.get(name)
+            if call is None:
+                self.calls[name] = [1, seconds]
+            else:
+                call[0] += 1
+                call[1] += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'disk': {'reads': self.disk_reads, 'bytes': self.bytes_read,
+                         'seeks': self.seeks, 'writes': self.disk_writes,
+                         'bytes_written': self.bytes_written,
+                         'copies': self.disk_copies,
+                         'bytes_copied': self.bytes_copied},
+                'calls': {name: {'calls': count, 'seconds': seconds}
+                          for name, (count, seconds) in self.calls.items()},
+            }
+
+
+def timed(method):
+    """Учитывает время работы метода в self.stats, если он не None"""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        stats = self.stats
+        if stats is None:
+            return method(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            stats.add_call(name, time.perf_counter() - start)
+
+    return wrapper
+
+
+def format_stats(snapshot: dict) -> list:
+    """Строки для показа снимка статистики HexEditor.statistics"""
+    lines = []
+    model = snapshot['model']
+    lines.append(f"regions: {model['regions']} ({model['edited_regions']} "
+                 f"edited), average length "
+                 f"{model['average_region_length']:.0f} bytes")
+    lines.append(f"edit buffer: {_size(model['edit_buffer_bytes'])}, "
+                 f"in memory {_size(model['edit_memory'])}"
+                 + (', spilled to disk' if model['edit_buffer_spilled']
+                    else ''))
+    cache = snapshot['cache']
+    if cache is not None:
+        lines.append(f"cache: hit ratio {cache['hit_ratio']:.1%}, "
+                     f"{cache['hits']} hits, {cache['misses']} misses, "
+                     f"{cache['evictions']} evictions, "
+                     f"{cache['prefetched']} prefetched, "
+                     f"{cache['bulk_hits']} bulk hits, "
+                     f"{cache['bulk_misses']} bulk misses, "
+                     f"{_size(cache['memory'])}")
+    engine = snapshot['engine']
+    if engine is None:
+        lines.append('disk reads and timings are not collected')
+        return lines
+    disk = engine['disk']
+    lines.append(f"disk: {disk['reads']} reads, {_size(disk['bytes'])}, "
+                 f"{disk['seeks']} seeks, {disk['writes']} writes, "
+                 f"{_size(disk['bytes_written'])}, {disk['copies']} copies, "
+                 f"{_size(disk['bytes_copied'])}")
+    for name, call in sorted(engine['calls'].items(),
+                             key=lambda item: -item[1]['seconds']):
+        lines.append(f"{name}: {call['calls']} calls, "
+                     f"{call['seconds'] * 1000:.1f} ms, "
+                     f"{call['seconds'] * 1000 / call['calls']:.3f} ms/call")
+
+    return lines
+
+
+def dump_json(snapshot: dict, fp) -> None:
+    json.dump(snapshot, fp, indent=2)
+
+
+def log_stats(snapshot: dict, logger=logging,
+              level: int = logging.INFO) -> None:
+    for line in format_stats(snapshot):
+        logger.log(level, line)
+
+
+def _size(count: int) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if count < 1024:
+            return f'{count:.0f} {unit}' if unit == 'B' \
+                else f'{count:.1f} {unit}'
+        count /= 1024
+
+    return f'{count:.1f} GiB'
@@ -0,0 +1,93 @@
+import argparse
+import sys
+
+from modules.addbuffer import DEFAULT_MAX_MEMORY
+from modules.patching import PatchResult, patch_file, patch_files
+
+# столько байт участка показывается при пробном запуске
+DIFF_PREVIEW = 16
+
+
+def print_result(result: PatchResult) -> None:
+    if result.error is not None:
+        print(f'{result.filename}: error: {result.error}', file=sys.stderr)
+        return
+    print(f'{result.filename}: applied {result.operations} operations, '
+          f'{result.original_size} -> {result.size} bytes in '
+          f'{result.seconds:.3f} s '
+          f'({result.throughput / 1024 / 1024:.1f} MB/s)')
+    for offset, old, new in result.diff:
+        print(f'  {offset:08x}: {_preview(old)} -> {_preview(new)}')
+    if result.diff_truncated:
+        print('  ...')
+
+
+def _preview(data: bytes) -> str:
+    if not data:
+        return '(none)'
+    text = data[:DIFF_PREVIEW].hex(' ')
+    return text + f' ... ({len(data)} bytes)' \
+        if len(data) > DIFF_PREVIEW else text
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Applies a patch to files without the interactive '
+                    'editor')
+    parser.add_argument('filenames', nargs='+', metavar='filename',
+                        help='files to patch')
+    patch = parser.add_mutually_exclusive_group(required=True)
+    patch.add_argument('-s', '--script',
+                       help="patch script with replace, insert, remove, "
+                            "fill and substitute commands, '-' for stdin")
+    patch.add_argument('--ips', help='patch in IPS format')
+    patch.add_argument('--bps', help='patch in BPS format')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('-o', '--output',
+                        help='write the result to OUTPUT instead of '
+                             'changing the file in place, only for one file')
+    output.add_argument('-d', '--output-dir',
+                        help='write the results to OUTPUT_DIR under '
+                             'the same names')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='do not save anything, print changed bytes')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes patching files')
+    parser.add_argument('-e', '--edit-memory', type=int,
+                        default=DEFAULT_MAX_MEMORY // 1024 // 1024,
+                        help='memory for patched data in megabytes per '
+                             'file, the rest goes to a temporary file')
+    args = parser.parse_args(sys.argv[1:])
+    if args.output is not None and len(args.filenames) > 1:
+        parser.error('--output works only with one file, use --output-dir')
+
+    if args.script is not None:
+        kind = 'script'
+        if args.script == '-':
+            patch = sys.stdin.readlines()
+        else:
+            with open(args.script) as fp:
+                patch = fp.readlines()
+    else:
+        kind = 'ips' if args.ips else 'bps'
+        patch = args.ips or args.bps
+    edit_memory = args.edit_memory * 1024 * 1024
+    if args.output is not None:
+        results = [patch_file(args.filenames[0], kind, patch, args.output,
+                              args.dry_run, edit_memory)]
+    else:
+        results = patch_files(args.filenames, kind, patch, args.output_dir,
+                              args.dry_run, args.jobs, edit_memory)
+
+    failed = 0
+    for result in results:
+        print_result(result)
+        failed += result.error is not None
+    if len(args.filenames) > 1:
+        print(f'{len(args.filenames) - failed} files patched, '
+              f'{failed} failed')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import random
+import tempfile
+import unittest
+
+from modules.addbuffer import AddBuffer
+from modules.buffer import DataBuffer
+from modules.filemodel import FileModel
+
+
+class AddBufferTestCase(unittest.TestCase):
+    def test_in_memory(self):
+        buffer = AddBuffer(100)
+        self.assertEqual(buffer.append(b'abc'), 0)
+        self.assertEqual(buffer.append(b'def'), 3)
+        buffer.write(1, b'B')
+        self.assertEqual(buffer.read(0, 6), b'aBcdef')
+        self.assertFalse(buffer.is_spilled)
+        self.assertEqual(buffer.memory, 6)
+
+    def test_view(self):
+        buffer = AddBuffer(100)
+        buffer.append(b'abcdef')
+        view = buffer.view(1, 3)
+        self.assertEqual(bytes(view), b'bcd')
+        # view показывает байты буфера, а не их копию
+        buffer.write(2, b'C')
+        self.assertEqual(bytes(view), b'bCd')
+        # дописывание при выданных memoryview не падает и их не портит
+        for _ in range(10):
+            buffer.append(b'xyz')
+        self.assertEqual(bytes(view), b'bCd')
+        self.assertEqual(buffer.read(0, 9), b'abCdefxyz')
+        self.assertEqual(len(buffer), 36)
+
+    def test_spill(self):
+        buffer = AddBuffer(10)
+        buffer.append(b'0123456789')
+        self.assertFalse(buffer.is_spilled)
+        self.assertEqual(buffer.append(b'abc'), 10)
+        self.assertTrue(buffer.is_spilled)
+        self.assertEqual(buffer.memory, 0)
+        self.assertEqual(len(buffer), 13)
+        buffer.write(11, b'B')
+        self.assertEqual(buffer.read(8, 5), b'89aBc')
+        self.assertEqual(bytes(buffer.view(0, 3)), b'012')
+
+    def test_spill_grows(self):
+        buffer = AddBuffer(0)
+        chunks = [bytes([i]) * 5000 for i in range(10)]
+        for chunk in chunks:
+            buffer.append(chunk)
+        self.assertEqual(buffer.read(0, len(buffer)), b''.join(chunks))
+        buffer.close()
+        self.assertEqual(len(buffer), 0)
+
+
+class SpilledFileModelTestCase(unittest.TestCase):
+    def test_random_edits(self):
+        rng = random.Random(0)
+        original = bytes(rng.randrange(256) for _ in range(1000))
+        expected = bytearray(original)
+        model = FileModel(len(original), max_edit_memory=64)
+        fp = tempfile.TemporaryFile()
+        self.addCleanup(fp.close)
+        fp.write(original)
+        fp.flush()
+        buffer = DataBuffer(model, fp)
+        for _ in range(200):
+            offset = rng.randrange(len(expected))
+            data = bytes(rng.randrange(256)
+                         for _ in range(rng.randrange(1, 20)))
+            if rng.randrange(2):
+                model.insert(offset, data)
+                expected[offset:offset] = data
+            else:
+                model.replace(offset, data)
+                expected[offset:offset + len(data)] = data
+        self.assertTrue(model._add_buffer.is_spilled)
+        self.assertEqual(model.edit_memory, 0)
+        self.assertEqual(bytes(buffer.read_nbytes(0, len(expected))),
+                         bytes(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from benchmark import BENCHMARKS, MARKER, generate_file, parse_size, \
+    run_benchmarks
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('4K'), 4096)
+        self.assertEqual(parse_size('1.5m'), 1536 * 1024)
+        self.assertEqual(parse_size('10GB'), 10 * 1024 ** 3)
+
+    def test_generate_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'file')
+            offset = generate_file(filename, 10000, True, random.Random(0))
+            with open(filename, 'rb') as fp:
+                data = fp.read()
+        self.assertEqual(len(data), 10000)
+        self.assertEqual(data.find(MARKER), offset)
+
+    def test_run_benchmarks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            report = run_benchmarks([4096], (False, True), operations=10,
+                                    repeat=1, directory=directory)
+            self.assertListEqual(os.listdir(directory), [])
+        report = json.loads(json.dumps(report))
+        self.assertListEqual(
+            [(result['benchmark'], result['sparse'])
+             for result in report['results']],
+            [(name, sparse) for sparse in (False, True)
+             for name in BENCHMARKS])
+        self.assertTrue(all(result['seconds'] >= 0
+                            for result in report['results']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import random
+import tempfile
+import unittest
+
+from modules import bindiff
+from modules.bindiff import DiffRanges
+
+from search_tests import EditedFileTestCase
+
+
+def naive_diff_ranges(first: bytes, second: bytes) -> list:
+    """Участки отличающихся байт, склеенные, если между ними нет
+    совпадающих байт"""
+    ranges = []
+    for offset in range(max(len(first), len(second))):
+        if first[offset:offset + 1] == second[offset:offset + 1]:
+            continue
+        if ranges and ranges[-1][1] == offset:
+            ranges[-1][1] = offset + 1
+        else:
+            ranges.append([offset, offset + 1])
+
+    return [tuple(item) for item in ranges]
+
+
+def is_compact_cover(ranges: list, expected: list) -> bool:
+    """Каждый отличающийся байт лежит в одном из участков ranges, участки
+    начинаются и заканчиваются отличающимися байтами, а совпадающих байт
+    подряд внутри них меньше DIFF_GRANULARITY"""
+    differing = {offset for start, end in expected
+                 for offset in range(start, end)}
+    covered = {offset for start, end in ranges
+               for offset in range(start, end)}
+    gaps = [start - previous_end for (_, previous_end), (start, _)
+            in zip(expected, expected[1:])
+            if start in covered and start - 1 in covered]
+    return (differing <= covered
+            and all(start in differing and end - 1 in differing
+                    for start, end in ranges)
+            and all(gap < bindiff.DIFF_GRANULARITY for gap in gaps))
+
+
+class DiffRangesTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = random.Random(0)
+        self.first = rng.randbytes(20000)
+        second = bytearray(self.first)
+        for offset in (0, 1, 4095, 4096, 9000, 9003, 15000):
+            second[offset] ^= 0xff
+        second[12000:12100] = bytes(value ^ 0xff
+                                    for value in self.first[12000:12100])
+        self.second = bytes(second)
+
+    def read(self, data):
+        return lambda offset, count: data[offset:offset + count]
+
+    def compare(self, first, second, **kwargs):
+        return list(bindiff.diff_ranges(self.read(first), len(first),
+                                        self.read(second), len(second),
+                                        **kwargs))
+
+    def test_ranges(self):
+        expected = naive_diff_ranges(self.first, self.second)
+        for chunk_size in (1, 1000, 4096, 1 << 20):
+            ranges = self.compare(self.first, self.second,
+                                  chunk_size=chunk_size)
+            self.assertTrue(is_compact_cover(ranges, expected))
+            self.assertEqual(ranges[0], (0, 2))
+            self.assertIn((15000, 15001), ranges)
+
+    def test_block_boundary(self):
+        # отличия по обе стороны границы блока склеиваются в один участок
+        self.assertIn((4095, 4097), self.compare(self.first, self.second))
+
+    def test_equal(self):
+        self.assertListEqual(self.compare(self.first, self.first), [])
+        self.assertListEqual(self.compare(b'', b''), [])
+
+    def test_different_sizes(self):
+        self.assertListEqual(self.compare(b'abcd', b'abcdef'), [(4, 6)])
+        self.assertListEqual(self.compare(b'abcdef', b'abxd'), [(2, 3),
+                                                                 (4, 6)])
+        self.assertListEqual(self.compare(b'abcdef', b'abcdxy'), [(4, 6)])
+
+    def test_whole_chunk_differs(self):
+        # целиком отличающийся кусок дает один участок, короткие
+        # совпадения внутри него участки не разрывают
+        first = bytes(1 << 20)
+        second = bytearray(b'\xff' * (1 << 20))
+        second[1000:1000 + bindiff.DIFF_GRANULARITY - 1] = \
+            bytes(bindiff.DIFF_GRANULARITY - 1)
+        second[5000:5000 + bindiff.DIFF_GRANULARITY] = \
+            bytes(bindiff.DIFF_GRANULARITY)
+        self.assertListEqual(self.compare(first, bytes(second)),
+                             [(0, 5000), (5016, 1 << 20)])
+
+    def test_start_end(self):
+        ranges = self.compare(self.first, self.second, start=4096,
+                              end=10000)
+        self.assertListEqual(ranges, [(4096, 4097), (9000, 9004)])
+
+    def test_diff_ranges_class(self):
+        ranges = bindiff.compare(self.read(self.first), len(self.first),
+                                 self.read(self.second), len(self.second))
+        self.assertEqual(len(ranges), 5)
+        self.assertEqual(ranges.differing_bytes, 2 + 2 + 4 + 100 + 1)
+        self.assertEqual(ranges.next_after(0), 1)
+        self.assertEqual(ranges[ranges.next_after(4095)], (9000, 9004))
+        self.assertEqual(ranges.next_after(15000), -1)
+        self.assertEqual(ranges.prev_before(0), -1)
+        self.assertEqual(ranges[ranges.prev_before(9001)], (9000, 9004))
+        self.assertListEqual(ranges.overlapping(9002, 12050),
+                             [(9002, 9004), (12000, 12050)])
+        self.assertListEqual(ranges.overlapping(5000, 8000), [])
+
+    def test_add_merges(self):
+        ranges = DiffRanges()
+        ranges.add(1, 3)
+        ranges.add(3, 5)
+        ranges.add(7, 8)
+        self.assertListEqual(list(ranges), [(1, 5), (7, 8)])
+
+
+class ParallelCompareTestCase(EditedFileTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        fd, self.other_filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(self.data[:1000] + b'dd' + self.data[1002:1900])
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        os.remove(self.other_filename)
+
+    def test_parallel_compare(self):
+        with open(self.other_filename, 'rb') as fp:
+            other = fp.read()
+        expected = list(bindiff.compare(
+            lambda offset, count: self.data[offset:offset + count],
+            len(self.data), lambda offset, count: other[offset:offset + count],
+            len(other)))
+        self.assertListEqual(expected, [(1000, 1002), (1900, len(self.data))])
+        for shard_size in (97, 1001, 4096):
+            ranges = bindiff.parallel_compare(
+                self.filename, self.model.layout(), len(self.data),
+                self.other_filename, len(other), workers=2,
+                shard_size=shard_size, chunk_size=13)
+            self.assertListEqual(list(ranges), expected)
+
+    def test_background_compare(self):
+        background = bindiff.BackgroundCompare(
+            self.filename, self.model.layout(), len(self.data),
+            self.other_filename, chunk_size=64).start()
+        self.assertTrue(background.wait(10))
+        self.assertIsNone(background.error)
+        self.assertListEqual(list(background.result),
+                             [(1000, 1002), (1900, len(self.data))])
+        self.assertEqual(background.scanned, 1900)
+
+    def test_parallel_background_compare(self):
+        background = bindiff.BackgroundCompare(
+            self.filename, self.model.snapshot(portable=True),
+            len(self.data), self.other_filename, chunk_size=64, workers=2,
+            shard_size=97).start()
+        self.assertTrue(background.wait(30))
+        self.assertIsNone(background.error)
+        self.assertListEqual(list(background.result),
+                             [(1000, 1002), (1900, len(self.data))])
+        self.assertEqual(background.scanned, 1900)
@@ -1,3 +1,4 @@
+import mmap
 import unittest
 
 from modules.buffer import DataBuffer
@@ -21,29 +22,79 @@ class DataBufferTestCase(unittest.TestCase):
         '''
 
     def test_read_nbytes_without_offset(self):
-        self.assertListEqual(self.buffer.read_nbytes(0, 10), list(range(10)))
-        self.assertListEqual(self.buffer.read_nbytes(0, 10), list(range(10)))
-        self.assertListEqual(self.buffer.read_nbytes(0, 13),
-                                 [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 1, 2])
-        self.assertListEqual(self.buffer.read_nbytes(0, 15),
-                                 [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 1, 2, 3, 4])
+        self.assertEqual(self.buffer.read_nbytes(0, 10), bytearray(range(10)))
+        self.assertEqual(self.buffer.read_nbytes(0, 10), bytearray(range(10)))
+        self.assertEqual(self.buffer.read_nbytes(0, 13),
+                                 bytearray([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 1, 2]))
+        self.assertEqual(self.buffer.read_nbytes(0, 15),
+                                 bytearray([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 1, 2, 3, 4]))
 
     def test_read_nbytes_with_offset(self):
-        self.assertListEqual(self.buffer.read_nbytes(10, 3),
-                             [0, 1, 2])
-        self.assertListEqual(self.buffer.read_nbytes(10, 5),
-                             [0, 1, 2, 3, 4])
-        self.assertListEqual(self.buffer.read_nbytes(10, 6),
-                             [0, 1, 2, 3, 4, 0])
-        self.assertListEqual(self.buffer.read_nbytes(10, 8),
-                             [0, 1, 2, 3, 4, 0, 1, 2])
-        self.assertListEqual(self.buffer.read_nbytes(5, 5),
-                             [5, 6, 7, 8, 9])
-        self.assertListEqual(self.buffer.read_nbytes(10, 1), [0])
+        self.assertEqual(self.buffer.read_nbytes(10, 3),
+                             bytearray([0, 1, 2]))
+        self.assertEqual(self.buffer.read_nbytes(10, 5),
+                             bytearray([0, 1, 2, 3, 4]))
+        self.assertEqual(self.buffer.read_nbytes(10, 6),
+                             bytearray([0, 1, 2, 3, 4, 0]))
+        self.assertEqual(self.buffer.read_nbytes(10, 8),
+                             bytearray([0, 1, 2, 3, 4, 0, 1, 2]))
+        self.assertEqual(self.buffer.read_nbytes(5, 5),
+                             bytearray([5, 6, 7, 8, 9]))
+        self.assertEqual(self.buffer.read_nbytes(10, 1), bytearray([0]))
 
 
 class DataBufferTestCaseOnRealFile(unittest.TestCase):
-    pass
+    def setUp(self) -> None:
+        self.fp = open('simple_file.txt', 'rb')
+        self.model = FileModel(12)
+        self.model.insert(4, b'1234')
+
+    def tearDown(self) -> None:
+        self.fp.close()
+
+    def test_read_nbytes(self):
+        buffer = DataBuffer(self.model, self.fp)
+        self.assertEqual(buffer.read_nbytes(2, 8), bytearray(b'AA1234BB'))
+        self.assertEqual(buffer.read_nbytes(14, 10), bytearray(b'CC'))
+
+    def test_read_nbytes_mmap(self):
+        buffer = DataBuffer(self.model, self.fp, use_mmap=True)
+        self.assertEqual(buffer.read_nbytes(2, 8), bytearray(b'AA1234BB'))
+        self.assertEqual(buffer.read_nbytes(14, 10), bytearray(b'CC'))
+        buffer.unmap()
+
+    def test_read_nbytes_cached(self):
+        buffer = DataBuffer(self.model, self.fp, cache_size=64)
+        self.assertEqual(buffer.read_nbytes(2, 8), bytearray(b'AA1234BB'))
+        self.assertEqual(buffer.read_nbytes(14, 10), bytearray(b'CC'))
+        self.assertEqual(buffer.cache.misses, 1)
+        self.assertEqual(buffer.cache.hits, 2)
+
+    def test_read_view_mmap(self):
+        buffer = DataBuffer(self.model, self.fp, use_mmap=True)
+        view = buffer.read_view(8, 4)
+        self.assertIsInstance(view.obj, mmap.mmap)
+        self.assertEqual(view, b'BBBB')
+        view.release()
+        self.assertEqual(buffer.read_view(2, 4), b'AA12')
+        buffer.unmap()
+
+    def test_iter_chunks(self):
+        buffer = DataBuffer(self.model, self.fp, cache_size=64)
+        self.assertListEqual(
+            [bytes(chunk) for chunk in buffer.iter_chunks(2, 14, 3)],
+            [b'AA', b'123', b'4', b'BBB', b'BCC'])
+        # чтение кусками не заполняет кэш
+        self.assertEqual(buffer.cache.misses, 0)
+
+    def test_iter_chunks_mmap(self):
+        buffer = DataBuffer(self.model, self.fp, use_mmap=True)
+        chunks = list(buffer.iter_chunks(6, 100, 1024))
+        self.assertIsInstance(chunks[1].obj, mmap.mmap)
+        self.assertListEqual([bytes(chunk) for chunk in chunks],
+                             [b'34', b'BBBBCCCC'])
+        del chunks
+        buffer.unmap()
 
 
 if __name__ == '__main__':
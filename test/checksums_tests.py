@@ -0,0 +1,163 @@
+import hashlib
+import os
+import random
+import tempfile
+import unittest
+import zlib
+from array import array
+
+from modules import checksums
+from modules.checksums import BackgroundChecksums, ChecksumCache, \
+    ChunkTree, crc32_combine
+from modules.editor import HexEditor
+
+
+class Crc32CombineTestCase(unittest.TestCase):
+    def test_combine(self):
+        rng = random.Random(0)
+        for first_length, second_length in ((0, 0), (5, 0), (0, 7),
+                                            (13, 1000), (4096, 65537)):
+            first = rng.randbytes(first_length)
+            second = rng.randbytes(second_length)
+            self.assertEqual(crc32_combine(zlib.crc32(first),
+                                           zlib.crc32(second), len(second)),
+                             zlib.crc32(first + second))
+
+    def test_tree(self):
+        rng = random.Random(1)
+        chunks = [rng.randbytes(rng.randrange(1, 50)) for _ in range(13)]
+        tree = ChunkTree(array('L', map(zlib.crc32, chunks)),
+                         array('q', map(len, chunks)))
+        self.assertEqual(len(tree), 13)
+        for first in range(14):
+            for last in range(first, 14):
+                self.assertEqual(tree.crc32(first, last),
+                                 zlib.crc32(b''.join(chunks[first:last])))
+
+
+class ChecksumCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.data = random.Random(2).randbytes(1000)
+        self.reads = []
+
+    def read(self, offset, count):
+        self.reads.append((offset, count))
+        return self.data[offset:offset + count]
+
+    def test_original_crc32(self):
+        cache = ChecksumCache(len(self.data), chunk_size=64)
+        for start, end in ((0, 1000), (10, 20), (0, 64), (63, 129),
+                           (500, 1000), (1000, 1000)):
+            self.assertEqual(cache.original_crc32(self.read, start, end),
+                             zlib.crc32(self.data[start:end]))
+        # дерево строится один раз, дальше читаются только края
+        self.reads = []
+        cache.original_crc32(self.read, 10, 990)
+        self.assertListEqual(self.reads, [(10, 54), (960, 30)])
+
+    def test_checkpoint(self):
+        cache = ChecksumCache(len(self.data), chunk_size=64,
+                              checkpoint_size=200)
+        self.assertEqual(cache.checkpoint_size, 192)
+        for offset in (0, 191, 192, 500, 1000):
+            position, state = cache.checkpoint(self.read, 'sha256', offset)
+            self.assertEqual(position, offset // 192 * 192)
+            self.assertEqual(state.hexdigest(),
+                             hashlib.sha256(self.data[:position]).hexdigest())
+            # состояние - копия, его можно дополнять
+            state.update(b'x')
+        self.assertEqual(len(self.reads), 16)
+
+    def test_prepare_reads_once(self):
+        cache = ChecksumCache(len(self.data), chunk_size=64,
+                              checkpoint_size=200)
+        cache.prepare(self.read)
+        self.assertEqual(len(self.reads), 16)
+        self.reads = []
+        for algorithm in ('md5', 'sha256'):
+            position, state = cache.checkpoint(self.read, algorithm, 1000)
+            self.assertEqual(state.hexdigest(), hashlib.new(
+                algorithm, self.data[:position]).hexdigest())
+        self.assertListEqual(self.reads, [])
+        # дочитывается только неполный последний кусок
+        self.assertEqual(cache.original_crc32(self.read, 0, 1000),
+                         zlib.crc32(self.data))
+        self.assertListEqual(self.reads, [(0, 0), (960, 40)])
+
+
+class RecordingChecksums(BackgroundChecksums):
+    """Запоминает все значения scanned"""
+
+    @property
+    def scanned(self) -> int:
+        return self.progress[-1]
+
+    @scanned.setter
+    def scanned(self, value: int) -> None:
+        self.__dict__.setdefault('progress', []).append(value)
+
+
+class EditorChecksumsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.original = random.Random(3).randbytes(10000)
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(self.original)
+        self.editor = HexEditor(self.filename, prefetch_screens=0)
+
+    def tearDown(self) -> None:
+        self.editor.exit()
+        os.remove(self.filename)
+
+    def expected(self, data: bytes) -> dict:
+        return {'crc32': f'{zlib.crc32(data):08x}',
+                'md5': hashlib.md5(data).hexdigest(),
+                'sha256': hashlib.sha256(data).hexdigest()}
+
+    def test_checksums(self):
+        self.assertDictEqual(self.editor.checksums(),
+                             self.expected(self.original))
+        self.editor.replace(9000, b'\x00\x01\x02\x03')
+        self.editor.insert(5000, b'inserted')
+        self.editor.remove(100, 10)
+        data = self.editor.read(0, self.editor.file_size)
+        self.assertDictEqual(self.editor.checksums(), self.expected(data))
+        self.assertDictEqual(self.editor.checksums(4990, 5020),
+                             self.expected(data[4990:5020]))
+        self.assertDictEqual(self.editor.checksums(50, algorithms=('crc32',)),
+                             {'crc32': f'{zlib.crc32(data[50:]):08x}'})
+
+    def test_after_save(self):
+        self.editor.checksums()
+        self.editor.replace(0, b'saved')
+        self.editor.save_changes(self.filename)
+        self.editor.replace(10, b'edited')
+        data = self.editor.read(0, self.editor.file_size)
+        self.assertDictEqual(self.editor.checksums(), self.expected(data))
+
+    def test_background(self):
+        self.editor.insert(0, b'x')
+        data = self.editor.read(0, self.editor.file_size)
+        background = self.editor.start_checksums(1, 9000)
+        self.editor.insert(0, b'y')
+        self.assertTrue(background.wait(10))
+        self.assertIsNone(background.error)
+        self.assertDictEqual(background.result, self.expected(data[1:9000]))
+        self.assertListEqual(list(checksums.ALGORITHMS),
+                             list(background.result))
+
+    def test_background_progress(self):
+        # сначала читается весь исходный файл, потом [start; end), и
+        # прогресс считает оба прохода
+        self.editor.insert(0, b'x')
+        for prepared in (False, True):
+            background = RecordingChecksums(
+                self.filename, self.editor._model.snapshot(1, 9000),
+                self.editor._checksums(), 1, 9000, chunk_size=1000).start()
+            self.assertTrue(background.wait(10))
+            self.assertIsNone(background.error)
+            self.assertEqual(background.size,
+                             (10000 if not prepared else 0) + 8999)
+            self.assertListEqual(background.progress,
+                                 sorted(background.progress))
+            self.assertEqual(background.scanned, background.size)
@@ -1,6 +1,9 @@
+import os
+import tempfile
 import unittest
 
 from modules.editor import HexEditor
+from modules.patterns import compile_regex, parse_masked
 
 
 class HexEditorOnRealFileTestCase(unittest.TestCase):
@@ -24,3 +27,107 @@ class HexEditorOnRealFileTestCase(unittest.TestCase):
         editor = HexEditor('../ui.py')
         editor.replace(67, b'\x00')
         editor.get_nbytes(60, 10)
+
+    def test_search(self):
+        editor = HexEditor('simple_file.txt', is_readonly=True)
+        editor.search_chunk_size = 3
+        editor.insert(6, b'AB')
+        # AAAABBABBBCCCC
+        self.assertEqual(editor.search(b'AB'), 3)
+        self.assertEqual(editor.find_next(b'AB', 4), 6)
+        self.assertEqual(editor.find_next(b'AB', 7), -1)
+        self.assertEqual(editor.find_prev(b'AB'), 6)
+        self.assertEqual(editor.find_prev(b'AB', 6), 3)
+        self.assertListEqual(list(editor.find_all(b'BB')), [4, 7, 8])
+
+    def test_find_pattern(self):
+        editor = HexEditor('simple_file.txt', is_readonly=True)
+        editor.search_chunk_size = 3
+        editor.insert(6, b'AB')
+        # AAAABBABBBCCCC
+        self.assertEqual(editor.find_pattern(parse_masked('41 ?? 42')), 2)
+        self.assertListEqual(
+            list(editor.find_all_pattern(parse_masked('42 ?? 42'))), [5, 7])
+        self.assertEqual(editor.find_pattern(compile_regex(b'B+C'), 5), 7)
+
+    def test_iter_chunks(self):
+        editor = HexEditor('simple_file.txt', is_readonly=True)
+        editor.insert(6, b'AB')
+        # AAAABBABBBCCCC
+        chunks = list(editor.iter_chunks(chunk_size=4))
+        self.assertTrue(all(isinstance(chunk, memoryview)
+                            for chunk in chunks))
+        self.assertListEqual([bytes(chunk) for chunk in chunks],
+                             [b'AAAA', b'BB', b'AB', b'BBCC', b'CC'])
+        self.assertListEqual(
+            [bytes(chunk) for chunk in editor.iter_chunks(5, 8, 2)],
+            [b'B', b'AB'])
+        self.assertListEqual(list(editor.iter_chunks(14, 20)), [])
+        self.assertEqual(editor.read(3, 5), b'ABBAB')
+        self.assertEqual(editor.read(12, 10), b'CC')
+        self.assertEqual(editor.read(3, 0), b'')
+
+    def test_scan_signatures(self):
+        editor = HexEditor('simple_file.txt', is_readonly=True)
+        editor.insert(4, b'\x7fELF')
+        hits = editor.scan_signatures({'elf': b'\x7fELF', 'ab': b'AB'})
+        self.assertListEqual(list(hits), [(4, 'elf')])
+        self.assertListEqual(
+            list(editor.scan_signatures({'fb': b'FB', 'bc': b'BC'})),
+            [(7, 'fb'), (11, 'bc')])
+
+    def test_compare(self):
+        editor = HexEditor('simple_file.txt', is_readonly=True)
+        self.assertEqual(len(editor.compare()), 0)
+        editor.replace(2, b'XY')
+        editor.replace(6, b'B')
+        editor.insert(12, b'DD')
+        # AAXYBBBBCCCCDD
+        ranges = editor.compare()
+        self.assertListEqual(list(ranges), [(2, 4), (12, 14)])
+        self.assertEqual(ranges.differing_bytes, 4)
+        background = editor.start_compare('simple_file.txt')
+        self.assertTrue(background.wait(10))
+        self.assertListEqual(list(background.result), list(ranges))
+
+    def test_parallel_background_jobs(self):
+        editor = HexEditor('simple_file.txt', is_readonly=True)
+        editor.search_workers = 2
+        editor.search_shard_size = 5
+        editor.replace(2, b'XY')
+        editor.insert(12, b'AB')
+        # AAXYBBBBCCCCAB, фоновые поиск и сравнение идут по кускам
+        # в процессах
+        background = editor.start_search(b'AB')
+        self.assertTrue(background.wait(30))
+        self.assertEqual(background.result, 12)
+        background = editor.start_compare('simple_file.txt')
+        self.assertTrue(background.wait(30))
+        self.assertListEqual(list(background.result), [(2, 4), (12, 14)])
+
+
+class HexEditorSaveTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(b'A' * 100)
+
+    def tearDown(self) -> None:
+        os.remove(self.filename)
+
+    def test_read_after_save_in_place(self):
+        # байты, прочитанные до сохранения, не должны остаться в буфере
+        # файлового объекта
+        for cache_size, use_mmap in ((0, False), (1024 * 1024, False),
+                                     (0, True)):
+            editor = HexEditor(self.filename, use_mmap=use_mmap,
+                               cache_size=cache_size, prefetch_screens=0)
+            self.assertEqual(editor.get_nbytes(0, 8), b'AAAAAAAA')
+            editor.replace(2, b'BB')
+            editor.save_changes(self.filename)
+            self.assertEqual(editor.get_nbytes(0, 8), b'AABBAAAA')
+            editor.replace(2, b'AA')
+            editor.save_changes(self.filename)
+            self.assertEqual(editor.get_nbytes(0, 8), b'AAAAAAAA')
+            editor.exit()
+
@@ -1,5 +1,8 @@
+import random
+import tempfile
 import unittest
 
+from modules.buffer import DataBuffer
 from modules.filemodel import FileModel
 from modules.fileregion import FileRegion, EditedFileRegion
 
@@ -166,6 +169,78 @@ class FileModelTestCase(unittest.TestCase):
                          data=list(range(5)), expected_length=3,
                          is_removing=True)
 
+    def test_random_edits(self):
+        rng = random.Random(0)
+        original = bytes(rng.randrange(256) for _ in range(1000))
+        expected = bytearray(original)
+        model = FileModel(len(original))
+        fp = tempfile.TemporaryFile()
+        self.addCleanup(fp.close)
+        fp.write(original)
+        fp.flush()
+        buffer = DataBuffer(model, fp)
+        for _ in range(300):
+            offset = rng.randrange(len(expected))
+            data = bytes(rng.randrange(256) for _ in range(rng.randrange(1, 8)))
+            operation = rng.randrange(3)
+            if operation == 0:
+                model.insert(offset, data)
+                expected[offset:offset] = data
+            elif operation == 1:
+                model.replace(offset, data)
+                expected[offset:offset + len(data)] = data
+            elif len(expected) > len(data):
+                model.remove(offset, len(data))
+                del expected[offset:offset + len(data)]
+            self.assertEqual(model.file_size, len(expected))
+        self.assertEqual(bytes(buffer.read_nbytes(0, len(expected))),
+                         bytes(expected))
+
+    def test_typing_keeps_one_region(self):
+        model = FileModel(100)
+        for i in range(50):
+            # так набираются байты в режиме вставки
+            model.insert(10 + i, b'\x00')
+            model.replace(10 + i, bytes([i]))
+        self.assertListEqual(convert_regions_to_tuples(model.file_regions),
+                             [(0, 9), (10, 59), (60, 149)])
+        self.assertEqual(model.file_regions[1].data, bytes(range(50)))
+
+    def test_edits_share_add_buffer(self):
+        model = FileModel(100)
+        model.replace(10, b'abc')
+        model.replace(20, b'def')
+        model.replace(12, b'0123456789')
+        self.assertListEqual(convert_regions_to_tuples(model.file_regions),
+                             [(0, 9), (10, 11), (12, 21), (22, 22), (23, 99)])
+        self.assertListEqual([bytes(piece[3]) for piece in model.layout()
+                              if piece[3] is not None],
+                             [b'ab', b'0123456789', b'f'])
+        model.remove(13, 5)
+        self.assertEqual(model.file_regions[3].data, b'6789')
+        # данные не копируются ни при разбиении, ни при удалении
+        self.assertEqual(len(model._add_buffer), 16)
+
+    def test_remove_merges_edits(self):
+        model = FileModel(100)
+        model.replace(10, b'abc')
+        model.replace(20, b'def')
+        model.remove(13, 7)
+        self.assertListEqual(convert_regions_to_tuples(model.file_regions),
+                             [(0, 9), (10, 15), (16, 92)])
+        self.assertEqual(model.file_regions[1].data, b'abcdef')
+
+    def test_snapshot_is_not_overwritten(self):
+        model = FileModel(100)
+        model.replace(10, b'abc')
+        snapshot = model.snapshot()
+        model.replace(11, b'X')
+        model.insert(13, b'de')
+        self.assertEqual(bytes(snapshot[1][3]), b'abc')
+        self.assertListEqual([bytes(piece[3]) for piece in model.layout()
+                              if piece[3] is not None],
+                             [b'a', b'X', b'c', b'de'])
+
     def _check_indices(self):
         for index, region in enumerate(self.model.file_regions):
             self.assertEqual(region.index, index)
@@ -184,7 +259,7 @@ class FileModelTestCase(unittest.TestCase):
         self.assertEqual(new.start, offset)
         self.assertEqual(new.end, max(offset + len(data) - 1, 0))
         if not is_removing:
-            self.assertListEqual(data, new.data)
+            self.assertListEqual(list(data), list(new.data))
 
         self._check_bounds()
         self._check_indices()
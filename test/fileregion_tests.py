@@ -1,5 +1,6 @@
 import unittest
 
+from modules.addbuffer import AddBuffer
 from modules.fileregion import FileRegion, EditedFileRegion
 
 
@@ -27,6 +28,10 @@ class FileRegionTestCase(unittest.TestCase):
         self.assertFalse(FileRegion(5, 10, 0) < 4)
         self.assertFalse(FileRegion(5, 10, 0) < 7)
 
+    def test_slots(self):
+        self.assertFalse(hasattr(FileRegion(0, 10, 0), '__dict__'))
+        self.assertFalse(hasattr(EditedFileRegion(0, b'1', 0), '__dict__'))
+
     def test_truncate_start(self):
         region = FileRegion(0, 10, 0)
         region.truncate_start(5)
@@ -83,6 +88,19 @@ class EditedFileRegionTestCase(unittest.TestCase):
         self.assertEqual(right.start, 5)
         self.assertEqual(right.end, 8)
         self.assertEqual(right.data, b'6789')
+        self.assertIs(left._add_buffer, right._add_buffer)
+
+    def test_append_and_join(self):
+        add_buffer = AddBuffer()
+        region = EditedFileRegion(0, b'123', 0, add_buffer)
+        self.assertTrue(region.append(b'45'))
+        self.assertEqual(region.data, b'12345')
+        left, right = region.split(2)
+        self.assertFalse(left.append(b'6'))
+        self.assertTrue(left.join(right))
+        self.assertEqual(left.data, b'12345')
+        self.assertEqual(left.end, 4)
+        self.assertEqual(len(add_buffer), 5)
 
 
 if __name__ == '__main__':
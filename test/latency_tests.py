@@ -0,0 +1,56 @@
+import io
+import json
+import unittest
+
+from modules.latency import FrameTracer, LatencyHistogram, PHASES
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        self.assertListEqual(histogram.percentiles(50), [None])
+        for value in range(1, 101):
+            histogram.add(value)
+        self.assertListEqual(histogram.percentiles(50, 95, 99, 100),
+                             [50, 95, 99, 100])
+
+    def test_window(self):
+        histogram = LatencyHistogram(window=3)
+        for value in (100, 1, 2, 3):
+            histogram.add(value)
+        self.assertEqual(len(histogram), 3)
+        self.assertListEqual(histogram.percentiles(100), [3])
+
+
+class FrameTracerTestCase(unittest.TestCase):
+    def test_frames(self):
+        trace = io.StringIO()
+        tracer = FrameTracer(trace_file=trace)
+        self.assertEqual(tracer.summary(), 'no frames yet')
+        tracer.mark('key')
+        tracer.finish()
+        self.assertEqual(trace.getvalue(), '')
+
+        tracer.start(ord('a'))
+        for phase in PHASES:
+            tracer.mark(phase)
+        tracer.finish()
+        # незаконченный кадр отбрасывается при следующем нажатии
+        tracer.start(ord('b'))
+        tracer.start(ord('c'))
+        tracer.mark('key')
+        tracer.finish()
+
+        frames = [json.loads(line) for line in trace.getvalue().splitlines()]
+        self.assertListEqual([frame['key'] for frame in frames],
+                             [ord('a'), ord('c')])
+        self.assertEqual(frames[1]['fetch_ms'], 0)
+        self.assertGreaterEqual(
+            frames[0]['total_ms'],
+            sum(frames[0][f'{phase}_ms'] for phase in PHASES))
+        self.assertEqual(tracer.snapshot()['total']['frames'], 2)
+        self.assertTrue(tracer.summary().startswith('p50 '))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import tempfile
+import unittest
+
+from modules.pagecache import PageCache
+
+
+class PageCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.data = bytes(range(256)) * 4
+        self.fp = tempfile.TemporaryFile()
+        self.fp.write(self.data)
+        self.fp.flush()
+        self.cache = PageCache(self.fp, max_memory=64, block_size=16)
+
+    def tearDown(self) -> None:
+        self.fp.close()
+
+    def test_read(self):
+        self.assertEqual(bytes(self.cache.read(0, 10)), self.data[:10])
+        self.assertEqual(bytes(self.cache.read(10, 30)), self.data[10:40])
+        self.assertEqual(bytes(self.cache.read(1020, 10)), self.data[1020:])
+        self.assertEqual(bytes(self.cache.read(5, 0)), b'')
+
+    def test_hits_and_misses(self):
+        self.cache.read(0, 10)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+        self.cache.read(4, 20)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+        self.assertEqual(self.cache.hit_ratio, 1 / 3)
+
+    def test_eviction(self):
+        self.cache.read(0, 16 * 5)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertEqual(self.cache.memory, 64)
+        self.cache.read(0, 1)
+        self.assertEqual(self.cache.misses, 6)
+        self.cache.read(16 * 4, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_keeps_file_position(self):
+        self.fp.seek(7)
+        self.cache.read(100, 100)
+        self.assertEqual(self.fp.tell(), 7)
+
+    def test_clear(self):
+        self.cache.read(0, 10)
+        self.cache.clear()
+        self.cache.read(0, 10)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_prefetch(self):
+        self.assertEqual(self.cache.prefetch(20, 20), 2)
+        self.assertEqual(self.cache.prefetch(40, 20), 1)
+        self.assertEqual((self.cache.misses, self.cache.prefetched), (0, 3))
+        self.assertEqual(bytes(self.cache.read(16, 48)), self.data[16:64])
+        self.assertEqual((self.cache.hits, self.cache.misses), (3, 0))
+
+    def test_prefetch_limits(self):
+        # не больше половины кэша за раз и ничего за концом файла
+        self.assertEqual(self.cache.prefetch(0, 1024), 2)
+        self.assertEqual(self.cache.prefetch(1000, 100), 2)
+        self.assertEqual(self.cache.prefetch(2000, 100), 0)
+        self.assertEqual(self.cache.evictions, 0)
+
+    def test_read_bulk(self):
+        self.cache.read(16, 16)
+        self.cache.read(48, 16)
+        for offset, count in ((0, 100), (20, 30), (40, 1000), (1000, 50)):
+            self.assertEqual(bytes(self.cache.read_bulk(offset, count)),
+                             self.data[offset:offset + count])
+        self.assertEqual(bytes(self.cache.read_bulk(5, 0)), b'')
+        # недостающие блоки в кэш не попадают, а найденные не продвигаются
+        self.assertListEqual(list(self.cache._blocks), [1, 3])
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+        self.assertEqual(self.cache.bulk_hits, 5)
+        self.assertEqual(self.cache.bulk_misses, 72)
+
+    def test_clear_during_load(self):
+        # файл изменился и кэш сброшен, пока блоки читались с диска
+        load = self.cache._load
+
+        def load_and_clear(first, stop):
+            blocks = load(first, stop)
+            self.fp.seek(0)
+            self.fp.write(b'x' * 64)
+            self.fp.flush()
+            self.cache.clear()
+            return blocks
+
+        self.cache._load = load_and_clear
+        self.cache.prefetch(0, 32)
+        self.assertEqual(self.cache.prefetched, 0)
+        self.cache._load = load
+        self.assertEqual(bytes(self.cache.read(0, 32)), b'x' * 32)
+
+    def test_reads_without_lock(self):
+        # пока блоки читаются с диска, другие потоки могут читать из кэша
+        load = self.cache._load
+        locked = []
+
+        def checked_load(first, stop):
+            locked.append(self.cache._lock.locked())
+            return load(first, stop)
+
+        self.cache._load = checked_load
+        self.cache.read(0, 40)
+        self.cache.prefetch(100, 40)
+        self.assertListEqual(locked, [False, False])
+        self.assertEqual(bytes(self.cache.read(0, 140)), self.data[:140])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from modules.editor import HexEditor
+from modules.patching import PatchError, parse_script, patch_file, \
+    patch_files
+
+
+def encode_varint(value: int) -> bytes:
+    data = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if not value:
+            data.append(byte | 0x80)
+            return bytes(data)
+        data.append(byte)
+        value -= 1
+
+
+def encode_action(command: int, length: int) -> bytes:
+    return encode_varint((length - 1) << 2 | command)
+
+
+def encode_signed(value: int) -> bytes:
+    return encode_varint(abs(value) << 1 | (value < 0))
+
+
+def make_bps(source: bytes, target: bytes, actions: bytes) -> bytes:
+    patch = b'BPS1' + encode_varint(len(source)) \
+        + encode_varint(len(target)) + encode_varint(0) + actions \
+        + zlib.crc32(source).to_bytes(4, 'little') \
+        + zlib.crc32(target).to_bytes(4, 'little')
+    return patch + zlib.crc32(patch).to_bytes(4, 'little')
+
+
+class PatchingTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'file')
+        # AAAABBBBCCCC
+        shutil.copy('simple_file.txt', self.filename)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def write_patch(self, data: bytes) -> str:
+        filename = os.path.join(self.directory, 'patch')
+        with open(filename, 'wb') as fp:
+            fp.write(data)
+        return filename
+
+    def read(self, filename=None) -> bytes:
+        with open(filename or self.filename, 'rb') as fp:
+            return fp.read()
+
+    def test_parse_script(self):
+        script = ['# comment', '', 'replace 0x10 de ad', 'remove 3 2',
+                  'fill 0 4 00ff  # zeros', 'substitute 4142 43']
+        self.assertListEqual(list(parse_script(script)), [
+            ('replace', 16, b'\xde\xad'), ('remove', 3, 2),
+            ('fill', 0, 4, b'\x00\xff'), ('substitute', b'AB', b'C')])
+        with self.assertRaisesRegex(PatchError, 'line 2'):
+            list(parse_script(['remove 1 1', 'remove 1']))
+        with self.assertRaises(PatchError):
+            list(parse_script(['insert 0 zz']))
+
+    def test_script(self):
+        result = patch_file(self.filename, 'script', [
+            'insert 4 31 32', 'replace 0 78', 'remove 10 2',
+            'fill 12 3 2d', 'substitute 4131 5f'])
+        self.assertIsNone(result.error)
+        self.assertEqual(result.operations, 5)
+        self.assertEqual(self.read(), b'xAA_2BBBBCC---')
+
+    def test_script_past_end(self):
+        result = patch_file(self.filename, 'script', ['remove 10 5'])
+        self.assertIn('past the end', result.error)
+        self.assertEqual(self.read(), b'AAAABBBBCCCC')
+
+    def test_output(self):
+        output = os.path.join(self.directory, 'output')
+        patch_file(self.filename, 'script', ['replace 4 3030'], output)
+        self.assertEqual(self.read(), b'AAAABBBBCCCC')
+        self.assertEqual(self.read(output), b'AAAA00BBCCCC')
+
+    def test_ips(self):
+        patch = b'PATCH' + b'\x00\x00\x02\x00\x02xy' \
+            + b'\x00\x00\x08\x00\x00\x00\x03z' \
+            + b'\x00\x00\x10\x00\x01!' + b'EOF'
+        result = patch_file(self.filename, 'ips', self.write_patch(patch))
+        self.assertEqual(result.operations, 3)
+        self.assertEqual(self.read(), b'AAxyBBBBzzzC\0\0\0\0!')
+
+        patch_file(self.filename, 'ips',
+                   self.write_patch(b'PATCHEOF\x00\x00\x05'))
+        self.assertEqual(self.read(), b'AAxyB')
+        result = patch_file(self.filename, 'ips',
+                            self.write_patch(b'PATCH\x00'))
+        self.assertIsNotNone(result.error)
+        self.assertEqual(self.read(), b'AAxyB')
+
+    def test_bps(self):
+        source = b'AAAABBBBCCCC'
+        target = b'CCCCBBBBxyxyxyxy'
+        actions = encode_action(2, 4) + encode_signed(8) \
+            + encode_action(0, 4) \
+            + encode_action(1, 2) + b'xy' \
+            + encode_action(3, 6) + encode_signed(8)
+        patch_filename = self.write_patch(make_bps(source, target, actions))
+        self.assertEqual(patch_file(self.filename, 'bps',
+                                    patch_filename).operations, 4)
+        self.assertEqual(self.read(), target)
+
+        # исходный файл уже изменен
+        self.assertIsNotNone(patch_file(self.filename, 'bps',
+                                        patch_filename).error)
+        self.assertEqual(self.read(), target)
+
+    def test_save_reordered_in_place(self):
+        editor = HexEditor(self.filename, prefetch_screens=2)
+        editor.insert_original(0, 8, 4)
+        editor.remove(12, 4)
+        editor.save_changes(self.filename)
+        self.assertEqual(self.read(), b'CCCCAAAABBBB')
+        self.assertEqual(editor.get_nbytes(0, 16), b'CCCCAAAABBBB')
+        editor.replace(0, b'x')
+        editor.save_changes(self.filename)
+        self.assertEqual(self.read(), b'xCCCAAAABBBB')
+        editor.exit()
+
+    def test_dry_run(self):
+        result = patch_file(self.filename, 'script',
+                            ['replace 1 78', 'insert 12 7979'], dry_run=True)
+        self.assertIsNone(result.error)
+        self.assertEqual((result.original_size, result.size), (12, 14))
+        self.assertListEqual(result.diff, [(1, b'A', b'x'), (12, b'', b'yy')])
+        self.assertEqual(self.read(), b'AAAABBBBCCCC')
+
+        result = patch_file(self.filename, 'script', ['insert 0 00'],
+                            dry_run=True, diff_limit=1)
+        self.assertEqual(len(result.diff), 1)
+        self.assertTrue(result.diff_truncated)
+
+    def test_patch_files(self):
+        filenames = []
+        for i in range(3):
+            filenames.append(os.path.join(self.directory, f'file{i}'))
+            shutil.copy(self.filename, filenames[-1])
+        missing = os.path.join(self.directory, 'missing')
+        output_dir = os.path.join(self.directory, 'output')
+        os.mkdir(output_dir)
+        results = list(patch_files(filenames + [missing], 'script',
+                                   ['replace 0 7a'], output_dir, jobs=2))
+        self.assertSetEqual({result.filename for result in results},
+                            set(filenames + [missing]))
+        for result in results:
+            if result.filename == missing:
+                self.assertIn('No such file', result.error)
+                continue
+            self.assertIsNone(result.error)
+            self.assertEqual(result.operations, 1)
+            self.assertEqual(self.read(result.filename), b'AAAABBBBCCCC')
+            self.assertEqual(
+                self.read(os.path.join(output_dir,
+                                       os.path.basename(result.filename))),
+                b'zAAABBBBCCCC')
+
+    def test_patch_error(self):
+        result = patch_file(self.filename, 'ips', self.filename)
+        self.assertEqual(result.error, 'not an IPS patch')
+
+
+if __name__ == '__main__':
+    unittest.main()
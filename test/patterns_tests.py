@@ -0,0 +1,96 @@
+import random
+import re
+import unittest
+
+from modules import patterns
+from modules.patterns import MaskedPattern, compile_regex, parse_masked
+
+from search_tests import EditedFileTestCase
+
+
+def naive_find_masked(data, values, mask):
+    return [i for i in range(len(data) - len(values) + 1)
+            if all(not known or data[i + j] == values[j]
+                   for j, known in enumerate(mask))]
+
+
+class ParseMaskedTestCase(unittest.TestCase):
+    def test_parse(self):
+        pattern = parse_masked('4D 5A ?? ?? 50 45')
+        self.assertEqual(pattern.values, b'MZ\x00\x00PE')
+        self.assertListEqual(pattern.mask,
+                             [True, True, False, False, True, True])
+        self.assertEqual(str(pattern), '4d 5a ?? ?? 50 45')
+
+    def test_parse_without_spaces(self):
+        self.assertEqual(str(parse_masked('4d5a??5')), '4d 5a ?? 05')
+
+    def test_longest_literal(self):
+        pattern = parse_masked('aa ?? bb cc dd ?? ee')
+        self.assertEqual(pattern.literal, b'\xbb\xcc\xdd')
+        self.assertEqual(pattern.literal_offset, 2)
+
+    def test_bad_patterns(self):
+        for value in ('', '?? ??', '4?', 'zz'):
+            with self.assertRaises(ValueError):
+                parse_masked(value)
+
+
+class PatternSearchTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = random.Random(0)
+        self.data = bytes(rng.choice(b'abc') for _ in range(500))
+
+    def read(self, offset, count):
+        return self.data[offset:offset + count]
+
+    def test_masked(self):
+        for values, mask in ((b'a?c', [True, False, True]),
+                             (b'?ab?a', [False, True, True, False, True]),
+                             (b'cab', [True, True, True]),
+                             (b'??b', [False, False, True])):
+            pattern = MaskedPattern(values, mask)
+            for chunk_size in (1, 4, 64, 1000):
+                self.assertListEqual(
+                    list(patterns.find_all(self.read, len(self.data),
+                                           pattern, chunk_size=chunk_size)),
+                    naive_find_masked(self.data, values, mask))
+
+    def test_regex(self):
+        expected = [match.start()
+                    for match in re.finditer(b'ab+c|ca{2,}', self.data)]
+        pattern = compile_regex('ab+c|ca{2,}', 16)
+        for chunk_size in (1, 5, 64, 1000):
+            self.assertListEqual(
+                list(patterns.find_all(self.read, len(self.data), pattern,
+                                       chunk_size=chunk_size)), expected)
+
+    def test_regex_max_length(self):
+        data = b'x' + b'a' * 10 + b'x' + b'a' * 3
+        self.assertListEqual(
+            list(patterns.find_all(
+                lambda offset, count: data[offset:offset + count], len(data),
+                compile_regex(b'a+', 4), chunk_size=3)), [1, 5, 9, 12])
+
+    def test_find_next_from_offset(self):
+        pattern = parse_masked('61 ?? 63')
+        expected = naive_find_masked(self.data, b'a?c', [True, False, True])
+        self.assertEqual(patterns.find_next(self.read, len(self.data),
+                                            pattern, expected[0] + 1, 16),
+                         expected[1])
+        self.assertEqual(patterns.find_next(self.read, len(self.data),
+                                            parse_masked('64'), 0, 16), -1)
+
+
+class BackgroundPatternSearchTestCase(EditedFileTestCase):
+    def test_result(self):
+        expected = [match.start() for match in re.finditer(b'c{4}', self.data)]
+        background = patterns.BackgroundPatternSearch(
+            self.filename, self.model.layout(), len(self.data),
+            compile_regex(b'c{4}'), chunk_size=64).start()
+        self.assertTrue(background.wait(10))
+        self.assertEqual(background.result, expected[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from modules.editor import HexEditor
+from modules.prefetch import Prefetcher
+
+
+class PrefetcherTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.requests = []
+        self.prefetcher = Prefetcher(-1, screens=2)
+
+    def tearDown(self) -> None:
+        self.prefetcher.close()
+
+    def _locate(self, start, end):
+        self.requests.append((start, end))
+        return [(start, end - start)]
+
+    def test_forward(self):
+        self.prefetcher.access(0, 10, self._locate)
+        self.prefetcher.access(10, 10, self._locate)
+        self.assertEqual(self.requests, [])
+        self.prefetcher.access(20, 10, self._locate)
+        self.assertEqual(self.prefetcher.direction, 1)
+        self.assertEqual(self.requests, [(30, 50)])
+        self.assertTrue(self.prefetcher.wait_idle(5))
+        self.assertEqual(self.prefetcher.prefetched, 20)
+
+    def test_backward(self):
+        for offset in (100, 90, 80, 5):
+            self.prefetcher.access(offset, 10, self._locate)
+        self.assertEqual(self.prefetcher.direction, -1)
+        self.assertEqual(self.requests, [(60, 80), (0, 5)])
+
+    def test_random_access(self):
+        for offset in (100, 20, 300, 40, 40):
+            self.prefetcher.access(offset, 10, self._locate)
+        self.assertEqual(self.prefetcher.direction, 0)
+        self.assertEqual(self.requests, [])
+
+
+class EditorPrefetchTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        # AAAABBBBCCCC
+        self.editor = HexEditor('simple_file.txt', is_readonly=True,
+                                prefetch_screens=2)
+
+    def tearDown(self) -> None:
+        self.editor.exit()
+
+    def test_original_ranges(self):
+        self.editor.insert(2, b'xy')
+        self.editor.replace(7, b'z')
+        self.assertEqual(self.editor._original_ranges(1, 10),
+                         [(1, 1), (2, 3), (6, 2)])
+        self.assertEqual(self.editor._original_ranges(12, 20), [(10, 2)])
+        self.assertEqual(self.editor._original_ranges(14, 20), [])
+
+    def test_scrolling_warms_cache(self):
+        self.editor.cache.block_size = 2
+        for offset in range(0, 6, 2):
+            self.editor.get_nbytes(offset, 2)
+        self.assertTrue(self.editor._prefetcher.wait_idle(5))
+        misses = self.editor.cache.misses
+        self.assertEqual(self.editor.get_nbytes(6, 4), b'BBCC')
+        self.assertEqual(self.editor.cache.misses, misses)
+
+
+class PrefetchDuringSaveTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(b'A' * 100)
+        self.editor = HexEditor(self.filename, prefetch_screens=2)
+        self.editor.cache.block_size = 4
+
+    def tearDown(self) -> None:
+        self.editor.exit()
+        self.editor._fp.close()
+        os.remove(self.filename)
+
+    def test_save_drops_blocks_loaded_before_it(self):
+        # блоки, прочитанные потоком prefetch до сохранения, попадают
+        # в кэш уже после него
+        cache = self.editor.cache
+        load = cache._load
+        loaded, saved = threading.Event(), threading.Event()
+
+        def slow_load(first, stop):
+            blocks = load(first, stop)
+            if threading.current_thread() is self.editor._prefetcher._thread:
+                loaded.set()
+                saved.wait(5)
+            return blocks
+
+        cache._load = slow_load
+        for offset in range(0, 12, 4):
+            self.editor.get_nbytes(offset, 4)
+        self.assertTrue(loaded.wait(5))
+        self.editor.replace(12, b'ZZZZ')
+        self.editor.save_changes(self.filename)
+        saved.set()
+        self.assertTrue(self.editor._prefetcher.wait_idle(5))
+        self.assertEqual(self.editor.get_nbytes(12, 4), b'ZZZZ')
+
+
+if __name__ == '__main__':
+    unittest.main()
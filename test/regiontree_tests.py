@@ -0,0 +1,95 @@
+import random
+import unittest
+
+from modules.fileregion import FileRegion
+from modules.regiontree import RegionTree
+
+
+def make_regions(*lengths):
+    regions = []
+    start = 0
+    for index, length in enumerate(lengths):
+        regions.append(FileRegion(start, start + length - 1, index))
+        start += length
+    return regions
+
+
+class RegionTreeTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.regions = make_regions(6, 5, 7, 13)
+        self.tree = RegionTree(self.regions)
+
+    def test_length(self):
+        self.assertEqual(len(self.tree), 4)
+        self.assertEqual(self.tree.length, 31)
+
+    def test_find(self):
+        self.assertIs(self.tree.find(0), self.regions[0])
+        self.assertIs(self.tree.find(5), self.regions[0])
+        self.assertIs(self.tree.find(6), self.regions[1])
+        self.assertIs(self.tree.find(17), self.regions[2])
+        self.assertIs(self.tree.find(30), self.regions[3])
+        self.assertIsNone(self.tree.find(31))
+        self.assertIsNone(self.tree.find(-1))
+
+    def test_offset_and_index(self):
+        for index, region in enumerate(self.regions):
+            self.assertEqual(self.tree.index_of(region), index)
+            self.assertIs(self.tree[index], region)
+        self.assertEqual([region.start for region in self.tree],
+                         [0, 6, 11, 18])
+        self.assertIs(self.tree[-1], self.regions[-1])
+
+    def test_insert_before(self):
+        new = FileRegion(0, 2, 0)
+        self.tree.insert_before(self.regions[1], new)
+        self.assertEqual([region.start for region in self.tree],
+                         [0, 6, 9, 14, 21])
+        self.assertEqual(new.index, 1)
+        self.assertEqual(self.tree.length, 34)
+
+    def test_remove(self):
+        self.tree.remove(self.regions[1])
+        self.assertEqual([region.start for region in self.tree],
+                         [0, 6, 13])
+        self.assertEqual(self.regions[2].index, 1)
+
+    def test_successor_and_predecessor(self):
+        self.assertIs(self.tree.successor(self.regions[0]), self.regions[1])
+        self.assertIsNone(self.tree.successor(self.regions[3]))
+        self.assertIs(self.tree.predecessor(self.regions[3]), self.regions[2])
+        self.assertIsNone(self.tree.predecessor(self.regions[0]))
+
+    def test_truncate_updates_offsets(self):
+        self.regions[0].truncate_end(2)
+        self.assertEqual(self.regions[1].start, 4)
+        self.assertEqual(self.tree.length, 29)
+
+    def test_random_operations(self):
+        rng = random.Random(0)
+        reference = list(self.regions)
+        for _ in range(500):
+            if reference and rng.random() < 0.4:
+                region = reference.pop(rng.randrange(len(reference)))
+                self.tree.remove(region)
+            else:
+                position = rng.randrange(len(reference) + 1)
+                anchor = (reference[position]
+                          if position < len(reference) else None)
+                new = FileRegion(0, rng.randrange(10), 0)
+                self.tree.insert_before(anchor, new)
+                reference.insert(position, new)
+            self.assertEqual(list(self.tree), reference)
+
+        offset = 0
+        for index, region in enumerate(reference):
+            self.assertEqual(region.start, offset)
+            self.assertEqual(region.index, index)
+            if region.length:
+                self.assertIs(self.tree.find(offset), region)
+            offset += region.length
+        self.assertEqual(self.tree.length, offset)
+
+
+if __name__ == '__main__':
+    unittest.main()
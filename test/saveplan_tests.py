@@ -0,0 +1,163 @@
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from modules.buffer import DataBuffer
+from modules.filemodel import FileModel
+from modules.saveplan import RangeCopier, SavePlan, save_as
+
+
+class OriginalFileTestCase(unittest.TestCase):
+    edit_memory = 1024 * 1024
+
+    def setUp(self) -> None:
+        rng = random.Random(0)
+        self.original = bytes(rng.randrange(256) for _ in range(20000))
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(self.original)
+        self.fp = open(self.filename, 'r+b')
+        self.model = FileModel(len(self.original), self.edit_memory)
+
+    def tearDown(self) -> None:
+        self.fp.close()
+        os.remove(self.filename)
+
+
+class SavePlanTestCase(OriginalFileTestCase):
+    def save(self, chunk_size=64) -> int:
+        expected = bytes(DataBuffer(self.model, self.fp).read_nbytes(
+            0, self.model.file_size))
+        written = SavePlan.from_layout(
+            self.model.layout(copy=False), self.model.file_size).apply(
+            self.fp.fileno(), chunk_size)
+        with open(self.filename, 'rb') as fp:
+            self.assertEqual(fp.read(), expected)
+
+        return written
+
+    def test_replace_writes_only_changed_bytes(self):
+        self.model.replace(1000, b'\x01\x02\x03\x04')
+        plan = SavePlan.from_layout(self.model.layout(), self.model.file_size)
+        self.assertListEqual(plan.moves, [])
+        self.assertEqual(self.save(), 4)
+
+    def test_replace_with_same_bytes(self):
+        self.model.replace(10, self.original[10:20])
+        data = bytearray(self.original[5000:5010])
+        data[3] ^= 0xff
+        data[6] ^= 0xff
+        self.model.replace(5000, bytes(data))
+        self.assertEqual(self.save(), 4)
+
+    def test_insert_moves_tail_backward(self):
+        self.model.insert(100, b'abc')
+        plan = SavePlan.from_layout(self.model.layout(), self.model.file_size)
+        self.assertListEqual(plan.moves,
+                             [(100, 103, len(self.original) - 100)])
+        self.save()
+
+    def test_remove(self):
+        self.model.remove(100, 1000)
+        self.save()
+
+    def test_short_writes(self):
+        # pwrite может записать только часть данных
+        pwrite = os.pwrite
+        self.model.insert(100, b'abc')
+        self.model.replace(5000, b'\x00' * 50)
+        with mock.patch('os.pwrite', lambda fd, data, offset: pwrite(
+                fd, bytes(data)[:7], offset)):
+            self.save()
+
+    def test_random_edits(self):
+        rng = random.Random(1)
+        for _ in range(50):
+            offset = rng.randrange(self.model.file_size)
+            action = rng.randrange(3)
+            data = bytes(rng.randrange(256) for _ in range(rng.randrange(
+                1, 300)))
+            if action == 0:
+                self.model.insert(offset, data)
+            elif action == 1:
+                self.model.replace(offset, data)
+            else:
+                self.model.remove(offset, len(data))
+        self.save(chunk_size=100)
+
+
+class SpilledSavePlanTestCase(SavePlanTestCase):
+    # данные изменений лежат во временном файле
+    edit_memory = 0
+
+
+class SaveAsTestCase(OriginalFileTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.target = self.filename + '.saved'
+        self.model.insert(100, b'abc')
+        self.model.replace(5000, b'\x00' * 50)
+        self.model.remove(7000, 1000)
+        self.model.insert(self.model.file_size, b'tail')
+        self.expected = bytes(DataBuffer(self.model, self.fp).read_nbytes(
+            0, self.model.file_size))
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        if os.path.exists(self.target):
+            os.remove(self.target)
+
+    def check_save_as(self, copier) -> None:
+        save_as(self.model.layout(copy=False), self.fp.fileno(), self.target,
+                copier=copier)
+        with open(self.target, 'rb') as fp:
+            self.assertEqual(fp.read(), self.expected)
+        with open(self.filename, 'rb') as fp:
+            self.assertEqual(fp.read(), self.original)
+        self.assertListEqual(
+            [name for name in os.listdir(os.path.dirname(self.target))
+             if name.startswith(f'.{os.path.basename(self.target)}.')], [])
+
+    def test_copy_file_range(self):
+        self.check_save_as(RangeCopier(256))
+
+    def test_sendfile(self):
+        copier = RangeCopier(256)
+        copier.use_copy_file_range = False
+        self.check_save_as(copier)
+
+    def test_buffered(self):
+        copier = RangeCopier(256)
+        copier.use_copy_file_range = copier.use_sendfile = False
+        self.check_save_as(copier)
+
+    def test_truncated_source(self):
+        with open(self.target, 'wb') as fp:
+            fp.write(b'x' * 100)
+        os.truncate(self.filename, 10000)
+        for use_copy_file_range, use_sendfile in ((True, True),
+                                                  (False, True),
+                                                  (False, False)):
+            copier = RangeCopier(256)
+            copier.use_copy_file_range &= use_copy_file_range
+            copier.use_sendfile &= use_sendfile
+            with self.assertRaises(OSError):
+                save_as(self.model.layout(copy=False), self.fp.fileno(),
+                        self.target, copier=copier)
+            with open(self.target, 'rb') as fp:
+                self.assertEqual(fp.read(), b'x' * 100)
+            self.assertListEqual(
+                [name for name in os.listdir(os.path.dirname(self.target))
+                 if name.startswith(f'.{os.path.basename(self.target)}.')],
+                [])
+
+    def test_overwrite(self):
+        with open(self.target, 'wb') as fp:
+            fp.write(b'x' * 100000)
+        self.check_save_as(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import itertools
+import os
+import random
+import tempfile
+import unittest
+
+from modules import search
+from modules.addbuffer import SpilledSlice
+from modules.buffer import DataBuffer
+from modules.filemodel import FileModel
+
+
+def naive_find_all(data, query):
+    return [i for i in range(len(data) - len(query) + 1)
+            if data[i:i + len(query)] == query]
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = random.Random(0)
+        self.data = bytes(rng.choice(b'abc') for _ in range(500))
+
+    def read(self, offset, count):
+        return self.data[offset:offset + count]
+
+    def test_find_all(self):
+        for query in (b'a', b'ab', b'abc', b'cab', b'aaaa', b'abcabc'):
+            for chunk_size in (1, 3, 7, 64, 1000):
+                self.assertListEqual(
+                    list(search.find_all(self.read, len(self.data), query,
+                                         chunk_size=chunk_size)),
+                    naive_find_all(self.data, query))
+
+    def test_find_all_from_offset(self):
+        expected = [i for i in naive_find_all(self.data, b'abc') if i >= 100]
+        self.assertListEqual(
+            list(search.find_all(self.read, len(self.data), b'abc', 100,
+                                 chunk_size=16)), expected)
+
+    def test_find_next(self):
+        occurrences = naive_find_all(self.data, b'cc')
+        self.assertEqual(search.find_next(self.read, len(self.data), b'cc',
+                                          chunk_size=5), occurrences[0])
+        self.assertEqual(search.find_next(self.read, len(self.data), b'cc',
+                                          occurrences[0] + 1, chunk_size=5),
+                         occurrences[1])
+        self.assertEqual(search.find_next(self.read, len(self.data), b'd'),
+                         -1)
+        self.assertEqual(search.find_next(self.read, len(self.data), b''),
+                         -1)
+
+    def test_find_prev(self):
+        occurrences = naive_find_all(self.data, b'bca')
+        for chunk_size in (1, 4, 50, 1000):
+            self.assertEqual(search.find_prev(self.read, len(self.data),
+                                              b'bca', chunk_size=chunk_size),
+                             occurrences[-1])
+            self.assertEqual(search.find_prev(self.read, len(self.data),
+                                              b'bca', occurrences[-1],
+                                              chunk_size=chunk_size),
+                             occurrences[-2])
+            self.assertEqual(search.find_prev(self.read, len(self.data),
+                                              b'bca', occurrences[0],
+                                              chunk_size=chunk_size), -1)
+
+
+class EditedFileTestCase(unittest.TestCase):
+    edit_memory = 1024 * 1024
+
+    def setUp(self) -> None:
+        rng = random.Random(1)
+        original = bytes(rng.choice(b'abc') for _ in range(2000))
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(original)
+        self.model = FileModel(len(original), self.edit_memory)
+        self.addCleanup(self.model.close)
+        self.model.insert(100, b'abcabc')
+        self.model.replace(997, b'cccc')
+        self.model.remove(1500, 20)
+        with open(self.filename, 'rb') as fp:
+            self.data = bytes(DataBuffer(self.model, fp).read_nbytes(
+                0, self.model.file_size))
+
+    def tearDown(self) -> None:
+        os.remove(self.filename)
+
+
+class ParallelSearchTestCase(EditedFileTestCase):
+    def test_parallel_find_all(self):
+        for query in (b'abc', b'cccc', b'bacab'):
+            self.assertListEqual(
+                list(search.parallel_find_all(
+                    self.filename, self.model.snapshot(portable=True), len(self.data), query,
+                    workers=2, shard_size=97, chunk_size=13)),
+                naive_find_all(self.data, query))
+
+    def test_parallel_find_next(self):
+        expected = naive_find_all(self.data, b'cccc')
+        self.assertEqual(search.parallel_find_next(
+            self.filename, self.model.snapshot(portable=True), len(self.data), b'cccc',
+            workers=2, shard_size=128), expected[0])
+        self.assertEqual(search.parallel_find_next(
+            self.filename, self.model.snapshot(portable=True), len(self.data), b'cccc',
+            expected[-1] + 1, workers=2, shard_size=128), -1)
+
+    def test_map_in_processes_is_bounded(self):
+        consumed = []
+
+        def calls():
+            for number in range(100):
+                consumed.append(number)
+                yield (-number,)
+
+        results = search.map_in_processes(abs, calls(), workers=2)
+        self.assertListEqual(list(itertools.islice(results, 3)), [0, 1, 2])
+        results.close()
+        # в процессы отправлены только первые куски и по одному на замену
+        # каждому полученному результату
+        self.assertEqual(len(consumed), 5)
+
+    def test_shard_pieces(self):
+        layout = self.model.snapshot(portable=True)
+        starts = [piece[0] for piece in layout]
+        pieces = search.shard_pieces(layout, starts, 98, 1000)
+        self.assertEqual(pieces[0], (98, 2, 98, None))
+        self.assertEqual(pieces[-1][0] + pieces[-1][1], 1000)
+        self.assertEqual(sum(piece[1] for piece in pieces), 902)
+
+
+class SpilledParallelSearchTestCase(ParallelSearchTestCase):
+    # данные правок лежат во временном файле и передаются в процессы
+    # как SpilledSlice
+    edit_memory = 0
+
+    def test_pieces_are_not_copied(self):
+        self.assertTrue(all(
+            isinstance(piece[3], SpilledSlice)
+            for piece in self.model.snapshot(portable=True)
+            if piece[3] is not None))
+
+
+class BackgroundSearchTestCase(EditedFileTestCase):
+    def test_result(self):
+        expected = naive_find_all(self.data, b'cccc')
+        background = search.BackgroundSearch(
+            self.filename, self.model.layout(), len(self.data), b'cccc',
+            chunk_size=64).start()
+        # изменения после запуска поиска не должны на него влиять
+        self.model.insert(0, b'cccc')
+        self.assertTrue(background.wait(10))
+        self.assertEqual(background.result, expected[0])
+        self.assertEqual(background.scanned, expected[0] // 64 * 64 + 64)
+        self.assertIsNone(background.error)
+
+    def test_parallel_result(self):
+        expected = naive_find_all(self.data, b'cccc')
+        background = search.BackgroundSearch(
+            self.filename, self.model.snapshot(portable=True),
+            len(self.data), b'cccc', chunk_size=64, workers=2,
+            shard_size=97).start()
+        self.assertTrue(background.wait(30))
+        self.assertIsNone(background.error)
+        self.assertEqual(background.result, expected[0])
+        self.assertEqual(background.scanned, expected[0] // 97 * 97 + 97)
+
+    def test_parallel_cancel(self):
+        background = search.BackgroundSearch(
+            self.filename, self.model.snapshot(portable=True),
+            len(self.data), b'd', workers=2, shard_size=97)
+        background.cancel()
+        background.start()
+        self.assertTrue(background.wait(30))
+        self.assertTrue(background.cancelled)
+        self.assertIsNone(background.result)
+        self.assertIsNone(background.error)
+
+    def test_not_found(self):
+        background = search.BackgroundSearch(
+            self.filename, self.model.layout(), len(self.data), b'd').start()
+        self.assertTrue(background.wait(10))
+        self.assertEqual(background.result, -1)
+
+    def test_cancel(self):
+        background = search.BackgroundSearch(
+            self.filename, self.model.layout(), len(self.data), b'd')
+        background.cancel()
+        background.start()
+        self.assertTrue(background.wait(10))
+        self.assertTrue(background.cancelled)
+        self.assertIsNone(background.result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import random
+import unittest
+
+from modules.signatures import SignatureHits, SignatureMatcher, \
+    scan_signatures
+
+from search_tests import naive_find_all
+
+
+class SignatureMatcherTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = random.Random(0)
+        self.data = bytes(rng.choice(b'abc') for _ in range(500))
+
+    def read(self, offset, count):
+        return self.data[offset:offset + count]
+
+    def test_scan(self):
+        patterns = [b'abc', b'bc', b'c', b'cab', b'abcab', b'aaa']
+        matcher = SignatureMatcher(patterns)
+        for chunk_size in (1, 7, 1000):
+            # вхождения идут по порядку смещений без сортировки
+            hits = list(matcher.scan(self.read, len(self.data),
+                                     chunk_size=chunk_size))
+            expected = sorted((offset, index)
+                              for index, pattern in enumerate(patterns)
+                              for offset in naive_find_all(self.data, pattern))
+            self.assertListEqual(hits, expected)
+
+    def test_scan_from_offset(self):
+        matcher = SignatureMatcher([b'ab'])
+        self.assertListEqual(
+            [offset for offset, _ in matcher.scan(self.read,
+                                                  len(self.data), 250)],
+            [offset for offset in naive_find_all(self.data, b'ab')
+             if offset >= 250])
+
+    def test_empty_pattern(self):
+        with self.assertRaises(ValueError):
+            SignatureMatcher([b'a', b''])
+
+
+class SignatureHitsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.data = (b'\x00' * 10 + b'PK\x03\x04' + b'\x00' * 5
+                     + b'\x7fELF' + b'\x89PNG\r\n\x1a\n' + b'PK\x03\x04')
+        self.hits = scan_signatures(
+            lambda offset, count: self.data[offset:offset + count],
+            len(self.data))
+
+    def test_scan_signatures(self):
+        self.assertListEqual(list(self.hits),
+                             [(10, 'zip'), (19, 'elf'), (23, 'png'),
+                              (31, 'zip')])
+        self.assertEqual(self.hits.counts()['zip'], 2)
+        self.assertEqual(self.hits.counts()['gzip'], 0)
+
+    def test_next_and_prev(self):
+        self.assertEqual(self.hits.next_after(0), 0)
+        self.assertEqual(self.hits.next_after(10), 1)
+        self.assertEqual(self.hits.next_after(31), -1)
+        self.assertEqual(self.hits.prev_before(31), 2)
+        self.assertEqual(self.hits.prev_before(10), -1)
+
+    def test_empty(self):
+        self.assertFalse(SignatureHits(['zip']))
+
+
+if __name__ == '__main__':
+    unittest.main()
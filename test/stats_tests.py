@@ -0,0 +1,144 @@
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import unittest
+
+from modules.editor import HexEditor
+from modules.stats import EngineStats, format_stats, timed
+
+
+class Timed:
+    def __init__(self, stats=None):
+        self.stats = stats
+
+    @timed
+    def double(self, value):
+        return value * 2
+
+
+class EngineStatsTestCase(unittest.TestCase):
+    def test_timed(self):
+        self.assertEqual(Timed().double(2), 4)
+        stats = EngineStats()
+        instance = Timed(stats)
+        instance.double(1)
+        instance.double(2)
+        self.assertEqual(stats.calls['double'][0], 2)
+        self.assertGreaterEqual(stats.calls['double'][1], 0)
+
+    def test_count_disk(self):
+        stats = EngineStats()
+        stats.count_read(10, 0)
+        stats.count_read(5, 10)
+        stats.count_read(5, 100)
+        stats.count_read(1)
+        stats.count_write(7)
+        stats.count_copy(30)
+        self.assertEqual(stats.snapshot()['disk'],
+                         {'reads': 4, 'bytes': 21, 'seeks': 1, 'writes': 1,
+                          'bytes_written': 7, 'copies': 1,
+                          'bytes_copied': 30})
+
+    def test_threads(self):
+        stats = EngineStats()
+
+        def count():
+            for _ in range(10000):
+                stats.count_read(1)
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats.disk_reads, 40000)
+
+
+class EditorStatsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        # AAAABBBBCCCC
+        self.editor = HexEditor('simple_file.txt', is_readonly=True,
+                                cache_size=0, prefetch_screens=0)
+
+    def tearDown(self) -> None:
+        self.editor.exit()
+
+    def test_disabled(self):
+        self.editor.get_nbytes(0, 4)
+        snapshot = self.editor.statistics()
+        self.assertIsNone(snapshot['engine'])
+        self.assertIsNone(snapshot['cache'])
+        self.assertEqual(snapshot['model']['regions'], 1)
+
+    def test_enabled(self):
+        self.editor.enable_stats()
+        self.editor.insert(4, b'12')
+        self.assertEqual(self.editor.get_nbytes(2, 6), b'AA12BB')
+        snapshot = self.editor.statistics()
+        engine = snapshot['engine']
+        self.assertEqual(engine['disk'], {'reads': 2, 'bytes': 4,
+                                          'seeks': 0, 'writes': 0,
+                                          'bytes_written': 0, 'copies': 0,
+                                          'bytes_copied': 0})
+        self.assertEqual(engine['calls']['insert']['calls'], 1)
+        self.assertEqual(engine['calls']['get_nbytes']['calls'], 1)
+        self.assertEqual(snapshot['model']['regions'], 3)
+        self.assertEqual(snapshot['model']['edited_regions'], 1)
+        self.assertEqual(snapshot['model']['edit_buffer_bytes'], 2)
+
+        self.editor.disable_stats()
+        self.editor.get_nbytes(0, 4)
+        self.assertIsNone(self.editor.statistics()['engine'])
+
+    def test_dump(self):
+        self.editor.enable_stats()
+        self.editor.get_nbytes(0, 4)
+        fp = io.StringIO()
+        self.editor.dump_stats(fp)
+        self.assertEqual(json.loads(fp.getvalue())['file_size'], 12)
+        lines = format_stats(self.editor.statistics())
+        self.assertIn('disk: 1 reads, 4 B, 0 seeks, 0 writes, 0 B, '
+                      '0 copies, 0 B', lines)
+        with self.assertLogs(level=logging.INFO) as logs:
+            self.editor.log_stats()
+        self.assertEqual(len(logs.output), len(lines))
+
+
+class SaveStatsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(b'A' * 100)
+        self.editor = HexEditor(self.filename, cache_size=0,
+                                prefetch_screens=0)
+        self.stats = self.editor.enable_stats()
+
+    def tearDown(self) -> None:
+        self.editor.exit()
+        self.editor._fp.close()
+        for filename in (self.filename, self.filename + '.saved'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def test_save_in_place(self):
+        self.editor.replace(10, b'xy')
+        self.editor.insert(50, b'z')
+        self.editor.save_changes(self.filename)
+        disk = self.stats.snapshot()['disk']
+        self.assertGreater(disk['writes'], 0)
+        # сдвинутый хвост и измененные байты
+        self.assertEqual(disk['bytes_written'], 50 + 3)
+
+    def test_save_as(self):
+        self.editor.replace(10, b'xy')
+        self.editor.save_changes(self.filename + '.saved')
+        disk = self.stats.snapshot()['disk']
+        # неизмененные байты копируются ядром или через буфер
+        self.assertEqual(disk['bytes_written'] + disk['bytes_copied'], 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
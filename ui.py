@@ -1,10 +1,18 @@
 import logging
 import argparse
+import os
+import re
 import sys
 import curses
 import itertools
 
+from modules.addbuffer import DEFAULT_MAX_MEMORY
 from modules.editor import HexEditor
+from modules.latency import FrameTracer
+from modules.patterns import compile_regex, parse_masked
+from modules.pagecache import DEFAULT_CACHE_SIZE
+from modules.prefetch import DEFAULT_SCREENS as DEFAULT_PREFETCH_SCREENS
+from modules.stats import format_stats
 
 logging.basicConfig(filename='log.log', level=logging.ERROR)
 
@@ -25,6 +33,13 @@ ESCAPE_KEY = 27
 DELETE_KEY = 330
 HOME_KEY = 262
 END_KEY = 358
+NO_KEY = -1
+
+# печатные символы ASCII отображаются как есть, остальные байты как точки
+PRINTABLE_TABLE = bytes(value if 0x20 <= value <= 0x7e else ord('.')
+                        for value in range(256))
+
+SEARCH_POLL_INTERVAL = 100  # мс между обновлениями прогресса поиска
 
 CONTROL_KEYS = {
     curses.KEY_UP, curses.KEY_DOWN, curses.KEY_LEFT, curses.KEY_RIGHT,
@@ -38,7 +53,15 @@ default_upper_bar = 'Offset(h)  00 01 02 03 04 05 06 07  08 09 0a 0b 0c 0d 0e 0f
                     '   Decoded text'
 help_menu = "'a' for insert mode\n'v' for view mode\n's' for save" \
             "\n'page_up', 'page_down', 'home', 'end', arrows for navigation" \
-            "\n'g' for goto\n'f' for find" \
+            "\n'g' for goto\n'f' for find (?? for any byte)" \
+            "\n'r' for find by regex\n'x' for cancel search" \
+            "\n'm' for scan for file signatures" \
+            "\n'n'('N') for next(previous) found signature" \
+            "\n'd' for compare with the diff file (the saved file by default)" \
+            "\n'>'('<') for next(previous) difference" \
+            "\n'#' for checksums of the selection or the whole file" \
+            "\n'i' for open(close) engine statistics" \
+            "\n'l' for show(hide) key latency" \
             "\n'h' for open(close) help\n'q' for quit" \
             "\nshift + arrows for selection\n'c' for copy\n'k' for cut" \
             "(in insert mode)\n'p' for paste(in insert mode)"
@@ -56,20 +79,36 @@ def is_correct_hex_symbol_or_backspace(value: int) -> bool:
     return is_correct_hex_symbol(value) or value == BACKSPACE_KEY
 
 
+def is_correct_pattern_symbol(value: int) -> bool:
+    return is_correct_hex_symbol(value) or chr(value) in '? '
+
+
+def is_printable_symbol(value: int) -> bool:
+    return 0x20 <= value <= 0x7e
+
+
 def init_colors() -> None:
     curses.init_pair(1, curses.COLOR_CYAN, curses.COLOR_BLACK)
     curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_WHITE)
     curses.init_pair(3, curses.COLOR_BLACK, curses.COLOR_WHITE)
     curses.init_pair(4, curses.COLOR_WHITE, curses.COLOR_BLACK)
+    curses.init_pair(5, curses.COLOR_WHITE, curses.COLOR_RED)
 
 
 class HexEditorUI:
-    def __init__(self, filename: str, is_readonly=False):
-        self.editor = HexEditor(filename, is_readonly)
+    def __init__(self, filename: str, is_readonly=False, use_mmap=False,
+                 cache_size=DEFAULT_CACHE_SIZE, search_workers=1,
+                 edit_memory=DEFAULT_MAX_MEMORY,
+                 prefetch_screens=DEFAULT_PREFETCH_SCREENS,
+                 trace_file=None, diff_file: str = None):
+        self.editor = HexEditor(filename, is_readonly, use_mmap, cache_size,
+                                edit_memory, prefetch_screens)
+        self.editor.search_workers = search_workers
 
         self.selected = [None, None]
         self.clipboard = b''
-        self.data = b''
+        self.data = b''  # байты, видимые на экране
+        self._decoded = ''
         self.filename = filename
 
         self.current_offset = 0  # смещение, соответствующее первому байту на экране
@@ -81,6 +120,9 @@ class HexEditorUI:
         self.is_readonly = is_readonly
         self._is_in_help = False
         self._bottom_bar_draw_queue = []
+        # строки с байтами, которые нужно перерисовать в следующем кадре
+        self._dirty_rows = set()
+        self._is_full_redraw = True
 
         self.current_mode = 'view'
         self.separator = ' | '
@@ -99,6 +141,18 @@ class HexEditorUI:
         self.cursor_y = 2
 
         self._x_offset = 0  # сдвиг в текущей строке
+        self._search = None  # поиск, идущий в фоне
+        self._on_search_done = None
+        self.signature_hits = None
+        # файл, с которым сравнивается текущее состояние, None - сохраненный
+        self.diff_file = diff_file
+        self.diff_ranges = None  # результат последнего сравнения
+        self._other_fp = None  # файл из последнего сравнения
+        self._other_data = b''  # его байты с теми же смещениями, что на экране
+        # время обработки нажатий, trace_file получает строку JSON на кадр
+        self.tracer = FrameTracer(trace_file=trace_file)
+        self._is_latency_shown = False
+        self._screen_lines = None  # строки, которые покажутся поверх байт
 
         self.stdscr: curses.window = None
 
@@ -107,45 +161,85 @@ class HexEditorUI:
         init_colors()
         self.height, self.width = stdscr.getmaxyx()
         self.bytes_rows = self.height - 3
+        # разрешаем curses прокручивать строки средствами терминала
+        stdscr.idlok(True)
 
         while self.key != ord('q'):
+            view = self._view_state()
             self.handle_key()
-            self.stdscr.clear()
+            self.track_damage(view)
             self.draw()
 
             self.key = stdscr.getch()
+            if self.key != NO_KEY:
+                self.tracer.start(self.key)
 
     def draw(self) -> None:
+        """Перерисовывает строки, отмеченные как измененные, нижнюю панель
+        и курсор"""
+        self.tracer.mark('key')
+        if self._is_in_help:
+            # справка закрывает весь экран
+            self.mark_all_dirty()
         self._is_in_help = False
-        self.stdscr.addstr(0, 0, self.upper_bar)
-        self.stdscr.addstr(1, 9, self.upper_bar_underline)
-        for line in range(self.height - 1):
-            to_read = min(COLUMNS,
-                          self.editor.file_size
-                          - self.current_offset
-                          - line * COLUMNS)
-            self.data = self.editor.get_nbytes(
-                self.current_offset + line * COLUMNS, to_read)
-            self.draw_offset(line)
-            self.draw_bytes(line)
-            self.draw_decoded_bytes(line)
-            if self.current_offset + line * COLUMNS + COLUMNS > self.editor.file_size:
-                break
+        if self._is_full_redraw:
+            self.stdscr.erase()
+            self.stdscr.addstr(0, 0, self.upper_bar)
+            self.stdscr.addstr(1, 9, self.upper_bar_underline)
+            if self._is_diff_pane_shown():
+                self.stdscr.addstr(0, self._diff_pane_x(),
+                                   f'{os.path.basename(self._other_fp.name)}'
+                                   [:self._bytes_str_len])
+            self._dirty_rows = set(range(self.bytes_rows))
+        # строка с курсором перерисовывается всегда, иначе на ней
+        # останется подсветка
+        self._dirty_rows.add(self.cursor_y - 2)
+        self.tracer.mark('render')
+        rows = self.fetch_screen()
+        self.tracer.mark('fetch')
+        for line in sorted(self._dirty_rows):
+            if not 0 <= line < self.bytes_rows:
+                continue
+            self.stdscr.move(line + 2, 0)
+            self.stdscr.clrtoeol()
+            if line < rows:
+                self.draw_offset(line)
+                self.draw_bytes(line)
+                self.draw_decoded_bytes(line)
+            if self._is_diff_pane_shown():
+                self.draw_other_bytes(line)
+        self.draw_differences()
         if self._bottom_bar_draw_queue:
             self.bottom_bar = self._bottom_bar_draw_queue.pop()
         else:
             self.bottom_bar = default_bottom_bar.format(self.current_mode)
+            if self._is_latency_shown:
+                self.bottom_bar += f' | latency {self.tracer.summary()}'
         self.draw_bottom_bar()
         self.draw_label()
         self.draw_selected_bytes()
+        self._dirty_rows = set()
+        self._is_full_redraw = False
         if self.key == ord('h'):
             self.handle_help()
+        elif self.key == ord('i'):
+            self.handle_stats()
+        elif self._screen_lines is not None:
+            self._show_screen(self._screen_lines)
+            self._screen_lines = None
 
         self.stdscr.move(self.cursor_y, self.cursor_x)
 
+        self.tracer.mark('render')
         self.stdscr.refresh()
+        self.tracer.mark('refresh')
+        self.tracer.finish()
 
     def handle_key(self) -> None:
+        if self._search is not None:
+            self.handle_background_search()
+        if self.key == NO_KEY:
+            return
         if self.key in CONTROL_KEYS:
             self.clear_selected()
             self.handle_cursor()
@@ -165,10 +259,13 @@ class HexEditorUI:
             self.handle_insert_mode()
         elif self.key == ord('a') and not self.is_readonly:
             self.current_mode = INSERT_MODE
-        elif self.key == ord('h'):
+        elif self.key in (ord('h'), ord('i')):
             if self._is_in_help:
                 self.key = -1
                 self._is_in_help = False
+                self.mark_all_dirty()
+        elif self.key == ord('l'):
+            self._is_latency_shown = not self._is_latency_shown
         elif self.key == ord('g'):
             self.clear_selected()
             self.handle_goto()
@@ -177,6 +274,23 @@ class HexEditorUI:
         elif self.key == ord('f'):
             self.clear_selected()
             self.handle_search()
+        elif self.key == ord('r'):
+            self.clear_selected()
+            self.handle_regex_search()
+        elif self.key == ord('m'):
+            self.clear_selected()
+            self.handle_signature_scan()
+        elif self.key in (ord('n'), ord('N')):
+            self.clear_selected()
+            self.handle_next_signature()
+        elif self.key == ord('#'):
+            self.handle_checksums()
+        elif self.key == ord('d'):
+            self.clear_selected()
+            self.handle_compare()
+        elif self.key in (ord('>'), ord('<')):
+            self.clear_selected()
+            self.handle_next_difference()
         elif self.key == HOME_KEY:
             self.clear_selected()
             self._increment_offset(-self.current_offset)
@@ -208,8 +322,12 @@ class HexEditorUI:
             return
         start = min(self.selected)
         end = max(self.selected)
+        # подсветка на остальных строках осталась с прошлого кадра
+        start = max(start, self.current_offset)
+        end = min(end, self.current_offset + self.bytes_rows * COLUMNS - 1)
         for offset in range(start, end + 1):
-            if not self._is_offset_on_screen(offset):
+            if (offset - self.current_offset) // COLUMNS \
+                    not in self._dirty_rows:
                 continue
             y, cursor_x = self._cursor_coords_by_offset(offset)
             label_x = self._offset_to_label_x(offset)
@@ -232,6 +350,78 @@ class HexEditorUI:
                 self.stdscr.addch(y, cursor_x, third,
                                   curses.color_pair(1))
 
+    def mark_all_dirty(self) -> None:
+        """Перерисовать в следующем кадре весь экран"""
+        self._is_full_redraw = True
+
+    def mark_dirty_from(self, offset: int) -> None:
+        """Отмечает измененными строки, начиная со строки со смещением
+        offset: после вставки и удаления сдвигаются все байты за ним"""
+        first = max((offset - self.current_offset) // COLUMNS, 0)
+        self._dirty_rows.update(range(first, self.bytes_rows))
+
+    def mark_dirty_range(self, start: int, end: int) -> None:
+        """Отмечает измененными строки с байтами из [start; end]"""
+        first = max((start - self.current_offset) // COLUMNS, 0)
+        last = min((end - self.current_offset) // COLUMNS, self.bytes_rows - 1)
+        self._dirty_rows.update(range(first, last + 1))
+
+    def track_damage(self, view: tuple) -> None:
+        """Отмечает строки, которые изменились после обработки нажатия,
+        по состоянию view до нее (см. _view_state)"""
+        offset, cursor_y, selected = view
+        if self.key == ord('h'):
+            self.mark_all_dirty()
+        selection = [selected, self.selected]
+        if offset != self.current_offset:
+            shift = self.current_offset - offset
+            if shift % COLUMNS or abs(shift) // COLUMNS >= self.bytes_rows \
+                    or any(item[0] is not None for item in selection):
+                self.mark_all_dirty()
+                return
+            self.scroll(shift // COLUMNS)
+            cursor_y -= shift // COLUMNS
+        self._dirty_rows.add(cursor_y - 2)
+        for item in selection:
+            if item[0] is not None:
+                self.mark_dirty_range(min(item), max(item))
+
+    def scroll(self, rows: int) -> None:
+        """Сдвигает строки с байтами на rows вверх (вниз, если rows < 0)
+        средствами терминала и отмечает открывшиеся строки измененными"""
+        if self._is_full_redraw or not rows:
+            return
+        self.stdscr.scrollok(True)
+        self.stdscr.setscrreg(2, self.bytes_rows + 1)
+        self.stdscr.scrl(rows)
+        self.stdscr.setscrreg(0, self.height - 1)
+        self.stdscr.scrollok(False)
+        self._dirty_rows = {line - rows for line in self._dirty_rows}
+        if rows > 0:
+            self._dirty_rows.update(range(self.bytes_rows - rows,
+                                          self.bytes_rows))
+        else:
+            self._dirty_rows.update(range(-rows))
+
+    def _view_state(self) -> tuple:
+        return self.current_offset, self.cursor_y, list(self.selected)
+
+    def fetch_screen(self) -> int:
+        """Читает все байты, видимые на экране, одним вызовом и возвращает
+        количество строк, которые нужно нарисовать. Если файл заканчивается
+        на границе строки, последняя строка пустая, чтобы в нее можно было
+        поставить курсор"""
+        remaining = self.editor.file_size - self.current_offset
+        rows = max(min(self.bytes_rows, remaining // COLUMNS + 1), 0)
+        self.data = self.editor.get_nbytes(self.current_offset,
+                                           min(rows * COLUMNS, remaining))
+        self._decoded = self.data.translate(PRINTABLE_TABLE).decode('ascii')
+        if self._is_diff_pane_shown():
+            self._other_data = os.pread(self._other_fp.fileno(),
+                                        rows * COLUMNS, self.current_offset)
+
+        return rows
+
     def draw_offset(self, y: int) -> None:
         offset_str = '{0:0{1}x}{2}'.format(self.current_offset + y * COLUMNS,
                                            OFFSET_COLUMN_LENGTH,
@@ -239,18 +429,66 @@ class HexEditorUI:
         self.stdscr.addstr(min(y + 2, self.height - 1), 0, offset_str)
 
     def draw_bytes(self, y: int) -> None:
-        bytes_str = f"{self.data[:COLUMNS // 2].hex(' ')} " \
-                    f" {self.data[COLUMNS // 2:].hex(' ')}"
+        line = self.data[y * COLUMNS:y * COLUMNS + COLUMNS]
+        bytes_str = f"{line[:COLUMNS // 2].hex(' ')} " \
+                    f" {line[COLUMNS // 2:].hex(' ')}"
         self.stdscr.addstr(min(y + 2, self.height - 1), self._offset_str_len,
                            bytes_str)
 
     def draw_decoded_bytes(self, y: int) -> None:
-        decoded_str = '{}{}'.format(self.separator, ''.join(
-            map(lambda x: chr(x) if 0x20 <= x <= 0x7e else '.', self.data)))
+        decoded_str = self.separator \
+            + self._decoded[y * COLUMNS:y * COLUMNS + COLUMNS]
         self.stdscr.addstr(min(y + 2, self.height - 1),
                            self._offset_str_len + self._bytes_str_len,
                            decoded_str)
 
+    def draw_other_bytes(self, y: int) -> None:
+        """Рисует в боковой панели байты файла из сравнения с теми же
+        смещениями, что и строка y"""
+        line = self._other_data[y * COLUMNS:y * COLUMNS + COLUMNS]
+        other_str = f"{line[:COLUMNS // 2].hex(' ')} " \
+                    f" {line[COLUMNS // 2:].hex(' ')}"
+        other_str += ' ' * (self._bytes_str_len - len(other_str)) \
+            + self.separator \
+            + line.translate(PRINTABLE_TABLE).decode('ascii')
+        self.stdscr.addstr(min(y + 2, self.height - 1), self._diff_pane_x(),
+                           other_str)
+
+    def draw_differences(self) -> None:
+        """Подсвечивает на перерисованных строках байты, отличающиеся
+        от файла из сравнения"""
+        if not self.diff_ranges:
+            return
+        screen_end = self.current_offset + len(self.data)
+        if self._is_diff_pane_shown():
+            screen_end = max(screen_end,
+                             self.current_offset + len(self._other_data))
+        pane_x = self._diff_pane_x() - self._offset_str_len
+        for start, end in self.diff_ranges.overlapping(self.current_offset,
+                                                       screen_end):
+            for offset in range(start, end):
+                shift = offset - self.current_offset
+                if shift // COLUMNS not in self._dirty_rows:
+                    continue
+                y = 2 + shift // COLUMNS
+                column = shift % COLUMNS
+                hex_x = self._offset_str_len + column * 3 + column // 8
+                decoded_x = (self._offset_str_len + self._bytes_str_len
+                             + len(self.separator) + column)
+                if shift < len(self.data):
+                    self.stdscr.addstr(y, hex_x, f'{self.data[shift]:02x}',
+                                       curses.color_pair(5))
+                    self.stdscr.addstr(y, decoded_x, self._decoded[shift],
+                                       curses.color_pair(5))
+                if self._is_diff_pane_shown() \
+                        and shift < len(self._other_data):
+                    value = self._other_data[shift]
+                    self.stdscr.addstr(y, pane_x + hex_x, f'{value:02x}',
+                                       curses.color_pair(5))
+                    self.stdscr.addstr(y, pane_x + decoded_x,
+                                       chr(PRINTABLE_TABLE[value]),
+                                       curses.color_pair(5))
+
     def draw_bottom_bar(self) -> None:
         self.stdscr.attron(curses.color_pair(3))
         self.stdscr.addstr(self.height - 1, 0, self.bottom_bar)
@@ -260,7 +498,7 @@ class HexEditorUI:
 
     def handle_copy(self) -> None:
         start, end = min(self.selected), max(self.selected)
-        self.clipboard = self.editor.get_nbytes(start, end - start + 1)
+        self.clipboard = self.editor.read(start, end - start + 1)
         self.clear_selected()
         logging.log(msg=f'clipboard: {self.clipboard}', level=logging.DEBUG)
 
@@ -268,14 +506,16 @@ class HexEditorUI:
         if self.clipboard == b'':
             return
         self.editor.insert(self._get_cursor_offset(), self.clipboard)
+        self.mark_dirty_from(self._get_cursor_offset())
 
     def handle_cut(self) -> None:
         if self.selected[0] is None:
             return
         start, end = min(self.selected), max(self.selected)
-        self.clipboard = self.editor.get_nbytes(start, end - start + 1)
+        self.clipboard = self.editor.read(start, end - start + 1)
         self.clear_selected()
         self.editor.remove(start, end - start + 1)
+        self.mark_dirty_from(start)
 
     def handle_select(self) -> None:
         if self.selected[0] is None:
@@ -306,6 +546,10 @@ class HexEditorUI:
             self._increment_offset(16)
 
     def handle_save(self) -> None:
+        if self._search is not None:
+            # поиск читает исходный файл, который может быть перезаписан
+            self._search.cancel()
+            self._stop_search()
         self.bottom_bar = self.filename
         self.draw_bottom_bar()
         filename = list(self.filename)
@@ -389,9 +633,11 @@ class HexEditorUI:
 
     def handle_delete(self) -> None:
         self.editor.remove(self._get_cursor_offset(), 1)
+        self.mark_dirty_from(self._get_cursor_offset())
 
     def handle_backspace(self) -> None:
         self.editor.remove(max(self._get_cursor_offset() - 1, 0), 1)
+        self.mark_dirty_from(max(self._get_cursor_offset() - 1, 0))
         self.key = curses.KEY_LEFT
         self.handle_cursor()
 
@@ -487,14 +733,14 @@ class HexEditorUI:
                 user_input.append(chr(symbol))
                 self.editor.insert(self._get_cursor_offset(),
                                    str_to_bytes(''.join(user_input)))
-                self.stdscr.clear()
+                self.mark_dirty_from(self._get_cursor_offset())
                 self.draw()
             else:
                 del user_input[-2]
                 user_input.append(chr(symbol))
                 self.editor.replace(self._get_cursor_offset(),
                                     str_to_bytes(''.join(user_input)))
-                self.stdscr.clear()
+                self._dirty_rows.add(self.cursor_y - 2)
                 self.draw()
                 user_input = []  #
         if self.key == ord('v'):
@@ -514,7 +760,7 @@ class HexEditorUI:
                 self.handle_delete()
                 break
             self.editor.insert(self._get_cursor_offset(), chr(symbol).encode('utf-8'))
-            self.stdscr.clear()
+            self.mark_dirty_from(self._get_cursor_offset())
             self.draw()
         if self.key == ord('v'):
             self.current_mode = VIEW_MODE
@@ -522,10 +768,24 @@ class HexEditorUI:
             self.handle_cursor()
 
     def handle_help(self) -> None:
+        self._show_screen(help_menu.split('\n'))
+
+    def handle_stats(self) -> None:
+        """Показывает статистику движка. Подсчет чтений и времени работы
+        включается при первом открытии, если не был включен флагом
+        --stats"""
+        if self.editor.stats is None:
+            self.editor.enable_stats()
+        lines = ['engine statistics'] \
+            + format_stats(self.editor.statistics())
+        self._show_screen(lines[:self.height - 3])
+
+    def _show_screen(self, lines: list) -> None:
+        """Показывает строки lines поверх байт до следующего нажатия"""
         self._is_in_help = True
-        lines = help_menu.split('\n')
         self.stdscr.attron(curses.color_pair(1))
         for i, line in enumerate(lines):
+            line = line[:self.width - 1]
             self.stdscr.addstr(2 + i, 0,
                                line + ' ' * (self._total_line_len - len(line)))
         for i in range(len(lines) + 2, self.height - 1):
@@ -549,44 +809,221 @@ class HexEditorUI:
         self._move_cursor_to_offset(offset)
 
     def handle_search(self) -> None:
+        """Поиск по шестнадцатеричной строке, в которой '??' обозначает
+        любой байт, например 4d 5a ?? ?? 50 45"""
+        query = self._read_query('search (h): ', is_correct_pattern_symbol)
+        if query is None:
+            return
+        try:
+            pattern = parse_masked(query)
+        except ValueError as error:
+            self._bottom_bar_draw_queue.append(f'bad pattern: {error}')
+            return
+        logging.log(msg=f'trying to find {pattern}', level=logging.DEBUG)
+        if all(pattern.mask):
+            background_search = self.editor.start_search(pattern.values)
+        else:
+            background_search = self.editor.start_pattern_search(pattern)
+        self._start_background_search(background_search,
+                                      self._show_search_result)
+
+    def handle_regex_search(self) -> None:
+        query = self._read_query('regex: ', is_printable_symbol)
+        if query is None:
+            return
+        try:
+            pattern = compile_regex(query)
+        except (re.error, UnicodeEncodeError) as error:
+            self._bottom_bar_draw_queue.append(f'bad regex: {error}')
+            return
+        logging.log(msg=f'trying to find {pattern}', level=logging.DEBUG)
+        self._start_background_search(
+            self.editor.start_pattern_search(pattern),
+            self._show_search_result)
+
+    def _read_query(self, prompt: str, filter) -> str:
+        """Считывает строку в нижней панели. Возвращает None, если ввод
+        был прерван нажатием ESCAPE"""
         user_input = []
-        self.bottom_bar = 'search (h): '
+        self.bottom_bar = prompt
         self.draw_bottom_bar()
-        stop_keys = {ENTER_KEY, ESCAPE_KEY}
-        counter = itertools.count()
         for symbol in self.get_user_input(
-                filter=is_correct_hex_symbol_or_backspace, stop_keys=stop_keys):
-            if symbol == BACKSPACE_KEY and not user_input:
-                continue
-            if next(counter) % 2 - 1:
-                if symbol == BACKSPACE_KEY and len(user_input) >= 2:
-                    user_input[-1] = user_input[-2]
-                    user_input[-2] = '0'
-                elif symbol != BACKSPACE_KEY:
-                    user_input.append('0')
-                    user_input.append(chr(symbol))
+                filter=lambda key: filter(key) or key == BACKSPACE_KEY,
+                stop_keys={ENTER_KEY, ESCAPE_KEY}):
+            if symbol == BACKSPACE_KEY:
+                if user_input:
+                    user_input.pop()
             else:
-                if symbol == BACKSPACE_KEY and len(user_input) >= 2:
-                    del user_input[-2:]
-                elif symbol != BACKSPACE_KEY:
-                    del user_input[-2]
-                    user_input.append(chr(symbol))
-            self.bottom_bar = f'search (h): {"".join(user_input)}'
+                user_input.append(chr(symbol))
+            self.bottom_bar = f'{prompt}{"".join(user_input)}'
             self.draw_bottom_bar()
         if self.key == ESCAPE_KEY:
+            return None
+
+        return ''.join(user_input)
+
+    def handle_signature_scan(self) -> None:
+        self._start_background_search(self.editor.start_signature_scan(),
+                                      self._show_signature_hits)
+
+    def handle_next_signature(self) -> None:
+        if not self.signature_hits:
+            self._bottom_bar_draw_queue.append('no signatures found, '
+                                               'press m to scan')
+            return
+        offset = self._get_cursor_offset()
+        if self.key == ord('n'):
+            index = self.signature_hits.next_after(offset)
+        else:
+            index = self.signature_hits.prev_before(offset)
+        if index == -1:
+            self._bottom_bar_draw_queue.append('no more signatures')
+            return
+        self._show_signature(index)
+
+    def handle_compare(self) -> None:
+        """Сравнивает в фоне текущее состояние файла с файлом diff_file
+        или, если он не задан, с сохраненным на диске"""
+        self._start_background_search(
+            self.editor.start_compare(self.diff_file),
+            self._show_diff_ranges)
+
+    def handle_checksums(self) -> None:
+        """Считает в фоне crc32, md5 и sha256 выделенных байт или всего
+        файла, если ничего не выделено"""
+        if self.selected[0] is None:
+            start, end = 0, self.editor.file_size
+        else:
+            start, end = min(self.selected), max(self.selected) + 1
+        self._start_background_search(
+            self.editor.start_checksums(start, end), self._show_checksums)
+
+    def handle_next_difference(self) -> None:
+        if not self.diff_ranges:
+            self._bottom_bar_draw_queue.append('no differences found, '
+                                               'press d to compare')
+            return
+        offset = self._get_cursor_offset()
+        if self.key == ord('>'):
+            index = self.diff_ranges.next_after(offset)
+        else:
+            index = self.diff_ranges.prev_before(offset)
+        if index == -1:
+            self._bottom_bar_draw_queue.append('no more differences')
+            return
+        self._show_difference(index)
+
+    def handle_background_search(self) -> None:
+        """Показывает прогресс фонового поиска, отменяет его по нажатию 'x'
+        и обрабатывает результат, когда поиск закончится"""
+        if self.key == ord('x'):
+            self._search.cancel()
+            self._stop_search()
+            self._bottom_bar_draw_queue.append('search cancelled')
+            self.key = NO_KEY
+            return
+        if not self._search.done:
+            self._bottom_bar_draw_queue.append(self._search_progress())
             return
 
-        query = ''.join(user_input)
-        logging.log(msg=f'trying to find {str_to_bytes(query)}',
-                    level=logging.DEBUG)
-        if (offset := self.editor.search(str_to_bytes(query))) == -1:
+        background_search = self._search
+        on_search_done = self._on_search_done
+        self._stop_search()
+        if background_search.error is not None:
+            logging.exception(background_search.error)
+            self._bottom_bar_draw_queue.append(
+                f'search failed: {background_search.error}')
+            return
+        on_search_done(background_search)
+
+    def _start_background_search(self, background_search,
+                                 on_search_done) -> None:
+        if self._search is not None:
+            self._search.cancel()
+        self._search = background_search
+        self._on_search_done = on_search_done
+        self.stdscr.timeout(SEARCH_POLL_INTERVAL)
+        self._bottom_bar_draw_queue.append(self._search_progress())
+
+    def _show_search_result(self, background_search) -> None:
+        offset = background_search.result
+        query = background_search.query
+        if offset == -1:
             logging.log(msg=f'query {query} not found', level=logging.DEBUG)
             self._bottom_bar_draw_queue.append('not found')
             return
         logging.log(msg=f'found at offset {offset}', level=logging.DEBUG)
+        self.clear_selected()
+        self._jump_to_offset(offset)
+
+    def _show_signature_hits(self, background_search) -> None:
+        self.signature_hits = background_search.result
+        if not self.signature_hits:
+            self._bottom_bar_draw_queue.append('no signatures found')
+            return
+        self._show_signature(0)
+
+    def _show_signature(self, index: int) -> None:
+        offset, name = self.signature_hits[index]
+        self._jump_to_offset(offset)
+        self._bottom_bar_draw_queue.append(
+            f'{name} at {offset:x} ({index + 1}/{len(self.signature_hits)})'
+            f' | n(N) for next(previous)')
+
+    def _show_checksums(self, background_checksums) -> None:
+        start, end = background_checksums.start_offset, \
+            background_checksums.end
+        self._screen_lines = [f'checksums of {start:x}-{end:x} '
+                              f'({end - start} bytes)'] \
+            + [f'{name}: {value}'
+               for name, value in background_checksums.result.items()]
+
+    def _show_diff_ranges(self, background_compare) -> None:
+        if self._other_fp is not None:
+            self._other_fp.close()
+        self._other_fp = open(background_compare.other_filename, 'rb')
+        self.diff_ranges = background_compare.result
+        self.mark_all_dirty()
+        if not self.diff_ranges:
+            self._bottom_bar_draw_queue.append('files are equal')
+            return
+        self._show_difference(0)
+
+    def _show_difference(self, index: int) -> None:
+        start, end = self.diff_ranges[index]
+        self._jump_to_offset(start)
+        count = min(end - start, COLUMNS)
+        other = os.pread(self._other_fp.fileno(), count, start)
+        self._bottom_bar_draw_queue.append(
+            f'diff {index + 1}/{len(self.diff_ranges)}: {start:x}-{end:x} '
+            f'({end - start} bytes), other: {other.hex(" ")}'
+            f' | >(<) for next(previous)')
+
+    def _is_diff_pane_shown(self) -> bool:
+        """Байты файла из сравнения показываются справа, если терминал
+        достаточно широкий"""
+        return (self._other_fp is not None
+                and self.width > self._diff_pane_x() + self._bytes_str_len
+                + self._decoded_bytes_str_len)
+
+    def _diff_pane_x(self) -> int:
+        return self._total_line_len + len(self.separator)
+
+    def _jump_to_offset(self, offset: int) -> None:
         self.current_offset = offset - offset % COLUMNS
         self._move_cursor_to_offset(offset)
 
+    def _search_progress(self) -> str:
+        scanned = self._search.scanned / 1024 / 1024
+        throughput = self._search.throughput / 1024 / 1024
+        return f'searching: {scanned:.1f} MiB scanned, ' \
+               f'{throughput:.1f} MiB/s | x for cancel'
+
+    def _stop_search(self) -> None:
+        self._search = None
+        self._on_search_done = None
+        self.stdscr.timeout(-1)
+
     def clear_selected(self) -> None:
         if self.selected[0] is None:
             return
@@ -603,8 +1040,14 @@ class HexEditorUI:
         """Считывает пользовательский ввод до нажатия stop_keys(по
            умолчанию ENTER). Если передан предикат filter, то считывает
            только символы, удовлетворяющие ему"""
-        while (key := self.stdscr.getch()) not in stop_keys:
-            if filter(key):
+        while True:
+            key = self.stdscr.getch()
+            if key != NO_KEY:
+                # каждое нажатие начинает новый кадр для замера задержки
+                self.tracer.start(key)
+            if key in stop_keys:
+                break
+            if key != NO_KEY and filter(key):
                 yield key
         self.key = key
 
@@ -614,10 +1057,53 @@ def main():
     parser.add_argument('filename', nargs='?', help='name of the file to edit')
     parser.add_argument('-r', '--read-only', action='store_true',
                         help='opens file in readonly mode if passed')
+    parser.add_argument('-m', '--mmap', action='store_true',
+                        help='maps file into memory instead of reading it')
+    parser.add_argument('-c', '--cache-size', type=int,
+                        default=DEFAULT_CACHE_SIZE // 1024 // 1024,
+                        help='size of the read cache in megabytes')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes used for search and compare')
+    parser.add_argument('-e', '--edit-memory', type=int,
+                        default=DEFAULT_MAX_MEMORY // 1024 // 1024,
+                        help='memory for unsaved changes in megabytes, '
+                             'the rest goes to a temporary file')
+    parser.add_argument('-p', '--prefetch', type=int,
+                        default=DEFAULT_PREFETCH_SCREENS,
+                        help='number of screens read ahead while scrolling, '
+                             '0 disables read-ahead')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='write time spent on every key press to FILE, '
+                             'one JSON object per line')
+    parser.add_argument('--diff', metavar='FILE',
+                        help="compare with FILE on 'd' instead of the saved "
+                             'file and show its bytes side by side')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='collect engine statistics and write them '
+                             'to FILE as JSON on exit')
     args = parser.parse_args(sys.argv[1:])
     logging.log(msg=f'readonly {args.read_only}', level=logging.DEBUG)
-    app = HexEditorUI(filename=args.filename, is_readonly=args.read_only)
-    curses.wrapper(app.main)
+    trace_file = open(args.trace, 'w') if args.trace else None
+    app = HexEditorUI(filename=args.filename, is_readonly=args.read_only,
+                      use_mmap=args.mmap,
+                      cache_size=args.cache_size * 1024 * 1024,
+                      search_workers=args.jobs,
+                      edit_memory=args.edit_memory * 1024 * 1024,
+                      prefetch_screens=args.prefetch,
+                      trace_file=trace_file, diff_file=args.diff)
+    if args.stats:
+        app.editor.enable_stats()
+    try:
+        curses.wrapper(app.main)
+    finally:
+        if trace_file is not None:
+            trace_file.close()
+    logging.log(msg=f'key latency {app.tracer.snapshot()}',
+                level=logging.DEBUG)
+    if args.stats:
+        app.editor.log_stats(level=logging.DEBUG)
+        with open(args.stats, 'w') as fp:
+            app.editor.dump_stats(fp)
 
 
 if __name__ == '__main__':